@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# Parser throughput on generated subtitle files.
+#
+#   python benchmarks/bench_parser.py --files 200 --cues 1500
+import io
+import sys
+import time
+import argparse
+
+from corpus import generate_srt
+from srttranslate.subtitles import SubtitleFile
+
+
+def bench(contents, rounds):
+    nbytes = sum(len(c.encode()) for c in contents)
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for content in contents:
+            SubtitleFile().read(io.StringIO(content)).count_content_chars()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(contents) / best, nbytes / best / 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Subtitle parser throughput")
+    parser.add_argument("--files", type=int, default=100, help="files per round")
+    parser.add_argument("--cues", type=int, default=1500, help="subtitles per file")
+    parser.add_argument("--rounds", type=int, default=3, help="best of N rounds")
+    opts = parser.parse_args(argv)
+
+    contents = [generate_srt(opts.cues, seed) for seed in range(opts.files)]
+    files_sec, mb_sec = bench(contents, opts.rounds)
+    print(
+        f"{opts.files} files of {opts.cues} subtitles: "
+        f"{files_sec:.1f} files/s, {mb_sec:.2f} MB/s"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# Parse -> translate -> write throughput against a local fake DeepL server.
+#
+#   python benchmarks/bench_pipeline.py --sizes 100 1000 5000 --latency 0.05
+#
+# The server runs in a subprocess, so the peak RSS reported is that of the
+# pipeline alone (it is the peak of the whole run, not of each size).
+import sys
+import json
+import time
+import pathlib
+import resource
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+
+from corpus import generate_srt
+from srttranslate.deeplhandler import DeeplHandler
+from srttranslate.translator import SrtTranslator, DEFAULT_BATCH_SIZE
+
+
+def start_server(opts):
+    cmd = [
+        sys.executable,
+        str(pathlib.Path(__file__).with_name("fake_deepl.py")),
+        "--port=0",
+        f"--latency={opts.latency}",
+        f"--jitter={opts.jitter}",
+        f"--error-rate={opts.error_rate}",
+        f"--throttle-rate={opts.throttle_rate}",
+        "--seed=1",
+    ]
+    if opts.max_request_chars:
+        cmd.append(f"--max-request-chars={opts.max_request_chars}")
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    return proc, proc.stdout.readline().strip()
+
+
+def server_stats(url):
+    with urllib.request.urlopen(f"{url}/stats") as rsp:
+        return json.load(rsp)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class TimedTranslator:
+    # Wraps deepl.Translator, recording the latency of every request
+    def __init__(self, transl):
+        self.transl = transl
+        self.latencies = []
+
+    def translate_text(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.transl.translate_text(*args, **kwargs)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+
+def run(url, path, ncues, opts):
+    path.write_text(generate_srt(ncues, seed=ncues))
+    handler = DeeplHandler("fake-key", server_url=url)
+    handler.transl = timed = TimedTranslator(handler.transl)
+    before = server_stats(url)
+
+    start = time.perf_counter()
+    transl = SrtTranslator(
+        handler,
+        batch_size=opts.batch_size,
+        workers=opts.workers,
+        merge_sentences=opts.merge_sentences,
+    )
+    transl.add_input_file(path).translate("DE").write("DE", path.with_suffix(".de.srt"))
+    elapsed = time.perf_counter() - start
+
+    after = server_stats(url)
+    requests = after["translate_requests"] - before["translate_requests"]
+    return dict(
+        cues=ncues,
+        seconds=elapsed,
+        cues_sec=ncues / elapsed,
+        requests=requests,
+        characters=after["characters"] - before["characters"],
+        retries=handler.scheduler.retries,
+        p50=percentile(timed.latencies, 50) * 1000,
+        p95=percentile(timed.latencies, 95) * 1000,
+        p99=percentile(timed.latencies, 99) * 1000,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Translation pipeline benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--max-request-chars", type=int)
+    parser.add_argument("--merge-sentences", action="store_true")
+    opts = parser.parse_args(argv)
+
+    proc, url = start_server(opts)
+    try:
+        print(
+            f"{'cues':>7} {'seconds':>8} {'cues/s':>9} {'requests':>8} {'chars':>9} "
+            f"{'retries':>7} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7}"
+        )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for ncues in opts.sizes:
+                path = pathlib.Path(tmpdir) / f"bench{ncues}.srt"
+                r = run(url, path, ncues, opts)
+                print(
+                    f"{r['cues']:7} {r['seconds']:8.2f} {r['cues_sec']:9.1f} "
+                    f"{r['requests']:8} {r['characters']:9} {r['retries']:7} {r['p50']:7.1f} "
+                    f"{r['p95']:7.1f} {r['p99']:7.1f}"
+                )
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"Peak RSS {peak_rss / 1024:.1f} MiB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
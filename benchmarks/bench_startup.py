@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# Command line startup time: the wall time of srttranslate --version and
+# --help against a bare interpreter, and the slowest imports reported by
+# python -X importtime. --record appends the results to a JSON lines file
+# to follow them over time.
+#
+#   python benchmarks/bench_startup.py --runs 20 --record startup.jsonl
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMMANDS = {
+    "python": ["-c", "pass"],
+    "--version": ["-m", "srttranslate.main", "--version"],
+    "--help": ["-m", "srttranslate.main", "--help"],
+}
+
+
+def environment():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [TOP_DIR, env.get("PYTHONPATH")]))
+    return env
+
+
+def wall_time(args, runs):
+    # Best of runs, in seconds
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable] + args,
+            env=environment(),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def import_times(module):
+    # Returns a dict module -> cumulative import time in microseconds
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=environment(),
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        try:
+            times[name.strip()] = int(cumulative)
+        except ValueError:
+            # The header line
+            continue
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Command line startup time")
+    parser.add_argument("--runs", type=int, default=10, help="best of N runs")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports shown")
+    parser.add_argument("--record", metavar="FILE", help="append results to FILE")
+    opts = parser.parse_args(argv)
+
+    walls = {name: wall_time(args, opts.runs) for name, args in COMMANDS.items()}
+    for name, secs in walls.items():
+        print(f"{name:>10} {secs * 1000:7.1f} ms")
+
+    times = import_times("srttranslate.main")
+    total = times.get("srttranslate.main", 0)
+    print(f"\nimport srttranslate.main {total / 1000:.1f} ms, slowest imports:")
+    slowest = sorted(times.items(), key=lambda item: item[1], reverse=True)
+    for name, usecs in slowest[: opts.top]:
+        print(f"{usecs / 1000:9.1f} ms  {name}")
+
+    if opts.record:
+        with open(opts.record, "a") as fd:
+            record = dict(
+                time=time.time(),
+                python=sys.version.split()[0],
+                wall_ms={name: secs * 1000 for name, secs in walls.items()},
+                import_ms=total / 1000,
+                modules=[name for name in times if not name.startswith("_")],
+            )
+            print(json.dumps(record), file=fd)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
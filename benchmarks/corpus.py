@@ -0,0 +1,42 @@
+import random
+
+WORDS = (
+    "the of and to a in is you that it he was for on are as with his they "
+    "at be this have from or one had by word but not what all were we when "
+    "your can said there use an each which she do how their if will up "
+    "other about out many then them these so some her would make like him "
+    "into time has look two more write go see number no way could people"
+).split()
+
+
+def generate_srt(ncues, seed=0, repeat=0.2):
+    # An srt file with ncues subtitles of one or two lines. A fraction
+    # repeat of the subtitles repeat an earlier text, as real files do.
+    rnd = random.Random(seed)
+    parts = []
+    texts = []
+    start = 0
+    for i in range(1, ncues + 1):
+        start += rnd.randint(500, 4000)
+        end = start + rnd.randint(800, 5000)
+        if texts and rnd.random() < repeat:
+            text = rnd.choice(texts)
+        else:
+            nlines = rnd.choice((1, 1, 2))
+            text = "\n".join(
+                " ".join(
+                    rnd.choice(WORDS) for _ in range(rnd.randint(2, 8))
+                ).capitalize()
+                for _ in range(nlines)
+            )
+            texts.append(text)
+        parts.append(f"{i}\n{timestamp(start)} --> {timestamp(end)}\n{text}\n\n")
+        start = end
+    return "".join(parts)
+
+
+def timestamp(ms):
+    second, ms = divmod(ms, 1000)
+    minute, second = divmod(second, 60)
+    hour, minute = divmod(minute, 60)
+    return f"{hour:02}:{minute:02}:{second:02},{ms:03}"
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# A local stand-in for the DeepL API, for benchmarks and for trying the
+# command line without spending quota:
+#
+#   python benchmarks/fake_deepl.py --port 8000 --latency 0.05 --throttle-rate 0.02
+#   srttranslate --server-url http://127.0.0.1:8000 -k anykey film.srt
+#
+# Translation is rot13, leaving markup alone with tag_handling=xml. Latency,
+# jitter, server errors, 429 responses and a per-request character limit can
+# be configured. GET /stats returns the request counters as JSON.
+#
+# Documents uploaded to /v2/document are translated the same way, leaving
+# the markup alone. They stay "translating" for --document-time seconds, are
+# billed at least 50000 characters like DeepL does, and can be downloaded
+# once.
+import re
+import sys
+import json
+import time
+import email
+import codecs
+import random
+import secrets
+import argparse
+import threading
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+MARKUP_RE = re.compile(r"(<[^>]*>|&\w+;)")
+
+
+def rot13(txt, tag_handling=None):
+    if tag_handling != "xml":
+        return codecs.encode(txt, "rot13")
+    return "".join(
+        part if MARKUP_RE.fullmatch(part) else codecs.encode(part, "rot13")
+        for part in MARKUP_RE.split(txt)
+    )
+
+
+class FakeDeepLServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address=("127.0.0.1", 0),
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        throttle_rate=0.0,
+        max_request_chars=None,
+        character_limit=500_000_000,
+        document_time=0.0,
+        document_min_chars=50_000,
+        seed=None,
+    ):
+        super().__init__(address, FakeDeepLHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.max_request_chars = max_request_chars
+        self.character_limit = character_limit
+        self.document_time = document_time
+        self.document_min_chars = document_min_chars
+        # document id -> dict(key, ready, result, billed)
+        self.documents = {}
+        self.rnd = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = dict(
+            requests=0,
+            translate_requests=0,
+            document_requests=0,
+            characters=0,
+            errors=0,
+            throttled=0,
+        )
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, **increments):
+        with self.lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+    def random(self):
+        with self.lock:
+            return self.rnd.random()
+
+    def delay(self):
+        with self.lock:
+            delay = self.latency + self.rnd.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class FakeDeepLHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body=None, headers=()):
+        data = json.dumps(body if body is not None else {}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        data = self.rfile.read(length)
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("multipart/form-data"):
+            # Fields as text, files as bytes
+            msg = email.message_from_bytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + data
+            )
+            body = {}
+            for part in msg.get_payload():
+                name = part.get_param("name", header="content-disposition")
+                value = part.get_payload(decode=True)
+                body[name] = value if part.get_filename() else value.decode()
+            return body
+        data = data.decode()
+        if content_type.startswith("application/json"):
+            return json.loads(data or "{}")
+        return {k: v if len(v) > 1 else v[0] for k, v in parse_qs(data).items()}
+
+    def document(self, path, body):
+        server = self.server
+        server.count(requests=1)
+        if path == "/v2/document":
+            server.count(document_requests=1)
+            source = body["file"].decode()
+            nchars = len(MARKUP_RE.sub("", source))
+            billed = max(nchars, server.document_min_chars)
+            server.count(characters=billed)
+            doc_id = secrets.token_hex(16).upper()
+            with server.lock:
+                server.documents[doc_id] = dict(
+                    key=secrets.token_hex(32).upper(),
+                    ready=time.monotonic() + server.document_time,
+                    result=rot13(source, "xml").encode(),
+                    billed=billed,
+                )
+                doc = server.documents[doc_id]
+            return self.reply(200, dict(document_id=doc_id, document_key=doc["key"]))
+
+        m = re.fullmatch(r"/v2/document/(\w+)(/result)?", path)
+        with server.lock:
+            doc = server.documents.get(m.group(1)) if m else None
+        if doc is None or body.get("document_key") != doc["key"]:
+            return self.reply(404, {"message": "Document not found"})
+        done = time.monotonic() >= doc["ready"]
+        if not m.group(2):
+            status = dict(document_id=m.group(1), status="translating")
+            if done:
+                status.update(status="done", billed_characters=doc["billed"])
+            return self.reply(200, status)
+        if not done:
+            return self.reply(503, {"message": "Document not ready"})
+        with server.lock:
+            del server.documents[m.group(1)]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(doc["result"])))
+        self.end_headers()
+        self.wfile.write(doc["result"])
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.split("?")[0]
+        if path == "/v2/usage":
+            server.count(requests=1)
+            self.reply(
+                200,
+                {
+                    "character_count": server.stats["characters"],
+                    "character_limit": server.character_limit,
+                },
+            )
+        elif path == "/stats":
+            self.reply(200, server.stats)
+        else:
+            self.reply(404, {"message": "Not found"})
+
+    def do_POST(self):
+        server = self.server
+        path = self.path.split("?")[0]
+        body = self.read_body()
+        if path == "/v2/usage":
+            return self.do_GET()
+        if path.startswith("/v2/document"):
+            return self.document(path, body)
+        if path != "/v2/translate":
+            return self.reply(404, {"message": "Not found"})
+
+        server.count(requests=1, translate_requests=1)
+        server.delay()
+        if server.random() < server.throttle_rate:
+            server.count(throttled=1)
+            return self.reply(
+                429, {"message": "Too many requests"}, [("Retry-After", "1")]
+            )
+        if server.random() < server.error_rate:
+            server.count(errors=1)
+            return self.reply(503, {"message": "Service unavailable"})
+
+        texts = body.get("text", [])
+        if isinstance(texts, str):
+            texts = [texts]
+        nchars = sum(len(txt) for txt in texts)
+        if server.max_request_chars and nchars > server.max_request_chars:
+            server.count(errors=1)
+            return self.reply(413, {"message": "Request too large"})
+
+        server.count(characters=nchars)
+        self.reply(
+            200,
+            {
+                "translations": [
+                    {
+                        "detected_source_language": body.get("source_lang") or "EN",
+                        "text": rot13(txt, body.get("tag_handling")),
+                        "billed_characters": len(txt),
+                    }
+                    for txt in texts
+                ]
+            },
+        )
+
+
+def start_server(**kwargs):
+    # Runs a server in a background thread, returns it
+    server = FakeDeepLServer(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the DeepL API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--max-request-chars", type=int)
+    parser.add_argument(
+        "--document-time", type=float, default=0.0, help="seconds per document"
+    )
+    parser.add_argument("--seed", type=int)
+    opts = parser.parse_args(argv)
+
+    server = FakeDeepLServer(
+        (opts.host, opts.port),
+        latency=opts.latency,
+        jitter=opts.jitter,
+        error_rate=opts.error_rate,
+        throttle_rate=opts.throttle_rate,
+        max_request_chars=opts.max_request_chars,
+        document_time=opts.document_time,
+        seed=opts.seed,
+    )
+    print(server.url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
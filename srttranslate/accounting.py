@@ -0,0 +1,47 @@
+from .document import DOCUMENT_MIN_CHARS
+
+
+def billable_chars(texts, engine="text"):
+    # Characters DeepL bills for texts sent in one request of engine
+    # ("text" or "document"). Documents are billed a minimum.
+    nchars = sum(len(txt) for txt in texts)
+    if engine == "document":
+        return max(nchars, DOCUMENT_MIN_CHARS)
+    return nchars
+
+
+class Account:
+    # Billable characters and requests of a translation. SrtTranslator
+    # charges it as requests complete, and its plan() charges a fresh one
+    # with the requests it would send, so that a plan and the run it
+    # plans count the same way. With keep_texts, the texts of text
+    # requests are kept by language (plans only), to work out how they
+    # could be packed together with those of other files.
+    def __init__(self, keep_texts=False):
+        self.chars = 0
+        self.requests = 0
+        self.texts = 0
+        self.documents = 0
+        self.sent = {} if keep_texts else None
+
+    def charge(self, engine, texts, lang=None):
+        # Returns the characters billed for the request
+        nchars = billable_chars(texts, engine)
+        self.chars += nchars
+        self.requests += 1
+        self.texts += len(texts)
+        if engine == "document":
+            self.documents += 1
+        elif self.sent is not None:
+            self.sent.setdefault(lang, []).extend(texts)
+        return nchars
+
+    def add(self, other):
+        self.chars += other.chars
+        self.requests += other.requests
+        self.texts += other.texts
+        self.documents += other.documents
+        if self.sent is not None and other.sent is not None:
+            for lang, texts in other.sent.items():
+                self.sent.setdefault(lang, []).extend(texts)
+        return self
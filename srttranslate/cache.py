@@ -0,0 +1,135 @@
+import os
+import time
+import sqlite3
+import pathlib
+import threading
+
+DEFAULT_MAX_ENTRIES = 1_000_000
+DEFAULT_MAX_AGE = 180 * 24 * 3600  # seconds
+CACHE_FILE = "translations.sqlite3"
+
+# SQLite limits the number of host parameters in a statement
+QUERY_CHUNK = 500
+
+
+def default_cache_dir():
+    base = os.getenv("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+    return pathlib.Path(base) / "srttranslate"
+
+
+class TranslationCache:
+    # Persistent translation memory. Translations are keyed by
+    # (source language, target language, text). Entries not used for
+    # max_age seconds are dropped and, beyond max_entries, the least
+    # recently used ones go first.
+    def __init__(
+        self,
+        cache_dir=None,
+        max_entries=DEFAULT_MAX_ENTRIES,
+        max_age=DEFAULT_MAX_AGE,
+        clock=time.time,
+    ):
+        self.cache_dir = pathlib.Path(cache_dir or default_cache_dir())
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.saved_chars = 0
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Translators working on several files at the same time share the cache
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(
+            str(self.cache_dir / CACHE_FILE), check_same_thread=False
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            " from_lang TEXT NOT NULL,"
+            " to_lang TEXT NOT NULL,"
+            " source TEXT NOT NULL,"
+            " translation TEXT NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (from_lang, to_lang, source))"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS translations_last_used"
+            " ON translations (last_used)"
+        )
+        self.db.commit()
+
+    def get_many(self, from_lang, to_lang, texts):
+        # Returns a dict text -> translation for the texts found. Hits,
+        # misses and characters saved count each distinct text once, as
+        # repeated texts would only have been sent once.
+        with self.lock:
+            found = {}
+            unique = list(dict.fromkeys(texts))
+            for n in range(0, len(unique), QUERY_CHUNK):
+                end = n + QUERY_CHUNK
+                chunk = unique[n:end]
+                marks = ",".join("?" * len(chunk))
+                rows = self.db.execute(
+                    "SELECT source, translation FROM translations"
+                    f" WHERE from_lang = ? AND to_lang = ? AND source IN ({marks})",
+                    [from_lang, to_lang, *chunk],
+                )
+                found.update(rows)
+
+            if found:
+                now = self.clock()
+                self.db.executemany(
+                    "UPDATE translations SET last_used = ?"
+                    " WHERE from_lang = ? AND to_lang = ? AND source = ?",
+                    [(now, from_lang, to_lang, txt) for txt in found],
+                )
+                self.db.commit()
+
+            for txt in unique:
+                if txt in found:
+                    self.hits += 1
+                    self.saved_chars += len(txt)
+                else:
+                    self.misses += 1
+            return found
+
+    def put_many(self, from_lang, to_lang, pairs):
+        with self.lock:
+            now = self.clock()
+            self.db.executemany(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?)",
+                [(from_lang, to_lang, src, dst, now) for src, dst in pairs],
+            )
+            self.db.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+
+    def evict(self):
+        with self.lock:
+            self.db.execute(
+                "DELETE FROM translations WHERE last_used < ?",
+                (self.clock() - self.max_age,),
+            )
+            excess = len(self) - self.max_entries
+            if excess > 0:
+                self.db.execute(
+                    "DELETE FROM translations WHERE rowid IN"
+                    " (SELECT rowid FROM translations ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+            self.db.commit()
+            return self
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM translations")
+            self.db.commit()
+            self.db.execute("VACUUM")
+            return self
+
+    def close(self):
+        with self.lock:
+            self.evict()
+            self.db.close()
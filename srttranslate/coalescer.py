@@ -0,0 +1,144 @@
+import itertools
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from .translator import DEFAULT_BATCH_SIZE, DEFAULT_BATCH_CHARS, make_batches
+
+# Seconds a text waits for others to fill its request
+DEFAULT_MAX_WAIT = 0.05
+
+
+class RequestCoalescer:
+    # Sits in front of one handler shared by the translators of many files
+    # and packs the texts they send into requests as full as batch_size and
+    # batch_chars allow, so that the last, partial batch of every file
+    # doesn't travel half empty. A request goes out as soon as it is full,
+    # or when a text has waited max_wait seconds. Each translation is
+    # routed back to the call, and position, of its text. There are no
+    # threads of its own: the callers' threads send the requests.
+    #
+    # Texts of different files share requests. A shared request that fails
+    # is sent again split by call, so that only the file with the text at
+    # fault fails.
+    def __init__(
+        self,
+        handler,
+        batch_size=DEFAULT_BATCH_SIZE,
+        batch_chars=DEFAULT_BATCH_CHARS,
+        max_wait=DEFAULT_MAX_WAIT,
+    ):
+        self.handler = handler
+        self.batch_size = batch_size
+        self.batch_chars = batch_chars
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        # (from, to, tag_handling) -> list of (text, Future, call number)
+        self.pending = {}
+        self.calls = itertools.count()
+        self.requests = 0
+        self.texts = 0
+        # A document is a request of its own
+        if hasattr(handler, "translate_document"):
+            self.translate_document = handler.translate_document
+
+    @property
+    def chars(self):
+        return self.handler.chars
+
+    @property
+    def limit(self):
+        return self.handler.limit
+
+    def check_quota(self, nchars):
+        return self.handler.check_quota(nchars)
+
+    def release_quota(self, nchars):
+        release_quota = getattr(self.handler, "release_quota", None)
+        if release_quota is not None:
+            release_quota(nchars)
+
+    def close(self):
+        close = getattr(self.handler, "close", None)
+        if close is not None:
+            close()
+
+    def translate_batch(self, from_lang, to_lang, texts, tag_handling=None):
+        key = (from_lang, to_lang, tag_handling)
+        with self.lock:
+            call = next(self.calls)
+            futures = [Future() for _ in texts]
+            self.pending.setdefault(key, []).extend(
+                (txt, future, call) for txt, future in zip(texts, futures)
+            )
+            batches = self._take(key, full_only=True)
+        self._send(key, batches)
+
+        for future in futures:
+            while True:
+                try:
+                    future.result(self.max_wait)
+                    break
+                except FutureTimeout:
+                    # Waited long enough, whatever is queued goes
+                    with self.lock:
+                        batches = self._take(key, full_only=False)
+                    self._send(key, batches)
+        return [future.result() for future in futures]
+
+    def _take(self, key, full_only):
+        # Removes from the queue and returns the requests to send, as lists
+        # of (text, future, call number). With full_only, a last request
+        # that could still take more texts is left queued. Called with the
+        # lock held.
+        queued = self.pending.get(key)
+        if not queued:
+            return []
+        texts = [txt for txt, _, _ in queued]
+        batches = [
+            [queued[i] for i in batch]
+            for batch in make_batches(texts, self.batch_size, self.batch_chars)
+        ]
+        if full_only and len(batches[-1]) < self.batch_size:
+            batches.pop()
+        taken = sum(len(batch) for batch in batches)
+        del queued[:taken]
+        return batches
+
+    def _send(self, key, batches):
+        from_lang, to_lang, tag_handling = key
+        kwargs = {"tag_handling": tag_handling} if tag_handling else {}
+        for batch in batches:
+            texts = [txt for txt, _, _ in batch]
+            try:
+                translate_batch = getattr(self.handler, "translate_batch", None)
+                if translate_batch is not None:
+                    results = translate_batch(from_lang, to_lang, texts, **kwargs)
+                else:
+                    results = [
+                        self.handler.translate(from_lang, to_lang, txt, **kwargs)
+                        for txt in texts
+                    ]
+                if len(results) != len(texts):
+                    raise ValueError(
+                        f"Handler returned {len(results)} translations "
+                        f"for a batch of {len(texts)}"
+                    )
+            except Exception as exc:
+                calls = {}
+                for item in batch:
+                    calls.setdefault(item[2], []).append(item)
+                if len(calls) > 1:
+                    self._send(key, list(calls.values()))
+                else:
+                    for _, future, _ in batch:
+                        future.set_exception(exc)
+                continue
+            except BaseException as exc:
+                for _, future, _ in batch:
+                    future.set_exception(exc)
+                raise
+            with self.lock:
+                self.requests += 1
+                self.texts += len(texts)
+            for (_, future, _), translated in zip(batch, results):
+                future.set_result(translated)
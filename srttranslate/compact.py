@@ -0,0 +1,94 @@
+from array import array
+
+from .subtitles import SubtitleFile, SubtitleRecord, SubtitleWriter, ms_format
+
+
+class CompactSubtitleFile:
+    # Array backed alternative to SubtitleFile for keeping many files in
+    # memory. Start and end times are milliseconds in arrays, the texts
+    # (lines joined with newlines) are concatenated in a single string
+    # and text i is buffer[offsets[i]:offsets[i + 1]]. The length of
+    # every text is the difference between consecutive offsets.
+    def __init__(self):
+        self.starts = array("q")
+        self.ends = array("q")
+        self.offsets = array("q", [0])
+        self._buffer = ""
+        self._pending = []
+
+    @property
+    def buffer(self):
+        self._flush()
+        return self._buffer
+
+    def _flush(self):
+        # Texts appended are collected in a list and joined in one go
+        if self._pending:
+            self._buffer += "".join(self._pending)
+            self._pending = []
+
+    def append(self, sub):
+        txt = "\n".join(sub.text or [])
+        self.starts.append(sub.start_ms)
+        self.ends.append(sub.end_ms)
+        self.offsets.append(self.offsets[-1] + len(txt))
+        self._pending.append(txt)
+        return self
+
+    def read(self, fil):
+        for sub in SubtitleFile.iter_records(fil):
+            self.append(sub)
+        self._flush()
+        return self
+
+    @classmethod
+    def from_subtitle_file(cls, sf):
+        compact = cls()
+        for sub in sf:
+            compact.append(sub)
+        compact._flush()
+        return compact
+
+    def to_subtitle_file(self):
+        sf = SubtitleFile()
+        sf.sublst = list(self)
+        return sf
+
+    def __len__(self):
+        return len(self.starts)
+
+    def text(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.buffer[start:end]
+
+    def texts(self):
+        buffer = self.buffer
+        offsets = self.offsets
+        for start, end in zip(offsets, offsets[1:]):
+            yield buffer[start:end]
+
+    def __iter__(self):
+        for start, end, txt in zip(self.starts, self.ends, self.texts()):
+            yield SubtitleRecord(start, end, txt.split("\n") if txt else None)
+
+    def remove_empty_subtitles(self):
+        # Empty texts take no room in the buffer, so only the arrays change
+        offsets = self.offsets
+        keep = [i for i in range(len(self.starts)) if offsets[i + 1] > offsets[i]]
+        self.starts = array("q", (self.starts[i] for i in keep))
+        self.ends = array("q", (self.ends[i] for i in keep))
+        self.offsets = array("q", [0])
+        self.offsets.extend(offsets[i + 1] for i in keep)
+        return self
+
+    def count_content_chars(self):
+        return self.offsets[-1]
+
+    def write(self, fd):
+        with SubtitleWriter(fd) as writer:
+            fd = writer.fd
+            for i, (start, end, txt) in enumerate(
+                zip(self.starts, self.ends, self.texts()), 1
+            ):
+                print(f"{i}\n{ms_format(start)} --> {ms_format(end)}\n{txt}\n", file=fd)
+        return self
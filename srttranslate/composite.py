@@ -0,0 +1,242 @@
+import time
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .metrics import Histogram
+from .accounting import billable_chars
+from .translator import OutOfQuotaError
+
+# Without enough latencies measured, a request is hedged after this long
+DEFAULT_HEDGE_DELAY = 2.0  # seconds
+DEFAULT_HEDGE_PERCENTILE = 95
+MIN_SAMPLES = 20
+
+
+class BackendStats:
+    def __init__(self, name):
+        self.name = name
+        self.latency = Histogram()
+        self.requests = 0
+        self.errors = 0
+        # Requests sent as a hedge, and those that answered first
+        self.hedges = 0
+        self.hedges_won = 0
+        self.out_of_quota = False
+
+    def score(self):
+        # Lower is better: median latency, made worse by errors. Backends
+        # not measured yet score 0 so that they get tried.
+        if not self.latency.count:
+            return 0.0
+        error_rate = self.errors / self.requests if self.requests else 0.0
+        return self.latency.percentile(50) * (1 + 4 * error_rate)
+
+    def snapshot(self):
+        return dict(
+            name=self.name,
+            requests=self.requests,
+            errors=self.errors,
+            hedges=self.hedges,
+            hedges_won=self.hedges_won,
+            out_of_quota=self.out_of_quota,
+            p50=self.latency.percentile(50),
+            p95=self.latency.percentile(95),
+        )
+
+
+class CompositeHandler:
+    # A handler made of several handlers (other API keys, regions, another
+    # service), with the same translate()/check_quota() protocol. Each
+    # request goes to the backend with the best latency and error record.
+    # If it hasn't answered by the hedge_percentile latency of that
+    # backend, the same request goes to the next backend too and the first
+    # answer is taken: one slow response no longer holds up the file, at
+    # the cost of paying for some texts twice. A backend that fails is
+    # replaced by the next one straight away, and one out of quota (its
+    # check_quota() says no, or it raises one of quota_errors) is not used
+    # again. Documents, if every backend translates them, fail over the
+    # same way but are not hedged: each one is billed at least 50000
+    # characters.
+    def __init__(
+        self,
+        handlers,
+        names=None,
+        hedge_percentile=DEFAULT_HEDGE_PERCENTILE,
+        hedge_delay=DEFAULT_HEDGE_DELAY,
+        min_samples=MIN_SAMPLES,
+        quota_errors=(),
+        clock=time.monotonic,
+        threads=None,
+    ):
+        self.handlers = list(handlers)
+        names = names or [f"backend {n}" for n in range(1, len(self.handlers) + 1)]
+        self.stats = [BackendStats(name) for name in names]
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.min_samples = min_samples
+        self.quota_errors = tuple(quota_errors)
+        self.clock = clock
+        self.lock = threading.Lock()
+        # Characters passed by each backend's check_quota() and not sent yet
+        self.reserved = [0] * len(self.handlers)
+        # Hedged requests may outlive the call that started them
+        self.pool = ThreadPoolExecutor(
+            max_workers=threads or 4 * len(self.handlers) + 4
+        )
+        if all(hasattr(handler, "translate_document") for handler in self.handlers):
+            self.translate_document = self._translate_document
+
+    @property
+    def chars(self):
+        return sum(handler.chars for handler in self.handlers)
+
+    @property
+    def limit(self):
+        return sum(handler.limit for handler in self.handlers)
+
+    def check_quota(self, nchars):
+        # True if a backend has nchars of quota left, the best one first
+        for n in self._ranked():
+            if self.handlers[n].check_quota(nchars):
+                with self.lock:
+                    self.reserved[n] += nchars
+                return True
+            with self.lock:
+                self.stats[n].out_of_quota = True
+        return False
+
+    def release_quota(self, nchars):
+        with self.lock:
+            releases = []
+            for n, reserved in enumerate(self.reserved):
+                amount = min(reserved, nchars)
+                if amount:
+                    self.reserved[n] -= amount
+                    nchars -= amount
+                    releases.append((n, amount))
+        for n, amount in releases:
+            release_quota = getattr(self.handlers[n], "release_quota", None)
+            if release_quota is not None:
+                release_quota(amount)
+
+    def translate(self, from_lang, to_lang, txt, **kwargs):
+        return self._request("translate", True, from_lang, to_lang, txt, **kwargs)
+
+    def translate_batch(self, from_lang, to_lang, texts, **kwargs):
+        return self._request(
+            "translate_batch", True, from_lang, to_lang, texts, **kwargs
+        )
+
+    def _translate_document(self, from_lang, to_lang, texts, **kwargs):
+        return self._request(
+            "translate_document", False, from_lang, to_lang, texts, **kwargs
+        )
+
+    def backend_stats(self):
+        return [stats.snapshot() for stats in self.stats]
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+        for handler in self.handlers:
+            close = getattr(handler, "close", None)
+            if close is not None:
+                close()
+
+    def _ranked(self):
+        # Backends with quota, best first
+        with self.lock:
+            usable = [n for n, stats in enumerate(self.stats) if not stats.out_of_quota]
+            return sorted(usable, key=lambda n: self.stats[n].score())
+
+    def _delay(self, n):
+        stats = self.stats[n]
+        with self.lock:
+            if stats.latency.count < self.min_samples:
+                return self.hedge_delay
+            return stats.latency.percentile(self.hedge_percentile)
+
+    def _send(self, n, method, args, kwargs, begun):
+        handler = self.handlers[n]
+        stats = self.stats[n]
+        texts = args[2]
+        if isinstance(texts, str):
+            nchars = len(texts)
+        elif method == "translate_document":
+            nchars = billable_chars(texts, "document")
+        else:
+            nchars = billable_chars(texts)
+        start = self.clock()
+        # The request leaves now, not when it was queued for a thread
+        begun.append(start)
+        try:
+            if method == "translate_batch" and not hasattr(handler, "translate_batch"):
+                from_lang, to_lang, texts = args
+                result = [
+                    handler.translate(from_lang, to_lang, txt, **kwargs)
+                    for txt in texts
+                ]
+            else:
+                result = getattr(handler, method)(*args, **kwargs)
+        except Exception as exc:
+            with self.lock:
+                stats.requests += 1
+                stats.errors += 1
+                if isinstance(exc, self.quota_errors):
+                    stats.out_of_quota = True
+            raise
+        with self.lock:
+            stats.requests += 1
+            stats.latency.observe(self.clock() - start)
+            covered = min(self.reserved[n], nchars)
+            self.reserved[n] -= covered
+        if covered < nchars:
+            # Sent by another backend than the one that passed the quota
+            self.release_quota(nchars - covered)
+        return result
+
+    def _request(self, method, hedging, *args, **kwargs):
+        candidates = self._ranked()
+        if not candidates:
+            raise OutOfQuotaError("No translation backend has quota left")
+        running = {}
+        error = None
+
+        def start(hedge):
+            # Returns the backend and a list that gets the time the request
+            # is actually sent
+            n = candidates.pop(0)
+            if hedge:
+                with self.lock:
+                    self.stats[n].hedges += 1
+            begun = []
+            future = self.pool.submit(self._send, n, method, args, kwargs, begun)
+            running[future] = (n, hedge)
+            return n, begun
+
+        last, begun = start(hedge=False)
+        while running:
+            timeout = None
+            if hedging and candidates:
+                # A request waiting for a thread is not slow yet, it is
+                # looked at again after a full delay
+                delay = self._delay(last)
+                timeout = max(0.0, begun[0] + delay - self.clock()) if begun else delay
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if begun and self.clock() >= begun[0] + self._delay(last):
+                    # Too slow: the next backend gets the same request
+                    last, begun = start(hedge=True)
+                continue
+            for future in done:
+                n, hedge = running.pop(future)
+                if future.exception() is None:
+                    if hedge:
+                        with self.lock:
+                            self.stats[n].hedges_won += 1
+                    # The requests still running finish unheeded
+                    return future.result()
+                error = future.exception()
+            if not running and candidates:
+                # Failed: over to the next backend
+                last, begun = start(hedge=False)
+        raise error
@@ -0,0 +1,468 @@
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import pathlib
+import argparse
+import itertools
+import threading
+import urllib.error
+import urllib.request
+import ipaddress
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .translator import DEFAULT_BATCH_SIZE
+from .document import ENGINES
+from .subtitles import read_text
+from .main import (
+    DEFAULT_JOBS,
+    DEFAULT_LANGUAGE,
+    DEFAULT_OUTPUT_TEMPLATE,
+    DEFAULT_QUOTA_TTL,
+    DEFAULT_WORKERS,
+    find_subtitle_files,
+    get_api_key,
+    make_handler,
+    output_name,
+    progress_report,
+    translate_subtitles,
+)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8417
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_URL = f"http://{DEFAULT_HOST}:{DEFAULT_PORT}"
+FINAL_EVENTS = ("done", "failed")
+
+# srttranslate serve keeps one handler, with its connection to DeepL, its
+# usage and the translation cache, for all the jobs it is sent. Jobs are
+# posted as JSON to /jobs:
+#
+#   {"input": "/path/film.srt", "outputs": {"DE": "/path/film.de.srt"}}
+#   {"source": "1\n00:00:01,000 --> ...", "langs": ["DE"]}
+#
+# and wait in a bounded queue for one of the job workers. The response is a
+# stream of JSON lines, the events of the job: queued, progress, and done
+# (with the translations when the source was posted) or failed. A full queue
+# answers 503. GET /status returns the counters of the server.
+
+
+class Job:
+    ids = itertools.count(1)
+
+    def __init__(self, spec):
+        self.id = next(self.ids)
+        self.spec = spec
+        self.name = f"job {self.id}"
+        self.events = queue.Queue()
+
+    def emit(self, event, **fields):
+        self.events.put(dict(fields, event=event, job=self.id))
+
+
+def all_strings(values):
+    return all(isinstance(value, str) for value in values)
+
+
+def check_spec(spec):
+    # Returns an error message, or None if the job is well formed
+    if not isinstance(spec, dict):
+        return "a job is a JSON object"
+    if "source" in spec:
+        langs = spec.get("langs")
+        if not isinstance(spec["source"], str) or not (
+            isinstance(langs, list) and langs and all_strings(langs)
+        ):
+            return "a job with source needs a list of langs"
+    else:
+        outputs = spec.get("outputs")
+        if not (
+            isinstance(spec.get("input"), str)
+            and isinstance(outputs, dict)
+            and outputs
+            and all_strings(outputs.values())
+        ):
+            return "a job needs an input and its outputs, or a source"
+    return None
+
+
+def is_loopback(host):
+    # The server reads and writes the files its clients name, so it must
+    # not be reachable from other machines
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except socket.gaierror:
+        return False
+    return all(ipaddress.ip_address(addr).is_loopback for addr in addresses)
+
+
+class TranslationServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        handler,
+        address=(DEFAULT_HOST, DEFAULT_PORT),
+        jobs=DEFAULT_JOBS,
+        queue_size=DEFAULT_QUEUE_SIZE,
+        verbose=True,
+        **options,
+    ):
+        # options are passed on to translate_subtitles()
+        super().__init__(address, JobRequestHandler)
+        self.handler = handler
+        self.options = options
+        self.verbose = verbose
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.counters = dict(running=0, done=0, failed=0, chars=0)
+        self.workers = [
+            threading.Thread(target=self.work, daemon=True) for _ in range(jobs)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, **increments):
+        with self.lock:
+            for name, n in increments.items():
+                self.counters[name] += n
+
+    def status(self):
+        with self.lock:
+            return dict(self.counters, queued=self.queue.qsize())
+
+    def submit(self, spec):
+        # Returns the job, or None if the queue is full
+        job = Job(spec)
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            return None
+        job.emit("queued", position=self.queue.qsize())
+        return job
+
+    def work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            self.count(running=1)
+            try:
+                self.run(job)
+            except Exception as exc:
+                # A failed job must not take the worker down with it
+                self.count(failed=1)
+                self.log(f"Failed {job.name}: {exc}")
+                job.emit("failed", error=str(exc) or exc.__class__.__name__)
+            finally:
+                self.count(running=-1)
+
+    def run(self, job):
+        spec = job.spec
+        options = dict(self.options)
+
+        def progressfn(maxchars, chars_to_now):
+            job.emit("progress", total=maxchars, done=chars_to_now)
+
+        if "source" in spec:
+            subfile = StringIO(spec["source"])
+            outfiles = {lang: StringIO() for lang in spec["langs"]}
+            # The journal is kept per input file
+            options["journal_dir"] = None
+        else:
+            subfile = pathlib.Path(spec["input"])
+            outfiles = {
+                lang: pathlib.Path(path) for lang, path in spec["outputs"].items()
+            }
+            job.name = str(subfile)
+
+        nchars = translate_subtitles(
+            subfile,
+            outfiles,
+            self.handler,
+            verbose=False,
+            progressfn=progressfn,
+            **options,
+        )
+        result = dict(chars=nchars)
+        if "source" in spec:
+            result["translations"] = {
+                lang: fd.getvalue() for lang, fd in outfiles.items()
+            }
+        else:
+            result["outputs"] = spec["outputs"]
+        self.count(done=1, chars=nchars)
+        self.log(f"Translated {job.name} ({nchars} characters)")
+        job.emit("done", **result)
+
+    def log(self, msg):
+        if self.verbose:
+            print(msg, flush=True)
+
+    def stop(self):
+        # The jobs already queued are finished first
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.server_close()
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != "/status":
+            return self.reply(404, {"error": "Not found"})
+        self.reply(200, self.server.status())
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            return self.reply(404, {"error": "Not found"})
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            spec = json.loads(self.rfile.read(length).decode() or "null")
+        except ValueError:
+            return self.reply(400, {"error": "Invalid JSON"})
+        error = check_spec(spec)
+        if error:
+            return self.reply(400, {"error": error})
+
+        job = self.server.submit(spec)
+        if job is None:
+            return self.reply(503, {"error": "Job queue full"})
+
+        # HTTP/1.0: the end of the stream is the end of the connection
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        connected = True
+        while True:
+            event = job.events.get()
+            if connected:
+                try:
+                    self.wfile.write(json.dumps(event).encode() + b"\n")
+                    self.wfile.flush()
+                except OSError:
+                    # The client went away, the job goes on
+                    connected = False
+            if event["event"] in FINAL_EVENTS:
+                return
+
+
+def submit_job(url, spec, on_event=lambda event: None, retry_wait=1.0):
+    # Posts a job to the server at url and returns its final event, calling
+    # on_event with every event on the way. Waits while the queue is full.
+    data = json.dumps(spec).encode()
+    while True:
+        request = urllib.request.Request(
+            f"{url}/jobs", data, {"Content-Type": "application/json"}
+        )
+        try:
+            with urllib.request.urlopen(request) as rsp:
+                for line in rsp:
+                    event = json.loads(line)
+                    on_event(event)
+                    if event["event"] in FINAL_EVENTS:
+                        return event
+            return dict(event="failed", error="Connection closed by the server")
+        except urllib.error.HTTPError as exc:
+            if exc.code != 503:
+                error = json.loads(exc.read() or b"{}").get("error") or str(exc)
+                return dict(event="failed", error=error)
+        time.sleep(retry_wait)
+
+
+def write_atomically(path, txt):
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(txt)
+    os.replace(tmp, path)
+
+
+def serve_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="srttranslate serve",
+        description="Translate the subtitle files sent by srttranslate submit",
+    )
+    parser.add_argument(
+        "--host",
+        default=DEFAULT_HOST,
+        help=f"loopback address to listen on (default {DEFAULT_HOST})",
+    )
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        metavar="N",
+        type=int,
+        default=DEFAULT_JOBS,
+        help=f"number of files translated in parallel (default {DEFAULT_JOBS})",
+    )
+    parser.add_argument(
+        "--queue-size",
+        metavar="N",
+        type=int,
+        default=DEFAULT_QUEUE_SIZE,
+        help=f"jobs waiting beyond this are turned down (default {DEFAULT_QUEUE_SIZE})",
+    )
+    parser.add_argument("--keyfile", "-k", type=pathlib.Path)
+    parser.add_argument("--batch-size", "-b", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", "-w", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--server-url", metavar="URL")
+    parser.add_argument("--requests-per-second", metavar="N", type=float)
+    parser.add_argument("--chars-per-second", metavar="N", type=float)
+    parser.add_argument("--quota-ttl", type=float, default=DEFAULT_QUOTA_TTL)
+    parser.add_argument("--cache-dir", metavar="DIR", type=pathlib.Path)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--merge-sentences", action="store_true")
+    parser.add_argument("--engine", "-e", choices=ENGINES, default="auto")
+    cliopts = parser.parse_args(argv)
+
+    if not is_loopback(cliopts.host):
+        print(
+            f"{cliopts.host} is not a loopback address. The server has no "
+            "authentication and writes the files its clients name.",
+            file=sys.stderr,
+        )
+        return 1
+    api_key = get_api_key(cliopts)
+    if not api_key:
+        print("No API key for DeepL", file=sys.stderr)
+        return 1
+
+    from .cache import TranslationCache, default_cache_dir
+    from .metrics import Metrics
+
+    from .coalescer import RequestCoalescer
+
+    _, handler = make_handler(api_key, cliopts)
+    # Jobs running at the same time share requests
+    handler = RequestCoalescer(handler, cliopts.batch_size)
+    cache = None if cliopts.no_cache else TranslationCache(cliopts.cache_dir)
+    server = TranslationServer(
+        handler,
+        (cliopts.host, cliopts.port),
+        jobs=cliopts.jobs,
+        queue_size=cliopts.queue_size,
+        batch_size=cliopts.batch_size,
+        workers=cliopts.workers,
+        cache=cache,
+        journal_dir=(cliopts.cache_dir or default_cache_dir()) / "journal",
+        metrics=Metrics(),
+        merge_sentences=cliopts.merge_sentences,
+        engine=cliopts.engine,
+    )
+    print(f"Listening on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Finishing the jobs queued...", flush=True)
+    finally:
+        server.stop()
+        handler.close()
+        if cache is not None:
+            cache.close()
+    return 0
+
+
+def submit_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="srttranslate submit",
+        description="Send subtitle files to srttranslate serve for translation",
+    )
+    parser.add_argument(
+        "--url", default=DEFAULT_URL, help=f"server address (default {DEFAULT_URL})"
+    )
+    parser.add_argument("--lang", "-l", dest="langs", action="append")
+    parser.add_argument("--output", "-o", metavar="FILE", type=pathlib.Path)
+    parser.add_argument(
+        "--output-template", "-t", metavar="TEMPLATE", default=DEFAULT_OUTPUT_TEMPLATE
+    )
+    parser.add_argument(
+        "--upload",
+        "-u",
+        action="store_true",
+        help="send the contents of the files, for a server that cannot read them",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        metavar="N",
+        type=int,
+        default=DEFAULT_JOBS,
+        help=f"number of files submitted at a time (default {DEFAULT_JOBS})",
+    )
+    parser.add_argument("SUBFILE", nargs="+", type=pathlib.Path)
+    cliopts = parser.parse_args(argv)
+
+    langs = list(dict.fromkeys(cliopts.langs or [DEFAULT_LANGUAGE]))
+    subfiles = find_subtitle_files(cliopts.SUBFILE)
+    if cliopts.output and (len(langs) > 1 or len(subfiles) > 1):
+        print(
+            "--output needs a single subtitle file and target language",
+            file=sys.stderr,
+        )
+        return 1
+
+    def submit(subfile):
+        if cliopts.output:
+            outfiles = {langs[0]: cliopts.output}
+        else:
+            outfiles = {
+                lang: output_name(cliopts.output_template, subfile, lang)
+                for lang in langs
+            }
+        if cliopts.upload:
+            # Decoded the way the command line reads files
+            spec = dict(source=read_text(subfile)[0], langs=langs)
+        else:
+            spec = dict(
+                input=str(subfile.resolve()),
+                outputs={lang: str(out.resolve()) for lang, out in outfiles.items()},
+            )
+
+        def on_event(event):
+            if len(subfiles) == 1 and event["event"] == "progress":
+                progress_report(event["total"], event["done"])
+
+        final = submit_job(cliopts.url, spec, on_event)
+        if final["event"] == "done" and cliopts.upload:
+            for lang, txt in final["translations"].items():
+                write_atomically(outfiles[lang], txt)
+        return final
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=cliopts.jobs) as pool:
+        futures = {pool.submit(submit, subfile): subfile for subfile in subfiles}
+        for fut in as_completed(futures):
+            subfile = futures[fut]
+            try:
+                final = fut.result()
+            except (OSError, ValueError) as exc:
+                final = dict(event="failed", error=str(exc))
+            if len(subfiles) == 1:
+                print()
+            if final["event"] == "done":
+                print(f"Translated {subfile} ({final['chars']} characters)")
+            else:
+                failed += 1
+                print(f"Failed {subfile}: {final['error']}", file=sys.stderr)
+    return 1 if failed else 0
@@ -1,32 +1,191 @@
+import time
+import threading
+from io import BytesIO
+from concurrent.futures import Future
+
 import deepl
+from deepl import DeepLException, QuotaExceededException  # noqa: F401
+
+from .scheduler import RequestScheduler
+from .document import DOCUMENT_FILENAME, to_document, from_document
+from .accounting import billable_chars
+
+# Retries are left to the scheduler, which knows about the other requests
+# in flight. The deepl module has no per Translator setting, this one
+# applies to the whole process and is made once, on import.
+deepl.http_client.max_network_retries = 0
 
 # with open("deepl.key") as fd:
 # deepl_api_key = fd.read().strip()
 
+# Seconds between polls of the status of a document translation
+DOCUMENT_POLL_INTERVAL = 1.0
+
 
 class DeeplHandler:
-    def __init__(self, deepl_api_key):
-        self.transl = deepl.Translator(deepl_api_key)
-        usage = self.transl.get_usage()
-        self.chars = usage.character.count
-        self.limit = usage.character.limit
+    def __init__(
+        self,
+        deepl_api_key,
+        scheduler=None,
+        server_url=None,
+        ledger=None,
+        poll_interval=DOCUMENT_POLL_INTERVAL,
+    ):
+        self.transl = deepl.Translator(deepl_api_key, server_url=server_url)
+        self.scheduler = scheduler or RequestScheduler()
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.sent = 0
+        # With a QuotaLedger the quota is shared with other processes and
+        # the usage it has is reused while fresh
+        self.ledger = ledger
+        self.usage = Future()
+        snapshot = ledger.snapshot() if ledger is not None else None
+        if snapshot is not None:
+            self.usage.set_result(snapshot)
+        else:
+            # Looked up in the background while the caller gets on with
+            # reading its input, chars and limit wait for it
+            threading.Thread(
+                target=self._get_usage, args=(self.usage,), daemon=True
+            ).start()
+
+    def _get_usage(self, future):
+        try:
+            usage = self.scheduler.call(self.transl.get_usage)
+            count, limit = usage.character.count, usage.character.limit
+            if self.ledger is not None:
+                self.ledger.update(count, limit)
+        except BaseException as exc:
+            future.set_exception(exc)
+        else:
+            future.set_result((count, limit))
+
+    def _refresh_usage(self):
+        # A long lived handler (srttranslate serve) looks the usage up
+        # again once the ledger's is older than its ttl, so that use of
+        # the account elsewhere is taken into account
+        with self.refresh_lock:
+            if self.ledger.snapshot() is not None:
+                return
+            usage = Future()
+            self._get_usage(usage)
+            usage.result()
+            self.usage = usage
+
+    @property
+    def chars(self):
+        # Characters used in the period, including those sent since the
+        # usage was looked up
+        count, _ = self.usage.result()
+        if self.ledger is not None:
+            count, _, _ = self.ledger.usage()
+            return count
+        return count + self.sent
+
+    @property
+    def limit(self):
+        _, limit = self.usage.result()
+        return limit
+
+    def _sent(self, nchars):
+        with self.lock:
+            self.sent += nchars
+        if self.ledger is not None:
+            self.ledger.consume(nchars)
 
-    def translate(self, inlang, outlang, txt):
+    @staticmethod
+    def _languages(inlang, outlang):
         if inlang == "EN-GB":
             inlang = "EN"
         if outlang == "EN":
             outlang = "EN-GB"
+        return inlang or None, outlang
 
-        try:
-            rsp = self.transl.translate_text(
-                txt, source_lang=inlang, target_lang=outlang
-            )
-        except Exception:
-            raise
-        else:
-            self.chars += len(txt)
+    def translate(self, inlang, outlang, txt, tag_handling=None):
+        inlang, outlang = self._languages(inlang, outlang)
+        rsp = self.scheduler.call(
+            lambda: self.transl.translate_text(
+                txt,
+                source_lang=inlang,
+                target_lang=outlang,
+                tag_handling=tag_handling,
+            ),
+            len(txt),
+        )
+        self._sent(len(txt))
         return rsp.text
 
+    def translate_batch(self, inlang, outlang, texts, tag_handling=None):
+        inlang, outlang = self._languages(inlang, outlang)
+        nchars = sum(len(txt) for txt in texts)
+        rsp = self.scheduler.call(
+            lambda: self.transl.translate_text(
+                texts,
+                source_lang=inlang,
+                target_lang=outlang,
+                tag_handling=tag_handling,
+            ),
+            nchars,
+        )
+        self._sent(nchars)
+        return [r.text for r in rsp]
+
+    def translate_document(self, inlang, outlang, texts, tag_handling=None):
+        # Translates texts as one document: upload, poll until done and
+        # download. DeepL bills at least 50000 characters per document.
+        inlang, outlang = self._languages(inlang, outlang)
+        nchars = sum(len(txt) for txt in texts)
+        document = to_document(texts, tag_handling).encode("utf-8")
+        handle = self.scheduler.call(
+            lambda: self.transl.translate_document_upload(
+                document,
+                source_lang=inlang,
+                target_lang=outlang,
+                filename=DOCUMENT_FILENAME,
+            ),
+            nchars,
+        )
+        while True:
+            status = self.scheduler.call(
+                lambda: self.transl.translate_document_get_status(handle)
+            )
+            if not status.ok:
+                raise deepl.DocumentTranslationException(
+                    status.error_message or "Document translation failed", handle
+                )
+            if status.done:
+                break
+            time.sleep(self.poll_interval)
+
+        def download():
+            # A new buffer on every attempt
+            out = BytesIO()
+            self.transl.translate_document_download(handle, out)
+            return out.getvalue()
+
+        translated = self.scheduler.call(download).decode("utf-8")
+        self._sent(status.billed_characters or billable_chars(texts, "document"))
+        try:
+            return from_document(translated, len(texts), tag_handling)
+        except ValueError as exc:
+            raise deepl.DocumentTranslationException(str(exc), handle) from None
+
     def check_quota(self, nchars):
-        # True-- we can translate nchars False-- we can't
-        return (self.chars + nchars) <= self.limit
+        # True-- we can translate nchars False-- we can't. With a ledger
+        # the characters are reserved until sent or released.
+        if self.ledger is None:
+            return (self.chars + nchars) <= self.limit
+        self.usage.result()
+        self._refresh_usage()
+        return self.ledger.reserve(nchars)
+
+    def release_quota(self, nchars):
+        # nchars passed by check_quota() were not sent
+        if self.ledger is not None:
+            self.ledger.release(nchars)
+
+    def close(self):
+        if self.ledger is not None:
+            self.ledger.close()
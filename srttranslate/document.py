@@ -0,0 +1,62 @@
+import re
+
+# The document engine sends all the texts to translate into a language as
+# one HTML document, each text in a paragraph with a stable id, through
+# DeepL's document translation: one upload, a few status polls and one
+# download instead of a request per batch. DeepL bills at least
+# DOCUMENT_MIN_CHARS characters per document, so the engine is only chosen
+# automatically for long files.
+ENGINES = ("auto", "text", "document")
+DOCUMENT_MIN_CHARS = 50_000
+DOCUMENT_MIN_TEXTS = 1000
+DOCUMENT_FILENAME = "subtitles.html"
+
+PARAGRAPH_RE = re.compile(r'<p\b[^>]*\bid="c(\d+)"[^>]*>(.*?)</p>', re.DOTALL)
+BR_RE = re.compile(r"\s*<br\s*/?>\s*")
+TAG_RE = re.compile(r"<[^>]*>")
+
+
+def choose_engine(ntexts, nchars):
+    if ntexts >= DOCUMENT_MIN_TEXTS and nchars >= DOCUMENT_MIN_CHARS:
+        return "document"
+    return "text"
+
+
+def to_document(texts, tag_handling=None):
+    # Texts with markup (merged sentences) go in as they are, others are
+    # escaped with their line breaks as <br>. html (with its table of
+    # entities) is imported where used, the command line imports ENGINES.
+    import html
+
+    if tag_handling == "xml":
+        paragraphs = texts
+    else:
+        paragraphs = [
+            "<br>".join(html.escape(line, quote=False) for line in txt.split("\n"))
+            for txt in texts
+        ]
+    body = "\n".join(f'<p id="c{i}">{par}</p>' for i, par in enumerate(paragraphs))
+    return (
+        '<!DOCTYPE html>\n<html><head><meta charset="utf-8"></head><body>\n'
+        f"{body}\n</body></html>\n"
+    )
+
+
+def from_document(document, ntexts, tag_handling=None):
+    # The translations, in the order of the texts given to to_document()
+    import html
+
+    found = {}
+    for m in PARAGRAPH_RE.finditer(document):
+        par = m.group(2)
+        if tag_handling != "xml":
+            par = "\n".join(
+                html.unescape(TAG_RE.sub("", line)).strip() for line in BR_RE.split(par)
+            )
+        found[int(m.group(1))] = par
+    missing = sum(1 for i in range(ntexts) if i not in found)
+    if missing:
+        raise ValueError(
+            f"{missing} of {ntexts} texts missing from the translated document"
+        )
+    return [found[i] for i in range(ntexts)]
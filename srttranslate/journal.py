@@ -0,0 +1,82 @@
+import os
+import re
+import json
+import hashlib
+import pathlib
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fd:
+        for block in iter(lambda: fd.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class TranslationJournal:
+    # Records the translations of one input file to disk as each batch
+    # completes, so that an interrupted job can be resumed without paying
+    # again for what was already translated. There is one JSON lines file
+    # per target language, named after the hash of the input file contents.
+    def __init__(self, journal_dir, input_hash, resume=True):
+        self.journal_dir = pathlib.Path(journal_dir)
+        self.input_hash = input_hash
+        self.entries = {}
+        self.files = {}
+        self.resumed = 0
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+        if not resume:
+            self.remove()
+
+    @classmethod
+    def for_file(cls, journal_dir, path, resume=True):
+        return cls(journal_dir, file_hash(path), resume)
+
+    def path(self, lang):
+        safe_lang = re.sub(r"[^\w-]", "_", lang)
+        return self.journal_dir / f"{self.input_hash}.{safe_lang}.jsonl"
+
+    def _load(self, lang):
+        entries = self.entries[lang] = {}
+        try:
+            with self.path(lang).open(encoding="utf-8") as fd:
+                for line in fd:
+                    try:
+                        source, translation = json.loads(line)
+                    except ValueError:
+                        # Last line cut short by a crash
+                        continue
+                    entries[source] = translation
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def get_many(self, lang, texts):
+        # Returns a dict text -> translation for the texts in the journal
+        entries = self.entries.get(lang)
+        if entries is None:
+            entries = self._load(lang)
+        found = {txt: entries[txt] for txt in texts if txt in entries}
+        self.resumed += len(found)
+        return found
+
+    def record(self, lang, pairs):
+        fd = self.files.get(lang)
+        if fd is None:
+            fd = self.files[lang] = self.path(lang).open("a", encoding="utf-8")
+        for source, translation in pairs:
+            fd.write(json.dumps([source, translation], ensure_ascii=False) + "\n")
+        fd.flush()
+        os.fsync(fd.fileno())
+
+    def close(self):
+        for fd in self.files.values():
+            fd.close()
+        self.files = {}
+
+    def remove(self):
+        # Called once the outputs are safely written
+        self.close()
+        self.entries = {}
+        for path in self.journal_dir.glob(f"{self.input_hash}.*.jsonl"):
+            path.unlink()
@@ -0,0 +1,204 @@
+import os
+import time
+import socket
+import sqlite3
+import hashlib
+import pathlib
+import threading
+from contextlib import contextmanager
+
+from .cache import default_cache_dir
+
+DEFAULT_TTL = 300  # seconds
+DEFAULT_STALE_AFTER = 6 * 3600  # seconds
+LEDGER_FILE = "quota.sqlite3"
+
+
+def account_id(api_key, server_url=None):
+    # The ledger is kept per account without storing the key itself
+    digest = hashlib.sha256(f"{server_url or ''}\n{api_key}".encode())
+    return digest.hexdigest()[:32]
+
+
+def pid_alive(pid):
+    if os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class QuotaLedger:
+    # Character quota of a DeepL account shared by the srttranslate
+    # processes of a machine. It holds the last usage reported by DeepL,
+    # reused for ttl seconds, plus the characters translated since, and
+    # the characters reserved by each process for the work it has in hand.
+    # A process reserves characters before translating, consumes them as
+    # requests complete and releases what it did not use, so concurrent
+    # processes never count the same quota as available. SQLite's file
+    # locking keeps the updates atomic across processes.
+    def __init__(
+        self,
+        ledger_dir,
+        account,
+        ttl=DEFAULT_TTL,
+        stale_after=DEFAULT_STALE_AFTER,
+        clock=time.time,
+    ):
+        self.ledger_dir = pathlib.Path(ledger_dir or default_cache_dir())
+        self.account = account
+        self.ttl = ttl
+        self.stale_after = stale_after
+        self.clock = clock
+        self.host = socket.gethostname()
+        self.pid = os.getpid()
+        self.reservation = None
+
+        self.ledger_dir.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(
+            str(self.ledger_dir / LEDGER_FILE),
+            timeout=30,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS usage ("
+            " account TEXT PRIMARY KEY,"
+            " count INTEGER NOT NULL,"
+            " quota_limit INTEGER NOT NULL,"
+            " fetched REAL NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS reservations ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " account TEXT NOT NULL,"
+            " chars INTEGER NOT NULL,"
+            " host TEXT NOT NULL,"
+            " pid INTEGER NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so that reading
+        # what is available and reserving it is atomic
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.db
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+    def snapshot(self):
+        # Returns (count, limit) if the last usage known is fresh, or None
+        with self.lock:
+            row = self.db.execute(
+                "SELECT count, quota_limit, fetched FROM usage WHERE account = ?",
+                (self.account,),
+            ).fetchone()
+        if row is None or self.clock() - row[2] > self.ttl:
+            return None
+        return row[0], row[1]
+
+    def update(self, count, limit):
+        # A fresh usage from DeepL, which already counts what was consumed
+        with self.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO usage VALUES (?, ?, ?, ?)",
+                (self.account, count, limit, self.clock()),
+            )
+        return self
+
+    def usage(self):
+        # Returns (count, limit, reserved by every process)
+        with self.lock:
+            return self._usage(self.db)
+
+    def _usage(self, db):
+        row = db.execute(
+            "SELECT count, quota_limit FROM usage WHERE account = ?",
+            (self.account,),
+        ).fetchone()
+        count, limit = row if row is not None else (0, 0)
+        reserved = db.execute(
+            "SELECT COALESCE(SUM(chars), 0) FROM reservations WHERE account = ?",
+            (self.account,),
+        ).fetchone()[0]
+        return count, limit, reserved
+
+    def _expire(self, db):
+        # Reservations of processes that died without releasing them
+        now = self.clock()
+        rows = db.execute(
+            "SELECT id, host, pid, updated FROM reservations WHERE account = ?",
+            (self.account,),
+        ).fetchall()
+        for res_id, host, pid, updated in rows:
+            if res_id == self.reservation:
+                continue
+            if now - updated > self.stale_after or (
+                host == self.host and not pid_alive(pid)
+            ):
+                db.execute("DELETE FROM reservations WHERE id = ?", (res_id,))
+
+    def reserve(self, nchars):
+        # True if nchars were available and are now reserved for us
+        with self.transaction() as db:
+            self._expire(db)
+            count, limit, reserved = self._usage(db)
+            if count + reserved + nchars > limit:
+                return False
+            if self.reservation is not None:
+                cursor = db.execute(
+                    "UPDATE reservations SET chars = chars + ?, updated = ?"
+                    " WHERE id = ?",
+                    (nchars, self.clock(), self.reservation),
+                )
+                if cursor.rowcount:
+                    return True
+            cursor = db.execute(
+                "INSERT INTO reservations (account, chars, host, pid, updated)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (self.account, nchars, self.host, self.pid, self.clock()),
+            )
+            self.reservation = cursor.lastrowid
+            return True
+
+    def consume(self, nchars):
+        # nchars reserved were translated
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE usage SET count = count + ? WHERE account = ?",
+                (nchars, self.account),
+            )
+            self._take(db, nchars)
+
+    def release(self, nchars):
+        # nchars reserved were not needed after all
+        with self.transaction() as db:
+            self._take(db, nchars)
+
+    def _take(self, db, nchars):
+        if self.reservation is not None:
+            db.execute(
+                "UPDATE reservations SET chars = MAX(0, chars - ?), updated = ?"
+                " WHERE id = ?",
+                (nchars, self.clock(), self.reservation),
+            )
+
+    def close(self):
+        with self.lock:
+            if self.reservation is not None:
+                with self.transaction() as db:
+                    db.execute(
+                        "DELETE FROM reservations WHERE id = ?", (self.reservation,)
+                    )
+                self.reservation = None
+            self.db.close()
@@ -1,31 +1,325 @@
 import os
 import sys
 import pathlib
+import glob
+import time
 import argparse
-import importlib.resources
 
-from .translator import SrtTranslator
-from .deeplhandler import DeeplHandler
+# deepl (with requests), sqlite3 and concurrent.futures are imported when
+# needed, so that --help, --version and errors in the arguments are quick
+from .translator import (
+    SrtTranslator,
+    TranslatorError,
+    DEFAULT_BATCH_SIZE,
+    make_batches,
+)
+from .journal import TranslationJournal
+from .subtitles import STDIN, TimeWindow, parse_time
+from .document import ENGINES
+from .previous import PreviousTranslation
+from .metrics import Metrics, REPORTERS, rate_limited
 
+DEFAULT_WORKERS = 4
+DEFAULT_JOBS = 4
+DEFAULT_LANGUAGE = "EN-GB"
+DEFAULT_OUTPUT_TEMPLATE = "{stem}.{lang}.srt"
+DEFAULT_QUOTA_TTL = 300  # seconds
 
-def progress_report(maxchars, chars_to_now):
+
+def progress_report(maxchars, chars_to_now, progress=None):
+    if not maxchars:
+        return
     percent = chars_to_now * 100 / maxchars
-    print(f"\r{percent:5.1f}%", end="")
-
-
-def translate_subtitles(subfile, outfile, api_key):
-    print(f"Translating {subfile} into {outfile}")
-    handler = DeeplHandler(api_key)
-    print(f"{handler.chars} used of {handler.limit} available.")
-    transl = SrtTranslator(handler, progressfn=progress_report)
-    transl.add_input_file(subfile)
-    transl.translate("EN-GB")
-    print(f"\nWriting {outfile}")
-    transl.write("EN-GB", outfile)
+    line = f"\r{percent:5.1f}%"
+    if progress and len(progress) > 1:
+        for lang, (needed, done) in progress.items():
+            lang_percent = done * 100 / needed if needed else 100
+            line += f"  {lang} {lang_percent:5.1f}%"
+    print(line, end="")
+
+
+def output_name(template, subfile, lang):
+    # {stem} is the input file name without extension, {lang} the
+    # lowercase language without region (en) and {LANG} the language
+    # as given (EN-GB)
+    name = template.format(
+        stem=subfile.stem, lang=lang.split("-")[0].lower(), LANG=lang
+    )
+    return subfile.parent / name
+
+
+def translate_subtitles(
+    subfile,
+    outfiles,
+    handler,
+    batch_size=DEFAULT_BATCH_SIZE,
+    workers=DEFAULT_WORKERS,
+    cache=None,
+    verbose=True,
+    stream=False,
+    journal_dir=None,
+    resume=False,
+    metrics=None,
+    merge_sentences=False,
+    engine="text",
+    window=None,
+    previous=None,
+    previous_translations=None,
+    progressfn=None,
+):
+    # outfiles is a dict language -> output file. Returns the number of
+    # characters sent for translation. previous is an earlier version of
+    # subfile, previous_translations a dict language -> its translation,
+    # by default the output files. progressfn(maxchars, chars_to_now), if
+    # given, is called instead of printing the progress.
+    @rate_limited
+    def report_progress(maxchars, chars_to_now):
+        if progressfn is not None:
+            progressfn(maxchars, chars_to_now)
+        if not verbose:
+            return
+        if stream:
+            # The total is not known until the input is exhausted
+            print(f"\r{chars_to_now} characters", end="")
+        else:
+            progress_report(maxchars, chars_to_now, transl.progress)
+
+    if verbose:
+        print(f"Translating {subfile} into {', '.join(map(str, outfiles.values()))}")
+    journal = None
+    # The standard input can't be read again to resume
+    if journal_dir is not None and str(subfile) != STDIN:
+        journal = TranslationJournal.for_file(journal_dir, subfile, resume)
+    if previous is not None:
+        previous = PreviousTranslation.from_files(
+            previous, previous_translations or outfiles
+        )
+    transl = SrtTranslator(
+        handler,
+        progressfn=report_progress,
+        batch_size=batch_size,
+        workers=workers,
+        cache=cache,
+        journal=journal,
+        metrics=metrics,
+        merge_sentences=merge_sentences,
+        engine=engine,
+        window=window,
+        previous=previous,
+    )
+    try:
+        if stream:
+            transl.translate_stream(subfile, outfiles)
+            if verbose:
+                print()
+        else:
+            transl.add_input_file(subfile)
+            transl.translate(list(outfiles))
+            if verbose:
+                print()
+            for lang, outfile in outfiles.items():
+                if verbose:
+                    print(f"Writing {outfile}")
+                transl.write(lang, outfile)
+    except BaseException:
+        if journal is not None:
+            journal.close()
+        raise
+
+    if journal is not None:
+        if verbose and journal.resumed:
+            print(f"{journal.resumed} translations resumed from the journal.")
+        journal.remove()
+    if verbose and previous is not None:
+        print(
+            f"{previous.reused_chars} characters reused from the previous "
+            f"translation, {transl.chars} sent."
+        )
+    return transl.chars
+
+
+def plan_subtitles(
+    subfile,
+    outfiles,
+    cache=None,
+    stream=False,
+    journal_dir=None,
+    resume=False,
+    previous=None,
+    previous_translations=None,
+    **options,
+):
+    # What translate_subtitles() would send, without a handler or any
+    # request: returns an Account of the characters billed and requests.
+    # options are passed on to SrtTranslator.
+    journal = None
+    # Without resume, the run starts a new journal
+    if resume and journal_dir is not None and str(subfile) != STDIN:
+        journal = TranslationJournal.for_file(journal_dir, subfile, resume=True)
+    if previous is not None:
+        previous = PreviousTranslation.from_files(
+            previous, previous_translations or outfiles
+        )
+    transl = SrtTranslator(
+        None, cache=cache, journal=journal, previous=previous, **options
+    )
+    try:
+        transl.add_input_file(subfile)
+        return transl.plan(list(outfiles), stream=stream)
+    finally:
+        if journal is not None:
+            journal.close()
+
+
+def plan_many(jobs, batch_size=DEFAULT_BATCH_SIZE, **kwargs):
+    # Prints the plan of each job and the total, returns the list of files
+    # that failed
+    from .accounting import Account
+
+    total = Account(keep_texts=True)
+    failed = []
+    for subfile, outfiles in jobs.items():
+        try:
+            account = plan_subtitles(subfile, outfiles, batch_size=batch_size, **kwargs)
+        except Exception as exc:
+            failed.append(subfile)
+            print(f"Failed {subfile}: {exc!r}", file=sys.stderr)
+            continue
+        total.add(account)
+        print(
+            f"{subfile}: {account.chars} characters in {account.requests} requests"
+            + (f" ({account.documents} documents)" if account.documents else "")
+        )
+    if len(jobs) == 1:
+        requests = f"{total.requests} requests"
+    else:
+        # translate_many() packs the texts of all the files into shared
+        # requests, as full as the texts arriving at the same time allow
+        packed = total.documents + sum(
+            sum(1 for _ in make_batches(texts, batch_size))
+            for texts in total.sent.values()
+        )
+        requests = f"at most {total.requests} requests ({packed} if fully packed)"
     print(
-        f"Done. {transl.chars} Characters translated. "
-        f"Total {handler.chars+transl.chars} so far."
+        f"Total: {total.chars} characters in {requests} "
+        f"for {len(jobs) - len(failed)} files."
+    )
+    return failed
+
+
+def find_subtitle_files(paths):
+    # Expand directories and glob patterns into subtitle files
+    found = []
+    for path in paths:
+        if str(path) == STDIN:
+            found.append(path)
+        elif path.is_dir():
+            found.extend(sorted(path.glob("*.srt")))
+        elif any(c in str(path) for c in "*?["):
+            found.extend(sorted(map(pathlib.Path, glob.glob(str(path)))))
+        else:
+            found.append(path)
+    return list(dict.fromkeys(found))
+
+
+def is_up_to_date(subfile, outfiles):
+    try:
+        mtime = subfile.stat().st_mtime
+        return all(outfile.stat().st_mtime >= mtime for outfile in outfiles)
+    except FileNotFoundError:
+        return False
+
+
+def translate_many(jobs, handler, jobs_in_parallel=DEFAULT_JOBS, **kwargs):
+    # jobs is a dict subtitle file -> outfiles, translated in parallel
+    # sharing the handler, whose requests carry texts of several files.
+    # Returns the list of files that failed.
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    from .coalescer import RequestCoalescer
+
+    coalescer = RequestCoalescer(handler, kwargs.get("batch_size", DEFAULT_BATCH_SIZE))
+    failed = []
+    chars = 0
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=jobs_in_parallel) as pool:
+        futures = {
+            pool.submit(
+                translate_subtitles,
+                subfile,
+                outfiles,
+                coalescer,
+                verbose=False,
+                **kwargs,
+            ): subfile
+            for subfile, outfiles in jobs.items()
+        }
+        for fut in as_completed(futures):
+            subfile = futures[fut]
+            try:
+                nchars = fut.result()
+            except Exception as exc:
+                # Whatever went wrong with one file, the others go on
+                failed.append(subfile)
+                print(f"Failed {subfile}: {exc!r}", file=sys.stderr)
+            else:
+                chars += nchars
+                print(f"Translated {subfile} ({nchars} characters)")
+
+    elapsed = max(time.monotonic() - start, 0.001)
+    done = len(jobs) - len(failed)
+    print(
+        f"{done} files translated, {len(failed)} failed. "
+        f"{chars} characters in {coalescer.requests} requests, {elapsed:.1f}s "
+        f"({done / elapsed:.2f} files/s, {chars / elapsed:.0f} characters/s)."
+    )
+    return failed
+
+
+def make_handler(api_key, cliopts):
+    # Returns the scheduler and the handler for the command line options:
+    # a DeeplHandler, or with backup keys a CompositeHandler of one
+    # DeeplHandler per key. The scheduler is the first key's.
+    from .scheduler import RequestScheduler
+    from .ledger import QuotaLedger, account_id
+    from .deeplhandler import DeeplHandler, QuotaExceededException
+
+    def deepl_handler(key):
+        scheduler = RequestScheduler(
+            cliopts.requests_per_second, cliopts.chars_per_second
+        )
+        # Runs in parallel share the quota through the ledger
+        ledger = QuotaLedger(
+            cliopts.cache_dir,
+            account_id(key, cliopts.server_url),
+            ttl=cliopts.quota_ttl,
+        )
+        return scheduler, DeeplHandler(key, scheduler, cliopts.server_url, ledger)
+
+    scheduler, handler = deepl_handler(api_key)
+    backup_keyfiles = getattr(cliopts, "backup_keyfile", None) or []
+    if not backup_keyfiles:
+        return scheduler, handler
+
+    from .composite import CompositeHandler
+
+    handlers = [handler]
+    for keyfile in backup_keyfiles:
+        handlers.append(deepl_handler(keyfile.read_text().strip())[1])
+    names = [str(cliopts.keyfile or "DEEPL_API_KEY")]
+    names += [str(keyfile) for keyfile in backup_keyfiles]
+    composite = CompositeHandler(
+        handlers, names, quota_errors=(QuotaExceededException,)
     )
+    return scheduler, composite
+
+
+def timestamp(value):
+    try:
+        return parse_time(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"invalid time {value!r}, use [[HH:]MM:]SS[,mmm]"
+        ) from None
 
 
 def get_api_key(cliopts):
@@ -37,7 +331,10 @@ def get_api_key(cliopts):
 
 
 def get_command_line_args(version, argv):
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(
+        epilog="srttranslate serve runs a translation server that files are "
+        "sent to with srttranslate submit, see their --help."
+    )
     parser.add_argument(
         "--version",
         "-v",
@@ -52,29 +349,238 @@ def get_command_line_args(version, argv):
         type=pathlib.Path,
         help="name of file containing DeepL's API key",
     )
+    parser.add_argument(
+        "--backup-keyfile",
+        metavar="KEYFILE",
+        type=pathlib.Path,
+        action="append",
+        help="file with another API key, used when requests with the first "
+        "are slow, fail or run out of quota; may be repeated",
+    )
     parser.add_argument(
         "--output",
         "-o",
         metavar="FILE",
         type=pathlib.Path,
-        help="name of output subtitle file",
+        help="name of output subtitle file, only for a single language",
+    )
+    parser.add_argument(
+        "--lang",
+        "-l",
+        metavar="LANG",
+        action="append",
+        dest="langs",
+        help=f"target language, may be repeated (default {DEFAULT_LANGUAGE})",
+    )
+    parser.add_argument(
+        "--output-template",
+        "-t",
+        metavar="TEMPLATE",
+        default=DEFAULT_OUTPUT_TEMPLATE,
+        help="name of output files, using {stem}, {lang} and {LANG} "
+        f"(default {DEFAULT_OUTPUT_TEMPLATE})",
+    )
+    parser.add_argument(
+        "--batch-size",
+        "-b",
+        metavar="N",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help=f"maximum number of subtitles per request (default {DEFAULT_BATCH_SIZE})",
+    )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        metavar="N",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"number of requests to keep in flight (default {DEFAULT_WORKERS})",
+    )
+    parser.add_argument(
+        "--server-url",
+        metavar="URL",
+        help="DeepL API server, by default the one matching the API key",
+    )
+    parser.add_argument(
+        "--requests-per-second",
+        metavar="N",
+        type=float,
+        help="maximum requests per second sent to DeepL",
+    )
+    parser.add_argument(
+        "--chars-per-second",
+        metavar="N",
+        type=float,
+        help="maximum characters per second sent to DeepL",
+    )
+    parser.add_argument(
+        "--quota-ttl",
+        metavar="SECONDS",
+        type=float,
+        default=DEFAULT_QUOTA_TTL,
+        help="reuse the DeepL usage looked up by an earlier run for this long "
+        f"(default {DEFAULT_QUOTA_TTL})",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        type=pathlib.Path,
+        help="directory of the translation cache (default ~/.cache/srttranslate)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="do not look up or store translations in the cache",
+    )
+    parser.add_argument(
+        "--clear-cache",
+        action="store_true",
+        help="empty the translation cache before translating",
+    )
+    parser.add_argument(
+        "--stream",
+        "-s",
+        action="store_true",
+        help="translate and write subtitles as they are read, for very long files",
+    )
+    parser.add_argument(
+        "--resume",
+        "-r",
+        action="store_true",
+        help="reuse the translations of an interrupted run of the same files",
+    )
+    parser.add_argument(
+        "--merge-sentences",
+        action="store_true",
+        help="translate sentences spanning several subtitles as a whole",
+    )
+    parser.add_argument(
+        "--engine",
+        "-e",
+        choices=ENGINES,
+        default="auto",
+        help="send subtitles in batches of text or as one document, by "
+        "default a document for long files (default auto)",
+    )
+    parser.add_argument(
+        "--from",
+        metavar="TIME",
+        type=timestamp,
+        dest="from_time",
+        help="translate only the subtitles shown from this time, as "
+        "[[HH:]MM:]SS[,mmm]",
+    )
+    parser.add_argument(
+        "--to",
+        metavar="TIME",
+        type=timestamp,
+        dest="to_time",
+        help="translate only the subtitles shown before this time",
+    )
+    parser.add_argument(
+        "--rebase",
+        action="store_true",
+        help="with --from, move the times of the output back so that it "
+        "starts at 00:00:00",
+    )
+    parser.add_argument(
+        "--previous",
+        "-p",
+        metavar="FILE",
+        type=pathlib.Path,
+        help="earlier version of the subtitle file, only changed subtitles "
+        "are translated",
+    )
+    parser.add_argument(
+        "--previous-translation",
+        metavar="FILE",
+        type=pathlib.Path,
+        help="translation of the --previous file (default the output file)",
+    )
+    parser.add_argument(
+        "--metrics",
+        "-m",
+        choices=sorted(REPORTERS),
+        help="report timings and counters at the end in this format",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        metavar="FILE",
+        type=pathlib.Path,
+        help="file for the --metrics report (default standard output)",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        metavar="N",
+        type=int,
+        default=DEFAULT_JOBS,
+        help=f"number of files translated in parallel (default {DEFAULT_JOBS})",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="print the characters and requests the translation would take, "
+        "without translating; needs no API key",
+    )
+    parser.add_argument(
+        "--force",
+        "-f",
+        action="store_true",
+        help="translate files whose translations are up to date",
+    )
+    parser.add_argument(
+        "SUBFILE",
+        type=pathlib.Path,
+        nargs="*",
+        help="Subtitle files, directories or glob patterns to translate, "
+        f"{STDIN} for the standard input",
     )
-    parser.add_argument("SUBFILE", type=pathlib.Path, help="Subtitle file to translate")
     return parser.parse_args(argv)
 
 
+def report_metrics(cliopts, snap):
+    reporter_class = REPORTERS[cliopts.metrics]
+    if cliopts.metrics_file is None:
+        reporter_class().report(snap)
+        return
+    # JSON lines accumulate run after run, the other formats are replaced
+    mode = "a" if cliopts.metrics == "json" else "w"
+    with cliopts.metrics_file.open(mode) as fd:
+        reporter_class(fd).report(snap)
+
+
 def main(argv=None):
     if argv is None:
         argv = sys.argv[1:]
 
-    pkgname = __name__.split(".")[0]
-    with importlib.resources.open_text(pkgname, "VERSION") as vfd:
+    if argv and argv[0] in ("serve", "submit"):
+        from . import daemon
+
+        if argv[0] == "serve":
+            return daemon.serve_main(argv[1:])
+        return daemon.submit_main(argv[1:])
+
+    with open(os.path.join(os.path.dirname(__file__), "VERSION")) as vfd:
         version = vfd.read().strip()
 
     cliopts = get_command_line_args(version, argv)
 
+    from .cache import TranslationCache, default_cache_dir
+
+    if cliopts.clear_cache:
+        cache = TranslationCache(cliopts.cache_dir)
+        cache.clear().close()
+        print(f"Translation cache at {cache.cache_dir} cleared.")
+
+    if not cliopts.SUBFILE:
+        if cliopts.clear_cache:
+            return 0
+        print("No subtitle file to translate", file=sys.stderr)
+        return 1
+
     api_key = get_api_key(cliopts)
-    if not api_key:
+    if not api_key and not cliopts.plan:
         print("No API key for DeepL", file=sys.stderr)
         print(
             "Please provide a file that contains the API Key or set "
@@ -83,13 +589,177 @@ def main(argv=None):
         )
         return 1
 
+    subfiles = find_subtitle_files(cliopts.SUBFILE)
+    batch_mode = len(subfiles) != 1 or subfiles[0] not in cliopts.SUBFILE
+    langs = list(dict.fromkeys(cliopts.langs or [DEFAULT_LANGUAGE]))
+    if pathlib.Path(STDIN) in subfiles and (batch_mode or not cliopts.output):
+        print(
+            "Reading the standard input needs --output and no other subtitle file",
+            file=sys.stderr,
+        )
+        return 1
     if cliopts.output:
-        output = cliopts.output
+        if len(langs) > 1 or batch_mode:
+            print(
+                "--output needs a single subtitle file and target language",
+                file=sys.stderr,
+            )
+            return 1
+        jobs = {subfiles[0]: {langs[0]: cliopts.output}}
     else:
-        output = cliopts.SUBFILE.parent / (cliopts.SUBFILE.stem + ".en.srt")
+        jobs = {
+            subfile: {
+                lang: output_name(cliopts.output_template, subfile, lang)
+                for lang in langs
+            }
+            for subfile in subfiles
+        }
+        if len(langs) > 1 and len(set(jobs[subfiles[0]].values())) < len(langs):
+            print(
+                f"Output template {cliopts.output_template} gives the same "
+                "file name to several languages, use {LANG}",
+                file=sys.stderr,
+            )
+            return 1
 
-    translate_subtitles(cliopts.SUBFILE, output, api_key)
+    if cliopts.previous_translation and (len(langs) > 1 or not cliopts.previous):
+        print(
+            "--previous-translation needs --previous and a single target language",
+            file=sys.stderr,
+        )
+        return 1
+    if cliopts.previous and (batch_mode or cliopts.merge_sentences):
+        print(
+            "--previous needs a single subtitle file and no --merge-sentences",
+            file=sys.stderr,
+        )
+        return 1
+
+    window = None
+    if cliopts.from_time is not None or cliopts.to_time is not None:
+        from_time = cliopts.from_time or 0
+        if cliopts.to_time is not None and cliopts.to_time <= from_time:
+            print("--to must be later than --from", file=sys.stderr)
+            return 1
+        window = TimeWindow(from_time, cliopts.to_time, cliopts.rebase)
+
+    if batch_mode:
+        # Don't take translations of other files in a directory as input
+        outputs = {out for outfiles in jobs.values() for out in outfiles.values()}
+        jobs = {
+            subfile: outfiles
+            for subfile, outfiles in jobs.items()
+            if subfile not in outputs
+        }
+        if not cliopts.force:
+            uptodate = [
+                sub
+                for sub, outfiles in jobs.items()
+                if is_up_to_date(sub, outfiles.values())
+            ]
+            for subfile in uptodate:
+                del jobs[subfile]
+            if uptodate:
+                print(f"{len(uptodate)} files up to date.")
+        if not jobs:
+            print("Nothing to translate.")
+            return 0
+
+    cache = None if cliopts.no_cache else TranslationCache(cliopts.cache_dir)
+    if cliopts.plan:
+        previous = {}
+        if not batch_mode:
+            previous["previous"] = cliopts.previous
+            if cliopts.previous_translation:
+                previous["previous_translations"] = {
+                    langs[0]: cliopts.previous_translation
+                }
+        try:
+            failed = plan_many(
+                jobs,
+                cache=cache,
+                batch_size=cliopts.batch_size,
+                merge_sentences=cliopts.merge_sentences,
+                engine=cliopts.engine,
+                window=window,
+                stream=cliopts.stream,
+                journal_dir=(cliopts.cache_dir or default_cache_dir()) / "journal",
+                resume=cliopts.resume,
+                **previous,
+            )
+        finally:
+            if cache is not None:
+                cache.close()
+        return 1 if failed else 0
 
+    from .deeplhandler import DeepLException
+
+    scheduler, handler = make_handler(api_key, cliopts)
+    options = dict(
+        batch_size=cliopts.batch_size,
+        workers=cliopts.workers,
+        cache=cache,
+        stream=cliopts.stream,
+        journal_dir=(cliopts.cache_dir or default_cache_dir()) / "journal",
+        resume=cliopts.resume,
+        metrics=Metrics(),
+        merge_sentences=cliopts.merge_sentences,
+        engine=cliopts.engine,
+        window=window,
+    )
+    try:
+        if batch_mode:
+            failed = translate_many(jobs, handler, cliopts.jobs, **options)
+            if failed:
+                return 1
+            print(f"{handler.chars} of {handler.limit} used in the billing period.")
+        else:
+            subfile, outfiles = next(iter(jobs.items()))
+            previous_translations = None
+            if cliopts.previous_translation:
+                previous_translations = {langs[0]: cliopts.previous_translation}
+            nchars = translate_subtitles(
+                subfile,
+                outfiles,
+                handler,
+                previous=cliopts.previous,
+                previous_translations=previous_translations,
+                **options,
+            )
+            print(
+                f"Done. {nchars} characters translated, {handler.chars} of "
+                f"{handler.limit} used in the billing period."
+            )
+    except (TranslatorError, DeepLException) as exc:
+        print(f"\nTranslation failed: {exc}", file=sys.stderr)
+        print("No output written. Use --resume to carry on.", file=sys.stderr)
+        return 1
+    finally:
+        handler.close()
+        if cache is not None:
+            cache.close()
+
+    if cache is not None:
+        print(
+            f"Cache: {cache.hits} hits, {cache.misses} misses, "
+            f"{cache.saved_chars} characters saved."
+        )
+    if scheduler.retries or scheduler.throttled_time:
+        print(
+            f"{scheduler.retries} requests retried, "
+            f"{scheduler.throttled_time:.1f}s spent throttled."
+        )
+    backend_stats = getattr(handler, "backend_stats", None)
+    if backend_stats is not None:
+        for stats in backend_stats():
+            print(
+                f"{stats['name']}: {stats['requests']} requests, "
+                f"{stats['errors']} failed, p50 {stats['p50'] * 1000:.0f}ms, "
+                f"{stats['hedges_won']} of {stats['hedges']} hedges first"
+                + (", out of quota" if stats["out_of_quota"] else "")
+            )
+    if cliopts.metrics:
+        report_metrics(cliopts, options["metrics"].snapshot(cache, scheduler))
     return 0
 
 
@@ -0,0 +1,96 @@
+import re
+
+# Cues closer than this (milliseconds) may belong to the same sentence
+DEFAULT_MAX_GAP = 1000
+DEFAULT_MAX_CUES = 4
+
+SENTENCE_END = ".!?…♪"
+CLOSING = "\"'»”’)]"
+CUE_RE = re.compile(r"<c>(.*?)</c>", re.DOTALL)
+BR_RE = re.compile(r"\s*<br\s*/>\s*")
+TAG_RE = re.compile(r"<[^>]*>")
+
+
+# xml.sax.saxutils has these, but it is slow to import
+def escape(txt):
+    return txt.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def unescape(txt):
+    return txt.replace("&lt;", "<").replace("&gt;", ">").replace("&amp;", "&")
+
+
+def ends_sentence(txt):
+    txt = txt.rstrip().rstrip(CLOSING)
+    return not txt or txt[-1] in SENTENCE_END
+
+
+def group_sentences(records, max_gap=DEFAULT_MAX_GAP, max_cues=DEFAULT_MAX_CUES):
+    # Groups consecutive records into sentence units, returned as lists of
+    # record indexes. A unit goes on while the last cue does not end a
+    # sentence and the next cue starts within max_gap milliseconds.
+    units = []
+    unit = []
+    prev = None
+    for i, sub in enumerate(records):
+        if unit and (
+            len(unit) >= max_cues
+            or ends_sentence(prev.text[-1] if prev.text else "")
+            or sub.start_ms - prev.end_ms > max_gap
+        ):
+            units.append(unit)
+            unit = []
+        unit.append(i)
+        prev = sub
+    if unit:
+        units.append(unit)
+    return units
+
+
+def join_cues(texts):
+    # One text with markup, for translating with XML tag handling. Each
+    # cue goes in a <c> element and line breaks become <br/>. A unit of a
+    # single cue needs no <c>.
+    cues = ["<br/>".join(escape(line) for line in txt.split("\n")) for txt in texts]
+    if len(cues) == 1:
+        return cues[0]
+    return "".join(f"<c>{cue}</c>" for cue in cues)
+
+
+def unmark(part):
+    return "\n".join(
+        unescape(TAG_RE.sub("", line)).strip() for line in BR_RE.split(part)
+    )
+
+
+def split_cues(translated, source_texts):
+    # Back from the markup to one text per cue. If the translation lost
+    # or added cue elements, the words are shared out in proportion to
+    # the length of the source cues. Returns None when there are fewer
+    # words than cues, for the cues to be translated one by one.
+    if len(source_texts) == 1:
+        return [unmark(translated)]
+    parts = CUE_RE.findall(translated)
+    if len(parts) == len(source_texts):
+        return [unmark(part) for part in parts]
+    words = unescape(TAG_RE.sub(" ", translated)).split()
+    return distribute(words, [len(txt) for txt in source_texts])
+
+
+def distribute(words, weights):
+    # Every text gets at least one word
+    nwords = len(words)
+    ntexts = len(weights)
+    if nwords < ntexts:
+        return None
+    total = sum(weights) or 1
+    texts = []
+    start = 0
+    cumulative = 0
+    for n, weight in enumerate(weights, 1):
+        cumulative += weight
+        end = nwords if n == ntexts else round(nwords * cumulative / total)
+        end = min(max(end, start + 1), nwords - (ntexts - n))
+        texts.append(" ".join(words[start:end]))
+        start = end
+    return texts
@@ -0,0 +1,213 @@
+import sys
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PHASES = ("parse", "quota", "translate", "write")
+
+
+class Histogram:
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, pct):
+        # Interpolated within the bucket the percentile falls in
+        if not self.count:
+            return 0.0
+        rank = self.count * pct / 100
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.bounds[i - 1] if i else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else lower
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+
+
+class Metrics:
+    # Timings and counters of translation runs. One instance may be shared
+    # by several translators working at the same time.
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.started = clock()
+        self.lock = threading.Lock()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.latency = Histogram()
+        self.counters = dict(
+            files=0,
+            cues=0,
+            requests=0,
+            characters=0,
+            duplicate_texts=0,
+            duplicate_characters=0,
+        )
+
+    @contextmanager
+    def phase(self, name):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            elapsed = self.clock() - start
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe_request(self, seconds, nchars):
+        with self.lock:
+            self.latency.observe(seconds)
+            self.counters["requests"] += 1
+            self.counters["characters"] += nchars
+
+    def snapshot(self, cache=None, scheduler=None):
+        with self.lock:
+            elapsed = self.clock() - self.started
+            snap = dict(
+                elapsed=elapsed,
+                phases=dict(self.phases),
+                counters=dict(self.counters),
+                chars_per_sec=self.counters["characters"] / elapsed if elapsed else 0.0,
+                latency=dict(
+                    count=self.latency.count,
+                    sum=self.latency.sum,
+                    p50=self.latency.percentile(50),
+                    p95=self.latency.percentile(95),
+                    p99=self.latency.percentile(99),
+                    buckets=list(zip(self.latency.bounds, self.latency.counts)),
+                ),
+            )
+        if cache is not None:
+            snap["cache"] = dict(
+                hits=cache.hits, misses=cache.misses, saved_characters=cache.saved_chars
+            )
+        if scheduler is not None:
+            snap["scheduler"] = dict(
+                retries=scheduler.retries, throttled_seconds=scheduler.throttled_time
+            )
+        return snap
+
+
+class HumanReporter:
+    def __init__(self, fd=sys.stdout):
+        self.fd = fd
+
+    def report(self, snap):
+        counters = snap["counters"]
+        latency = snap["latency"]
+        phases = ", ".join(
+            f"{name} {secs:.2f}s" for name, secs in snap["phases"].items()
+        )
+        lines = [
+            f"Elapsed {snap['elapsed']:.2f}s (summed over files: {phases})",
+            f"{counters['cues']} subtitles, {counters['requests']} requests, "
+            f"{counters['characters']} characters, "
+            f"{snap['chars_per_sec']:.0f} characters/s",
+            f"Request latency p50 {latency['p50'] * 1000:.0f}ms, "
+            f"p95 {latency['p95'] * 1000:.0f}ms, p99 {latency['p99'] * 1000:.0f}ms",
+            f"Duplicates: {counters['duplicate_texts']} texts, "
+            f"{counters['duplicate_characters']} characters not sent",
+        ]
+        if "cache" in snap:
+            cache = snap["cache"]
+            lines.append(
+                f"Cache: {cache['hits']} hits, {cache['misses']} misses, "
+                f"{cache['saved_characters']} characters saved"
+            )
+        if "scheduler" in snap:
+            sched = snap["scheduler"]
+            lines.append(
+                f"{sched['retries']} requests retried, "
+                f"{sched['throttled_seconds']:.1f}s spent throttled"
+            )
+        print("\n".join(lines), file=self.fd)
+
+
+class JsonLinesReporter:
+    # Appends one JSON object per report
+    def __init__(self, fd=sys.stdout):
+        self.fd = fd
+
+    def report(self, snap):
+        snap = dict(snap, time=time.time())
+        print(json.dumps(snap), file=self.fd, flush=True)
+
+
+class PrometheusReporter:
+    # Prometheus text exposition format
+    def __init__(self, fd=sys.stdout, prefix="srttranslate"):
+        self.fd = fd
+        self.prefix = prefix
+
+    def report(self, snap):
+        p = self.prefix
+        out = [
+            f"# TYPE {p}_elapsed_seconds gauge",
+            f"{p}_elapsed_seconds {snap['elapsed']:.6f}",
+            f"# TYPE {p}_phase_seconds counter",
+        ]
+        out += [
+            f'{p}_phase_seconds{{phase="{name}"}} {secs:.6f}'
+            for name, secs in snap["phases"].items()
+        ]
+        for name, value in snap["counters"].items():
+            out += [f"# TYPE {p}_{name}_total counter", f"{p}_{name}_total {value}"]
+
+        latency = snap["latency"]
+        out.append(f"# TYPE {p}_request_latency_seconds histogram")
+        cumulative = 0
+        for bound, n in latency["buckets"]:
+            cumulative += n
+            out.append(
+                f'{p}_request_latency_seconds_bucket{{le="{bound}"}} {cumulative}'
+            )
+        out += [
+            f'{p}_request_latency_seconds_bucket{{le="+Inf"}} {latency["count"]}',
+            f"{p}_request_latency_seconds_sum {latency['sum']:.6f}",
+            f"{p}_request_latency_seconds_count {latency['count']}",
+        ]
+
+        for section in ("cache", "scheduler"):
+            for name, value in snap.get(section, {}).items():
+                out += [
+                    f"# TYPE {p}_{section}_{name} counter",
+                    f"{p}_{section}_{name} {value}",
+                ]
+        print("\n".join(out), file=self.fd)
+
+
+REPORTERS = {
+    "human": HumanReporter,
+    "json": JsonLinesReporter,
+    "prometheus": PrometheusReporter,
+}
+
+
+def rate_limited(fn, interval=0.1, clock=time.monotonic):
+    # Wraps a progressfn(maxchars, chars_to_now) so that it is called at
+    # most once every interval seconds, and always when done.
+    last = [None]
+
+    def wrapper(maxchars, chars_to_now):
+        now = clock()
+        if chars_to_now < maxchars and last[0] is not None and now - last[0] < interval:
+            return
+        last[0] = now
+        fn(maxchars, chars_to_now)
+
+    return wrapper
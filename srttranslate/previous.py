@@ -0,0 +1,56 @@
+from .subtitles import SubtitleFile
+
+
+def pair_texts(source, translation):
+    # Pairs the texts of an earlier source file with those of its
+    # translation. Translations keep the times of the source, so cues are
+    # matched by time, and by position if the times were edited but the
+    # number of cues is the same.
+    source = [sub for sub in source if sub.text]
+    translation = [sub for sub in translation if sub.text]
+    by_time = {(sub.start_ms, sub.end_ms): sub for sub in translation}
+    same_length = len(source) == len(translation)
+    pairs = {}
+    for i, sub in enumerate(source):
+        translated = by_time.get((sub.start_ms, sub.end_ms))
+        if translated is None and same_length:
+            translated = translation[i]
+        if translated is not None:
+            pairs.setdefault("\n".join(sub.text), "\n".join(translated.text))
+    return pairs
+
+
+class PreviousTranslation:
+    # Translations of an earlier version of the input file. Subtitles whose
+    # text is unchanged, even if their times moved, reuse them instead of
+    # being sent again.
+    def __init__(self):
+        self.entries = {}
+        self.reused = 0
+        self.reused_chars = 0
+
+    @classmethod
+    def from_files(cls, source, translations):
+        # translations is a dict language -> earlier translation of source.
+        # Languages without one are left out.
+        previous = cls()
+        source = SubtitleFile().read(source)
+        for lang, path in translations.items():
+            try:
+                translation = SubtitleFile().read(path)
+            except FileNotFoundError:
+                continue
+            previous.add(lang, source, translation)
+        return previous
+
+    def add(self, lang, source, translation):
+        self.entries.setdefault(lang, {}).update(pair_texts(source, translation))
+        return self
+
+    def get_many(self, lang, texts):
+        # Returns a dict text -> translation for the texts seen before
+        entries = self.entries.get(lang, {})
+        found = {txt: entries[txt] for txt in texts if txt in entries}
+        self.reused += len(found)
+        self.reused_chars += sum(len(txt) for txt in found)
+        return found
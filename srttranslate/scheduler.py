@@ -0,0 +1,174 @@
+import time
+import random
+import threading
+
+DEFAULT_MAX_RETRIES = 6
+DEFAULT_BASE_DELAY = 0.5  # seconds
+DEFAULT_MAX_DELAY = 60.0  # seconds
+DEFAULT_CONCURRENCY = 8
+DEFAULT_MAX_CONCURRENCY = 32
+
+
+class TokenBucket:
+    # rate tokens per second, up to capacity tokens saved up
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.clock = clock
+        self.stamp = clock()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount=1):
+        # Takes amount tokens, possibly going into debt. Returns how many
+        # seconds the caller has to wait before using them.
+        with self.lock:
+            now = self.clock()
+            elapsed = now - self.stamp
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.stamp = now
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+
+class AimdLimiter:
+    # Limits the number of requests in flight. The limit grows by one
+    # every limit successful requests (additive increase) and is cut by
+    # decrease when the service throttles us (multiplicative decrease).
+    def __init__(
+        self,
+        limit=DEFAULT_CONCURRENCY,
+        min_limit=1,
+        max_limit=DEFAULT_MAX_CONCURRENCY,
+        decrease=0.5,
+    ):
+        self.limit = float(limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.in_flight = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+    def on_success(self):
+        with self.cond:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+    def on_throttle(self):
+        with self.cond:
+            self.limit = max(self.min_limit, self.limit * self.decrease)
+
+
+class RetryDecision:
+    # What to do with a failed request. retry_after, if known, is how many
+    # seconds the service asked us to wait.
+    def __init__(self, retry=False, throttled=False, retry_after=None):
+        self.retry = retry
+        self.throttled = throttled
+        self.retry_after = retry_after
+
+
+def default_classifier(exc):
+    # Exceptions may carry an HTTP status code and a Retry-After value
+    status = getattr(exc, "http_status_code", None) or getattr(exc, "status", None)
+    retry_after = getattr(exc, "retry_after", None)
+    if status == 429:
+        return RetryDecision(True, True, retry_after)
+    if status is not None and 500 <= status < 600:
+        return RetryDecision(True, False, retry_after)
+    if getattr(exc, "should_retry", False):
+        return RetryDecision(True, False, retry_after)
+    return RetryDecision()
+
+
+class RequestScheduler:
+    # Paces requests with token buckets for requests and characters per
+    # second, keeps the number of requests in flight under an AIMD limit
+    # and retries failed requests with exponential backoff and full
+    # jitter, or as long as the service says in Retry-After.
+    def __init__(
+        self,
+        requests_per_sec=None,
+        chars_per_sec=None,
+        max_retries=DEFAULT_MAX_RETRIES,
+        base_delay=DEFAULT_BASE_DELAY,
+        max_delay=DEFAULT_MAX_DELAY,
+        limiter=None,
+        classify=default_classifier,
+        clock=time.monotonic,
+        sleep=time.sleep,
+        rnd=random.random,
+    ):
+        self.request_bucket = None
+        self.char_bucket = None
+        if requests_per_sec:
+            self.request_bucket = TokenBucket(requests_per_sec, clock=clock)
+        if chars_per_sec:
+            self.char_bucket = TokenBucket(chars_per_sec, clock=clock)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limiter = limiter or AimdLimiter()
+        self.classify = classify
+        self.sleep = sleep
+        self.rnd = rnd
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.throttled_time = 0.0
+
+    def _wait(self, seconds):
+        if seconds > 0:
+            with self.lock:
+                self.throttled_time += seconds
+            self.sleep(seconds)
+
+    def backoff(self, attempt):
+        return self.rnd() * min(self.max_delay, self.base_delay * 2**attempt)
+
+    def call(self, fn, nchars=0):
+        attempt = 0
+        while True:
+            wait = 0.0
+            if self.request_bucket is not None:
+                wait = self.request_bucket.reserve(1)
+            if self.char_bucket is not None:
+                wait = max(wait, self.char_bucket.reserve(nchars))
+            self._wait(wait)
+
+            self.limiter.acquire()
+            try:
+                with self.lock:
+                    self.requests += 1
+                result = fn()
+            except Exception as exc:
+                decision = self.classify(exc)
+                if not decision.retry or attempt >= self.max_retries:
+                    raise
+                if decision.throttled:
+                    self.limiter.on_throttle()
+            else:
+                self.limiter.on_success()
+                return result
+            finally:
+                self.limiter.release()
+
+            if decision.retry_after is not None:
+                delay = min(self.max_delay, decision.retry_after)
+            else:
+                delay = self.backoff(attempt)
+            with self.lock:
+                self.retries += 1
+            self._wait(delay)
+            attempt += 1
@@ -1,8 +1,14 @@
+import io
+import os
 import re
+import sys
+import mmap
+import bisect
+import codecs
 import pathlib
+from itertools import accumulate, chain
 
 from collections import namedtuple
-from dataclasses import dataclass
 
 subtpline_ptn = r"""
 (\d{2})   # start - hour
@@ -24,52 +30,341 @@ subtpline_ptn = r"""
 (\d{3})   # end - millisec
 """
 
+SUBTPLINE_RE = re.compile(subtpline_ptn, re.VERBOSE)
+# [[hours:]minutes:]seconds[,milliseconds], a dot is also accepted
+TIME_RE = re.compile(r"^(?:(?:(\d+):)?(\d+):)?(\d+)(?:[,.](\d{1,3}))?$")
+
 Timepoint = namedtuple("Timepoint", ["hour", "minute", "second", "millisecond"])
 
+# File name that reads the subtitles from the standard input
+STDIN = "-"
+# Files from this size (bytes) are mapped in memory instead of read
+MMAP_THRESHOLD = 1 << 20
+# Bytes looked at to guess the encoding of files without a BOM
+SNIFF_SIZE = 1 << 16
+BOMS = (
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+)
+
+
+def sniff_encoding(head):
+    # Returns (encoding, BOM length) guessed from the first bytes of a
+    # file. Without a BOM, UTF-16 shows as every other byte being NUL,
+    # then UTF-8 is tried, then Windows-1252, which leaves a few bytes
+    # undefined, and Latin-1, which decodes anything.
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding, len(bom)
+    half = len(head) // 2
+    if half and head[1::2].count(0) > half // 2:
+        return "utf-16-le", 0
+    if half and head[0::2].count(0) > half // 2:
+        return "utf-16-be", 0
+    for encoding in ("utf-8", "cp1252"):
+        try:
+            # Not final: head may end in the middle of a character
+            codecs.getincrementaldecoder(encoding)().decode(head)
+        except UnicodeDecodeError:
+            continue
+        return encoding, 0
+    return "latin-1", 0
+
+
+def decode(data):
+    # Returns (text, encoding) of the bytes-like data
+    encoding, start = sniff_encoding(bytes(data[:SNIFF_SIZE]))
+    candidates = [encoding]
+    if encoding == "utf-8":
+        # Only the beginning was checked
+        candidates += ["cp1252", "latin-1"]
+    view = memoryview(data)[start:]
+    try:
+        for encoding in candidates:
+            try:
+                return str(view, encoding), encoding
+            except UnicodeDecodeError:
+                if encoding == candidates[-1]:
+                    raise
+    finally:
+        view.release()
+
+
+def read_text(fil):
+    # Returns (text, encoding) of the whole content of a file name, STDIN
+    # or a file-like, in one read. Text file-likes are already decoded,
+    # their encoding is returned as None.
+    if isinstance(fil, str) or isinstance(fil, pathlib.Path):
+        if str(fil) == STDIN:
+            return decode(sys.stdin.buffer.read())
+        with open(fil, "rb") as fd:
+            if os.fstat(fd.fileno()).st_size < MMAP_THRESHOLD:
+                return decode(fd.read())
+            with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return decode(mapped)
+    data = fil.read()
+    if isinstance(data, str):
+        return data, None
+    return decode(data)
+
+
+def open_text(fil):
+    # Returns (text stream, opened by us) for reading a file name, STDIN
+    # or a buffered binary file-like line by line, decoded as sniffed from
+    # its first bytes
+    if str(fil) == STDIN:
+        fd, openedbyus = sys.stdin.buffer, False
+    elif isinstance(fil, str) or isinstance(fil, pathlib.Path):
+        fd, openedbyus = open(fil, "rb"), True
+    else:
+        fd, openedbyus = fil, False
+    if hasattr(fd, "peek"):
+        head = fd.peek(SNIFF_SIZE)
+    else:
+        head = fd.read(SNIFF_SIZE)
+        fd.seek(0)
+    encoding, bomlen = sniff_encoding(head)
+    fd.read(bomlen)
+    # With replacement, in case a guess from the beginning turns out wrong
+    text = io.TextIOWrapper(fd, encoding=encoding, errors="replace")
+    return text, openedbyus
+
 
 def tp_format(tp: Timepoint) -> str:
     return "{0:02}:{1:02}:{2:02},{3:03}".format(*tp)
 
 
-@dataclass
+def tp_to_ms(tp: Timepoint) -> int:
+    return ((tp.hour * 60 + tp.minute) * 60 + tp.second) * 1000 + tp.millisecond
+
+
+def ms_to_tp(ms: int) -> Timepoint:
+    second, millisecond = divmod(ms, 1000)
+    minute, second = divmod(second, 60)
+    hour, minute = divmod(minute, 60)
+    return Timepoint(hour, minute, second, millisecond)
+
+
+def ms_format(ms: int) -> str:
+    return tp_format(ms_to_tp(ms))
+
+
+def parse_time(value: str) -> int:
+    # Milliseconds of a time like 1:02:03,500, 62:03 or 3723.5
+    m = TIME_RE.match(value.strip())
+    if not m:
+        raise ValueError(f"Not a time: {value!r}")
+    hour, minute, second, millisecond = m.groups()
+    seconds = (int(hour or 0) * 60 + int(minute or 0)) * 60 + int(second)
+    return seconds * 1000 + int((millisecond or "0").ljust(3, "0"))
+
+
 class SubtitleRecord:
-    start: Timepoint
-    end: Timepoint
-    text: list = None
+    # Times are kept as integer milliseconds, start and end are also
+    # available as Timepoints. Either can be given to the constructor.
+    __slots__ = ("start_ms", "end_ms", "text")
+
+    def __init__(self, start, end, text: list = None):
+        self.start_ms = start if isinstance(start, int) else tp_to_ms(start)
+        self.end_ms = end if isinstance(end, int) else tp_to_ms(end)
+        self.text = text
+
+    @property
+    def start(self) -> Timepoint:
+        return ms_to_tp(self.start_ms)
+
+    @property
+    def end(self) -> Timepoint:
+        return ms_to_tp(self.end_ms)
 
     def add_line(self, line):
         if self.text is None:
             self.text = []
         self.text.append(line)
 
+    def __eq__(self, other):
+        if not isinstance(other, SubtitleRecord):
+            return NotImplemented
+        return (self.start_ms, self.end_ms, self.text) == (
+            other.start_ms,
+            other.end_ms,
+            other.text,
+        )
+
+    def __repr__(self):
+        return (
+            f"SubtitleRecord(start={self.start!r}, end={self.end!r}, "
+            f"text={self.text!r})"
+        )
+
     def __str__(self):
-        s = f"{tp_format(self.start)} --> {tp_format(self.end)}\n"
+        s = f"{ms_format(self.start_ms)} --> {ms_format(self.end_ms)}\n"
         s += "\n".join(self.text or []) + "\n"
         return s
 
 
+def record_text(sub) -> str:
+    # The text of a record as it is sent for translation
+    return "\n".join(sub.text or [])
+
+
+class TimeIndex:
+    # Records sorted by start time, with the running maximum of their end
+    # times, which is sorted as well. The records overlapping a window are
+    # found by bisecting both lists: those starting before the end of the
+    # window, from the first one that could still be showing at its start.
+    # Only long cues spanning shorter ones are looked at needlessly.
+    def __init__(self, records):
+        self.records = sorted(records, key=lambda sub: (sub.start_ms, sub.end_ms))
+        self.starts = [sub.start_ms for sub in self.records]
+        self.max_ends = list(accumulate((sub.end_ms for sub in self.records), max))
+
+    def __len__(self):
+        return len(self.records)
+
+    def overlapping(self, start_ms, end_ms=None):
+        # Records shown, even partly, from start_ms to end_ms (excluded,
+        # None for the end of the file), in order of start time
+        lo = bisect.bisect_right(self.max_ends, start_ms)
+        hi = len(self.records)
+        if end_ms is not None:
+            hi = bisect.bisect_left(self.starts, end_ms)
+        return [sub for sub in self.records[lo:hi] if sub.end_ms > start_ms]
+
+    def active_at(self, ms):
+        return self.overlapping(ms, ms + 1)
+
+
+class TimeWindow:
+    # The part of a file from start_ms to end_ms (None for the end of the
+    # file): the records shown, even partly, in between. With rebase their
+    # times are moved back by start_ms, for a file that starts there.
+    def __init__(self, start_ms=0, end_ms=None, rebase=False):
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        self.rebase = rebase
+
+    def __repr__(self):
+        return (
+            f"TimeWindow(start_ms={self.start_ms!r}, end_ms={self.end_ms!r}, "
+            f"rebase={self.rebase!r})"
+        )
+
+    def contains(self, sub):
+        return sub.end_ms > self.start_ms and (
+            self.end_ms is None or sub.start_ms < self.end_ms
+        )
+
+    def select(self, sf):
+        # The records of sf in the window, looked up in its time index
+        if hasattr(sf, "time_index"):
+            index = sf.time_index()
+        else:
+            index = TimeIndex(sf)
+        return [
+            self._shift(sub) for sub in index.overlapping(self.start_ms, self.end_ms)
+        ]
+
+    def filter(self, records):
+        # The records in the window, for records read one at a time
+        return (self._shift(sub) for sub in records if self.contains(sub))
+
+    def _shift(self, sub):
+        if not self.rebase or not self.start_ms:
+            return sub
+        return SubtitleRecord(
+            max(0, sub.start_ms - self.start_ms),
+            max(0, sub.end_ms - self.start_ms),
+            sub.text,
+        )
+
+
+class SubtitleWriter:
+    # Writes numbered records one at a time to a file name or file-like.
+    # Files are written under a temporary name and renamed when closed,
+    # so that the destination is either complete or untouched. Without
+    # atomic they are written in place, and show the records as they come.
+    def __init__(self, fd, atomic=True):
+        self.path = self.tmppath = None
+        if isinstance(fd, str) or isinstance(fd, pathlib.Path):
+            self.path = pathlib.Path(fd)
+            if atomic:
+                self.tmppath = self.path.with_name(
+                    f".{self.path.name}.{os.getpid()}.tmp"
+                )
+            fd = (self.tmppath or self.path).open("w")
+            self.openedbyus = True
+        elif hasattr(fd, "write"):
+            self.openedbyus = False
+        else:
+            raise RuntimeError(
+                f"write() needs filename or file-like argument. Got '{fd}'"
+            )
+        self.fd = fd
+        self.count = 0
+
+    def write(self, sub):
+        self.count += 1
+        print(f"{self.count}\n{sub}", file=self.fd)
+
+    def flush(self):
+        self.fd.flush()
+
+    def close(self, discard=False):
+        if not self.openedbyus or self.fd.closed:
+            return
+        self.fd.close()
+        if self.tmppath is None:
+            return
+        if discard:
+            self.tmppath.unlink()
+        else:
+            os.replace(str(self.tmppath), str(self.path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(discard=exc_type is not None)
+
+
 class SubtitleFile:
     def __init__(self):
         self.sublst = []
+        self.encoding = None
+        self._index = None
+        self._indexed = None
 
     def read(self, fil):
-        if isinstance(fil, str) or isinstance(fil, pathlib.Path):
-            fpath = pathlib.Path(fil)
-            fd = fpath.open()
-            openedbyus = True
+        # A file name, STDIN or a file-like is read and decoded at once and
+        # split into lines in one pass; other iterables give their lines
+        if hasattr(fil, "read") or isinstance(fil, (str, pathlib.Path)):
+            text, self.encoding = read_text(fil)
+            fil = iter(text.splitlines())
+        self.sublst.extend(self._read_from_iterable(fil))
+        return self
+
+    @classmethod
+    def iter_records(cls, fil):
+        # Parse records lazily from a file name, STDIN, a binary file-like
+        # or an iterable of lines, for input too long to read at once
+        text = None
+        if isinstance(fil, (str, pathlib.Path, io.BufferedIOBase)):
+            text, openedbyus = open_text(fil)
+            fd = text
         else:
-            try:
-                fd = iter(fil)
-            except TypeError:
-                raise
+            fd = iter(fil)
             openedbyus = False
 
         try:
-            self._read_from_iterable(fd)
+            yield from cls._read_from_iterable(fd)
         finally:
             if openedbyus:
                 fd.close()
-        return self
+            elif text is not None:
+                # Don't let the wrapper close a stream that is not ours
+                text.detach()
 
     @staticmethod
     def check_bom(fd):
@@ -78,60 +373,51 @@ class SubtitleFile:
             return
         fd.seek(0)
 
-    def _read_from_iterable(self, fd):
-        self.check_bom(fd)
+    @classmethod
+    def _read_from_iterable(cls, fd):
+        if hasattr(fd, "read") and hasattr(fd, "seek") and fd.seekable():
+            cls.check_bom(fd)
+        else:
+            first = next(fd, "")
+            fd = chain([first.lstrip("\ufeff")], fd)
+        match = SUBTPLINE_RE.match
         currentsub = None
         for line in fd:
             line = line.strip()
             if not line:
                 if currentsub:
-                    self.sublst.append(currentsub)
+                    yield currentsub
                 currentsub = None
                 continue
 
             if line.isdigit() and not currentsub:
                 continue
 
-            m = re.match(subtpline_ptn, line, re.VERBOSE)
+            # Cheap test before trying the regular expression
+            m = match(line) if "-->" in line else None
             if not m:
                 if currentsub:
                     currentsub.add_line(line)
                 continue
 
             if currentsub:
-                self.sublst.append(currentsub)
+                yield currentsub
 
-            ints = [int(m.group(i)) for i in range(1, 9)]
-            start = Timepoint(*ints[:4])
-            end = Timepoint(*ints[4:])
-            currentsub = SubtitleRecord(start, end)
+            h1, m1, s1, ms1, h2, m2, s2, ms2 = map(int, m.groups())
+            currentsub = SubtitleRecord(
+                ((h1 * 60 + m1) * 60 + s1) * 1000 + ms1,
+                ((h2 * 60 + m2) * 60 + s2) * 1000 + ms2,
+            )
 
         if currentsub:
-            self.sublst.append(currentsub)
+            yield currentsub
 
     def write(self, fd):
-        if isinstance(fd, str) or isinstance(fd, pathlib.Path):
-            fpath = pathlib.Path(fd)
-            fd = fpath.open("w")
-            openedbyus = True
-        elif hasattr(fd, "write"):
-            openedbyus = False
-        else:
-            raise RuntimeError(
-                f"write() needs filename or file-like argument. Got '{fd}'"
-            )
-
-        try:
-            self._write_to_open_file(fd)
-        finally:
-            if openedbyus:
-                fd.close()
+        with SubtitleWriter(fd) as writer:
+            for sub in self:
+                writer.write(sub)
         return self
 
-    def _write_to_open_file(self, fd):
-        for i, sub in enumerate(self, 1):
-            print(f"{i}\n{sub}", file=fd)
-
     def __iter__(self):
         class SubtitleIterator:
             def __init__(slf):
@@ -154,5 +440,24 @@ class SubtitleFile:
         self.sublst = newlist
         return self
 
+    def time_index(self):
+        # Built on first use, and again once records were added or the list
+        # replaced. Times changed in place are not noticed.
+        if (
+            self._index is None
+            or self._indexed is not self.sublst
+            or len(self._index) != len(self.sublst)
+        ):
+            self._index = TimeIndex(self.sublst)
+            self._indexed = self.sublst
+        return self._index
+
+    def active_at(self, ms):
+        # Records shown at ms, in O(log n) plus their number
+        return self.time_index().active_at(ms)
+
+    def overlapping(self, start_ms, end_ms=None):
+        return self.time_index().overlapping(start_ms, end_ms)
+
     def count_content_chars(self):
-        return sum([len("\n".join(sub.text or "")) for sub in self])
+        return sum(len(record_text(sub)) for sub in self)
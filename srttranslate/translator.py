@@ -1,4 +1,20 @@
-from .subtitles import SubtitleFile, SubtitleRecord
+import functools
+from contextlib import ExitStack
+from itertools import islice
+
+from .subtitles import SubtitleFile, SubtitleRecord, SubtitleWriter, record_text
+from .compact import CompactSubtitleFile
+from .metrics import Metrics
+from .merging import DEFAULT_MAX_GAP, group_sentences, join_cues, split_cues
+from .document import choose_engine
+from .accounting import Account, billable_chars
+
+# DeepL accepts up to 50 texts per request and a request body of 128KiB,
+# keep well under the size limit to leave room for the encoding overhead.
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_BATCH_CHARS = 30_000
+# Records translated at a time when streaming
+DEFAULT_WINDOW = 500
 
 
 class TranslatorError(Exception):
@@ -9,56 +25,502 @@ class OutOfQuotaError(TranslatorError):
     pass
 
 
+def make_batches(texts, batch_size=DEFAULT_BATCH_SIZE, batch_chars=DEFAULT_BATCH_CHARS):
+    # Split texts into lists of consecutive indexes, each one holding at
+    # most batch_size texts and batch_chars characters. A text longer than
+    # batch_chars goes into a batch on its own.
+    batch = []
+    nchars = 0
+    for i, txt in enumerate(texts):
+        if batch and (len(batch) >= batch_size or nchars + len(txt) > batch_chars):
+            yield batch
+            batch = []
+            nchars = 0
+        batch.append(i)
+        nchars += len(txt)
+    if batch:
+        yield batch
+
+
+def make_windows(records, window=DEFAULT_WINDOW):
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, window))
+        if not chunk:
+            return
+        yield chunk
+
+
+def run_coroutine(coro):
+    # Runs coro to completion from sync code, on a thread of its own if
+    # the caller is already running an event loop. asyncio and
+    # concurrent.futures are imported where used, they are slow to import
+    # and the command line needs this module to start.
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coro).result()
+
+
 class SrtTranslator:
-    def __init__(self, handler, filename="", progressfn=lambda x, y: None):
+    # The translation itself is asynchronous: batches are awaited
+    # concurrently, at most workers at a time. Handlers may be async
+    # (coroutine translate() and translate_batch()) or sync, in which case
+    # their calls run in a pool of workers threads. SrtTranslator runs all
+    # this on an event loop of its own; AsyncSrtTranslator offers the same
+    # methods as coroutines for callers already running an event loop.
+    def __init__(
+        self,
+        handler,
+        filename="",
+        progressfn=lambda x, y: None,
+        batch_size=DEFAULT_BATCH_SIZE,
+        batch_chars=DEFAULT_BATCH_CHARS,
+        workers=1,
+        cache=None,
+        journal=None,
+        metrics=None,
+        merge_sentences=False,
+        max_gap=DEFAULT_MAX_GAP,
+        previous=None,
+        engine="text",
+        window=None,
+    ):
         self.input = None
         self.input_language = ""
         self.output = {}
         self.handler = handler
         self.progressfn = progressfn
+        self.batch_size = batch_size
+        self.batch_chars = batch_chars
+        self.workers = workers
+        self.cache = cache
+        self.journal = journal
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.merge_sentences = merge_sentences
+        self.max_gap = max_gap
+        self.previous = previous
+        # "text" sends batches of texts, "document" all the texts of a
+        # language as one document, "auto" chooses by their number and size
+        self.engine = engine
+        # A TimeWindow: only its cues are translated and written
+        self.window = window
+        self.progress = {}
+        # Characters billed and requests sent
+        self.account = Account()
+        self._executor = None
         if filename:
             self.add_input_file(filename)
-        self.chars = 0
+
+    @property
+    def chars(self):
+        return self.account.chars
 
     def add_input_file(self, file, language=""):
-        self.input = SubtitleFile().read(file).remove_empty_subtitles()
+        with self.metrics.phase("parse"):
+            self.input = SubtitleFile().read(file).remove_empty_subtitles()
+        self.metrics.count("files")
         self.input_language = language
         return self
 
     def add_input_srt(self, sf, language=""):
-        if not isinstance(sf, SubtitleFile):
+        if not isinstance(sf, (SubtitleFile, CompactSubtitleFile)):
             raise TranslatorError(
                 "SrtTranslator.add_input_srt() needs "
                 f"argument of type SubtitleFile. Got {sf.__class__.__name__}"
             )
         self.input = sf
         self.input_language = language
+        self.metrics.count("files")
         return self
 
+    def _run(self, coro):
+        from concurrent.futures import ThreadPoolExecutor
+
+        if self.workers <= 1:
+            return run_coroutine(coro)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            self._executor = pool
+            try:
+                return run_coroutine(coro)
+            finally:
+                self._executor = None
+
     def translate(self, to_lang="EN-GB"):
-        if not self.input:
+        # to_lang is a language or a list of languages, all of them are
+        # translated concurrently from the same input
+        return self._run(self._translate(to_lang))
+
+    def translate_stream(self, file, outfiles, language="", window=DEFAULT_WINDOW):
+        # Streaming counterpart of add_input_file(), translate() and write().
+        # Records are parsed lazily from file, translated window records at
+        # a time and written to outfiles, a dict language -> file name or
+        # file-like, as soon as each window is done. Neither input nor
+        # output are kept in memory.
+        return self._run(self._translate_stream(file, outfiles, language, window))
+
+    def plan(self, to_lang="EN-GB", stream=False, window=DEFAULT_WINDOW):
+        # What translate() would send, or with stream translate_stream()
+        # window records at a time, worked out from the input, journal,
+        # previous translation, cache and batching without sending
+        # anything: returns an Account of the characters billed and the
+        # requests. Without a handler DeepL's is assumed. Merged sentences
+        # that can't be split back and go out again a cue at a time are not
+        # foreseen.
+        if self.input is None:
+            raise TranslatorError("SrtTranslator.plan() called with no input file")
+        to_langs = self._languages(to_lang)
+        if not stream:
+            windows = [self._records()]
+        else:
+            # In file order, as translate_stream() reads them
+            records = (sub for sub in self.input if sub.text)
+            if self.window is not None:
+                records = self.window.filter(records)
+            windows = make_windows(records, window)
+        account = Account(keep_texts=True)
+        sent = {lang: set() for lang in to_langs}
+        for records in windows:
+            _, texts, _ = self._request_texts(records)
+            _, pending = self._lookup(texts, to_langs)
+            if self.cache is not None:
+                # What earlier windows sent is in the cache by then
+                pending = {
+                    lang: [txt for txt in texts if txt not in sent[lang]]
+                    for lang, texts in pending.items()
+                }
+            for lang, batch, engine in self._requests(pending):
+                account.charge(engine, batch, lang)
+                sent[lang].update(batch)
+        return account
+
+    @staticmethod
+    def _languages(to_lang):
+        to_langs = [to_lang] if isinstance(to_lang, str) else to_lang
+        return list(dict.fromkeys(to_langs))
+
+    def _records(self):
+        # The input records to translate
+        if self.window is None:
+            return list(self.input)
+        return self.window.select(self.input)
+
+    async def _translate(self, to_lang):
+        if self.input is None:
             raise TranslatorError("SrtTranslator.translate() called with no input file")
 
-        chars_needed = self.input.count_content_chars()
-        if not self.handler.check_quota(chars_needed):
+        to_langs = self._languages(to_lang)
+        self.progress = {lang: [0, 0] for lang in to_langs}
+        results = await self._translate_records(self._records(), to_langs)
+        for lang, records in results.items():
+            result = self.output[lang] = SubtitleFile()
+            result.sublst = records
+
+        return self
+
+    async def _translate_stream(self, file, outfiles, language, window):
+        self.input_language = language
+        self.metrics.count("files")
+        self.progress = {lang: [0, 0] for lang in outfiles}
+        records = (sub for sub in SubtitleFile.iter_records(file) if sub.text)
+        if self.window is not None:
+            records = self.window.filter(records)
+        with ExitStack() as stack:
+            writers = {
+                # Written in place, so that output appears as it is translated
+                lang: stack.enter_context(SubtitleWriter(outfile, atomic=False))
+                for lang, outfile in outfiles.items()
+            }
+            for window_records in make_windows(records, window):
+                results = await self._translate_records(window_records, list(outfiles))
+                with self.metrics.phase("write"):
+                    for lang, translated in results.items():
+                        for sub in translated:
+                            writers[lang].write(sub)
+                        writers[lang].flush()
+        return self
+
+    def _request_texts(self, records):
+        # Returns the texts of records, the texts to send for them and the
+        # units: None, or with merge_sentences the records of each text
+        # sent. Cues of a sentence go out together, marked up so that the
+        # translation can be split back over them.
+        texts = [record_text(sub) for sub in records]
+        if not self.merge_sentences:
+            return texts, texts, None
+        units = group_sentences(records, self.max_gap)
+        return texts, [join_cues([texts[i] for i in unit]) for unit in units], units
+
+    async def _translate_records(self, records, to_langs):
+        # Returns a dict language -> list of translated records
+        texts, sent, units = self._request_texts(records)
+        self.metrics.count("cues", len(records))
+        if units is None:
+            translations = await self._translate_unique(texts, to_langs)
+        else:
+            unit_sources = [[texts[i] for i in unit] for unit in units]
+            unit_translations = await self._translate_unique(sent, to_langs)
+            translations = {}
+            for lang in to_langs:
+                translations[lang] = [None] * len(texts)
+                separate = []
+                for unit, sources, translated in zip(
+                    units, unit_sources, unit_translations[lang]
+                ):
+                    cues = split_cues(translated, sources)
+                    if cues is None:
+                        separate.extend(unit)
+                        continue
+                    for i, cue in zip(unit, cues):
+                        translations[lang][i] = cue
+                if separate:
+                    # Units that can't be split back go out a cue at a time
+                    found = await self._translate_unique(
+                        [join_cues([texts[i]]) for i in separate], [lang]
+                    )
+                    for i, translated in zip(separate, found[lang]):
+                        translations[lang][i] = split_cues(translated, [texts[i]])[0]
+
+        results = {}
+        for lang in to_langs:
+            results[lang] = [
+                SubtitleRecord(sub.start_ms, sub.end_ms, translated.split("\n"))
+                for sub, translated in zip(records, translations[lang])
+            ]
+        return results
+
+    def _lookup(self, texts, to_langs):
+        # Returns a dict language -> translations of texts found in the
+        # journal, previous translation and cache (None if not found), and
+        # a dict language -> the distinct texts left to send
+        translations = {}
+        pending = {}
+        for lang in to_langs:
+            found = {}
+            if self.journal is not None:
+                found.update(self.journal.get_many(lang, texts))
+            if self.previous is not None:
+                missing = [txt for txt in texts if txt not in found]
+                found.update(self.previous.get_many(lang, missing))
+            if self.cache is not None:
+                missing = [txt for txt in texts if txt not in found]
+                found.update(self.cache.get_many(self.input_language, lang, missing))
+            translations[lang] = [found.get(txt) for txt in texts]
+            # Identical texts are translated once and shared by every cue using them
+            pending[lang] = list(
+                dict.fromkeys(
+                    txt
+                    for txt, translated in zip(texts, translations[lang])
+                    if translated is None
+                )
+            )
+
+        for lang in to_langs:
+            missing = [txt for txt, tr in zip(texts, translations[lang]) if tr is None]
+            self.metrics.count("duplicate_texts", len(missing) - len(pending[lang]))
+            self.metrics.count(
+                "duplicate_characters",
+                sum(len(txt) for txt in missing)
+                - sum(len(txt) for txt in pending[lang]),
+            )
+        return translations, pending
+
+    def _requests(self, pending):
+        # The requests translating pending, a dict language -> texts: a
+        # list of (language, texts, engine), engine "text" or "document"
+        batching = (
+            self.handler is None
+            or getattr(self.handler, "translate_batch", None) is not None
+        )
+        requests = []
+        for lang, texts in pending.items():
+            if self._use_document(texts):
+                requests.append((lang, texts, "document"))
+            elif not batching:
+                requests.extend((lang, [txt], "text") for txt in texts)
+            else:
+                requests.extend(
+                    (lang, [texts[i] for i in batch], "text")
+                    for batch in make_batches(texts, self.batch_size, self.batch_chars)
+                )
+        return requests
+
+    async def _translate_unique(self, texts, to_langs):
+        # Returns a dict language -> list of translations of texts, looking
+        # them up in the journal and cache first and sending each distinct
+        # text only once
+        translations, pending = self._lookup(texts, to_langs)
+        requests = self._requests(pending)
+        needed = {lang: 0 for lang in to_langs}
+        for lang, batch, engine in requests:
+            needed[lang] += billable_chars(batch, engine)
+        with self.metrics.phase("quota"):
+            in_quota = self.handler.check_quota(sum(needed.values()))
+            if hasattr(in_quota, "__await__"):
+                in_quota = await in_quota
+        if not in_quota:
             raise OutOfQuotaError(
                 "No quota."
-                f"\n\tNeeded: {chars_needed}"
+                f"\n\tNeeded: {sum(needed.values())}"
                 f"\n\tAvaliable: {self.handler.limit - self.handler.chars}"
             )
+        for lang in to_langs:
+            self.progress[lang][0] += needed[lang]
+        chars_needed = sum(lang_needed for lang_needed, _ in self.progress.values())
 
-        result = self.output[to_lang] = SubtitleFile()
+        sent_before = self.chars
+        try:
+            with self.metrics.phase("translate"):
+                new_translations = await self._translate_texts(requests, chars_needed)
+        finally:
+            # Quota passed but not used, when a request failed
+            release_quota = getattr(self.handler, "release_quota", None)
+            unused = sum(needed.values()) - (self.chars - sent_before)
+            if release_quota is not None and unused > 0:
+                release_quota(unused)
 
-        for i, sub in enumerate(self.input):
-            txt = "\n".join(sub.text)
-            self.chars += len(txt)
+        for lang in to_langs:
+            translations[lang] = [
+                new_translations[lang][txt] if translated is None else translated
+                for txt, translated in zip(texts, translations[lang])
+            ]
+        return translations
+
+    async def _translate_texts(self, requests, chars_needed):
+        # requests is a list of (language, texts, engine), returns a dict
+        # language -> {text: translation}
+        translators = {
+            "text": self._translate_batch,
+            "document": self._translate_document,
+        }
+        translations = {lang: {} for lang, _, _ in requests}
+
+        def store(lang, texts, engine, results):
+            translations[lang].update(zip(texts, results))
+            if self.journal is not None:
+                self.journal.record(lang, zip(texts, results))
+            if self.cache is not None:
+                self.cache.put_many(self.input_language, lang, zip(texts, results))
+            self.progress[lang][1] += self.account.charge(engine, texts)
             self.progressfn(chars_needed, self.chars)
-            translated = self.handler.translate(self.input_language, to_lang, txt)
-            result.sublst.append(
-                SubtitleRecord(sub.start, sub.end, translated.split("\n"))
+
+        import asyncio
+
+        semaphore = asyncio.Semaphore(max(1, self.workers))
+        failed = []
+
+        async def run(lang, texts, engine):
+            async with semaphore:
+                # No new requests once one has failed
+                if failed:
+                    return
+                try:
+                    results = await translators[engine](lang, texts)
+                except BaseException:
+                    failed.append(lang)
+                    raise
+            store(lang, texts, engine, results)
+
+        tasks = [asyncio.ensure_future(run(*request)) for request in requests]
+        try:
+            # Requests in flight when one fails are paid for: they finish
+            # and their translations are stored before the error goes up
+            outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+        except BaseException:
+            # Cancelled from outside
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                raise outcome
+        return translations
+
+    async def _call(self, fn, *args, **kwargs):
+        # Handler methods that are coroutine functions are awaited, others
+        # run in the worker threads if there are any
+        import asyncio
+
+        if asyncio.iscoroutinefunction(fn):
+            return await fn(*args, **kwargs)
+        if self._executor is None:
+            return fn(*args, **kwargs)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(fn, *args, **kwargs)
+        )
+
+    def _use_document(self, texts):
+        if self.engine == "text" or not texts:
+            return False
+        supported = (
+            self.handler is None
+            or getattr(self.handler, "translate_document", None) is not None
+        )
+        if self.engine == "document":
+            if not supported:
+                raise TranslatorError("The handler can't translate documents")
+            return True
+        nchars = sum(len(txt) for txt in texts)
+        return supported and choose_engine(len(texts), nchars) == "document"
+
+    async def _translate_document(self, to_lang, texts):
+        clock = self.metrics.clock
+        kwargs = {"tag_handling": "xml"} if self.merge_sentences else {}
+        start = clock()
+        results = await self._call(
+            self.handler.translate_document,
+            self.input_language,
+            to_lang,
+            texts,
+            **kwargs,
+        )
+        self.metrics.observe_request(clock() - start, sum(len(txt) for txt in texts))
+        if len(results) != len(texts):
+            raise TranslatorError(
+                f"Handler returned {len(results)} translations "
+                f"for a document of {len(texts)}"
             )
+        return results
 
-        return self
+    async def _translate_batch(self, to_lang, texts):
+        clock = self.metrics.clock
+        # Merged cues carry markup the service must leave alone
+        kwargs = {"tag_handling": "xml"} if self.merge_sentences else {}
+        translate_batch = getattr(self.handler, "translate_batch", None)
+        if translate_batch is None:
+            results = []
+            for txt in texts:
+                start = clock()
+                results.append(
+                    await self._call(
+                        self.handler.translate,
+                        self.input_language,
+                        to_lang,
+                        txt,
+                        **kwargs,
+                    )
+                )
+                self.metrics.observe_request(clock() - start, len(txt))
+            return results
+
+        start = clock()
+        results = await self._call(
+            translate_batch, self.input_language, to_lang, texts, **kwargs
+        )
+        self.metrics.observe_request(clock() - start, sum(len(txt) for txt in texts))
+        if len(results) != len(texts):
+            raise TranslatorError(
+                f"Handler returned {len(results)} translations "
+                f"for a batch of {len(texts)}"
+            )
+        return results
 
     def write(self, to_lang, file):
         output = self.output.get(to_lang)
@@ -66,5 +528,18 @@ class SrtTranslator:
             raise TranslatorError(
                 f'SrtTranslator.write() No output for language "{to_lang}"'
             )
-        output.write(file)
+        with self.metrics.phase("write"):
+            output.write(file)
         return self
+
+
+class AsyncSrtTranslator(SrtTranslator):
+    # SrtTranslator for callers running an event loop, meant for async
+    # handlers. Calls to a sync handler block the loop.
+    async def translate(self, to_lang="EN-GB"):
+        return await self._translate(to_lang)
+
+    async def translate_stream(
+        self, file, outfiles, language="", window=DEFAULT_WINDOW
+    ):
+        return await self._translate_stream(file, outfiles, language, window)
@@ -0,0 +1,184 @@
+import tempfile
+import unittest
+from io import StringIO
+from pathlib import Path
+
+from srttranslate.accounting import Account, billable_chars
+from srttranslate.cache import TranslationCache
+from srttranslate.journal import TranslationJournal
+from srttranslate.main import plan_subtitles, translate_subtitles
+from srttranslate.subtitles import SubtitleFile, TimeWindow
+from srttranslate.translator import SrtTranslator, TranslatorError
+
+from test_translator import (
+    SUBTITLES,
+    DummyHandler,
+    SingleTextHandler,
+    SlowHandler,
+    make_subtitles,
+)
+from test_merging import DIALOGUE, XmlHandler
+from test_document import DocumentHandler
+
+
+class CountingHandler(DummyHandler):
+    # Counts what it is sent, the way DeepL bills it
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.account = Account()
+
+    def translate_batch(self, from_lang, to_lang, texts, **kwargs):
+        self.account.charge("text", texts)
+        return super().translate_batch(from_lang, to_lang, texts, **kwargs)
+
+
+class CountingXmlHandler(CountingHandler, XmlHandler):
+    pass
+
+
+class CountingDocumentHandler(DocumentHandler):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.account = Account()
+
+    def translate_document(self, from_lang, to_lang, texts, tag_handling=None):
+        self.account.charge("document", texts)
+        return super().translate_document(from_lang, to_lang, texts, tag_handling)
+
+
+class AccountingTest(unittest.TestCase):
+    def assertPlanMatchesRun(
+        self, handler, subtitles, langs, stream=False, window=20, **kwargs
+    ):
+        planned = SrtTranslator(None, **kwargs).add_input_file(StringIO(subtitles))
+        plan = planned.plan(langs, stream=stream, window=window)
+        trans = SrtTranslator(handler, **kwargs)
+        if stream:
+            outfiles = {lang: StringIO() for lang in langs}
+            trans.translate_stream(StringIO(subtitles), outfiles, window=window)
+        else:
+            trans.add_input_file(StringIO(subtitles)).translate(langs)
+        self.assertEqual(plan.chars, trans.chars)
+        self.assertEqual(plan.requests, trans.account.requests)
+        self.assertEqual(plan.texts, trans.account.texts)
+        self.assertEqual(trans.chars, handler.account.chars)
+        self.assertEqual(trans.account.requests, handler.account.requests)
+        return plan
+
+    def test_billable_chars(self):
+        self.assertEqual(7, billable_chars(["abc", "defg"]))
+        self.assertEqual(50_000, billable_chars(["abc"], "document"))
+        self.assertEqual(60_000, billable_chars(["a" * 60_000], "document"))
+
+    def test_plan_matches_run(self):
+        subtitles = make_subtitles(120).replace("Line 7\n", "Line 1\n")
+        plan = self.assertPlanMatchesRun(
+            CountingHandler(), subtitles, ["ROT13", "DE"], batch_size=50
+        )
+        self.assertEqual(6, plan.requests)
+        texts = SubtitleFile().read(StringIO(subtitles))
+        duplicate = len("Line 1")
+        self.assertEqual(2 * (texts.count_content_chars() - duplicate), plan.chars)
+
+    def test_plan_with_merged_sentences(self):
+        self.assertPlanMatchesRun(
+            CountingXmlHandler(), DIALOGUE, "ROT13", merge_sentences=True
+        )
+
+    def test_plan_with_document_engine(self):
+        plan = self.assertPlanMatchesRun(
+            CountingDocumentHandler(), make_subtitles(30), "ROT13", engine="document"
+        )
+        self.assertEqual((1, 50_000), (plan.documents, plan.chars))
+
+    def test_plan_with_time_window(self):
+        self.assertPlanMatchesRun(
+            CountingHandler(), SUBTITLES, "ROT13", window=TimeWindow(60_000)
+        )
+
+    def test_plan_without_batch_support(self):
+        trans = SrtTranslator(SingleTextHandler()).add_input_file(StringIO(SUBTITLES))
+        self.assertEqual(3, trans.plan("ROT13").requests)
+        # Without a handler, DeepL's batches are assumed
+        trans = SrtTranslator(None).add_input_file(StringIO(SUBTITLES))
+        self.assertEqual(1, trans.plan("ROT13").requests)
+
+    def test_plan_uses_cache(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        cache = TranslationCache(tmpdir.name)
+        self.addCleanup(cache.close)
+        kwargs = dict(cache=cache, batch_size=10)
+        plan = self.assertPlanMatchesRun(
+            CountingHandler(), make_subtitles(20), "ROT13", **kwargs
+        )
+        self.assertEqual(2, plan.requests)
+        plan = self.assertPlanMatchesRun(
+            CountingHandler(), make_subtitles(25), "ROT13", **kwargs
+        )
+        self.assertEqual((1, 5), (plan.requests, plan.texts))
+
+    def test_plan_streamed(self):
+        # The same texts come back in every window of 20
+        subtitles = "".join(
+            f"{i}\n00:00:{i % 60:02},000 --> 00:00:{i % 60:02},500\nLine {i % 30}\n\n"
+            for i in range(1, 101)
+        )
+        whole = SrtTranslator(None).add_input_file(StringIO(subtitles)).plan("DE")
+        plan = self.assertPlanMatchesRun(
+            CountingHandler(), subtitles, ["DE"], stream=True, batch_size=8
+        )
+        self.assertEqual((5 * 20, 5 * 3), (plan.texts, plan.requests))
+        self.assertEqual(30, whole.texts)
+
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        cache = TranslationCache(tmpdir.name)
+        self.addCleanup(cache.close)
+        plan = self.assertPlanMatchesRun(
+            CountingHandler(), subtitles, ["DE"], stream=True, cache=cache
+        )
+        self.assertEqual(30, plan.texts)
+
+    def test_plan_resumed(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = Path(tmpdir.name) / "a.srt"
+        path.write_text(make_subtitles(30))
+        journal_dir = Path(tmpdir.name) / "journal"
+        journal = TranslationJournal.for_file(journal_dir, path)
+        trans = SrtTranslator(
+            SlowHandler(fail_on="Line 22"), batch_size=5, journal=journal
+        )
+        with self.assertRaises(RuntimeError):
+            trans.add_input_file(path).translate("ROT13")
+        journal.close()
+
+        outfiles = {"ROT13": Path(tmpdir.name) / "a.rot13.srt"}
+        plan = plan_subtitles(path, outfiles, journal_dir=journal_dir, batch_size=5)
+        self.assertEqual(30, plan.texts)
+        plan = plan_subtitles(
+            path, outfiles, journal_dir=journal_dir, resume=True, batch_size=5
+        )
+        self.assertEqual((10, 2), (plan.texts, plan.requests))
+
+        handler = CountingHandler()
+        translate_subtitles(
+            path,
+            outfiles,
+            handler,
+            batch_size=5,
+            journal_dir=journal_dir,
+            resume=True,
+            verbose=False,
+        )
+        self.assertEqual(plan.chars, handler.account.chars)
+        self.assertEqual(plan.requests, handler.account.requests)
+
+    def test_plan_needs_input(self):
+        with self.assertRaises(TranslatorError):
+            SrtTranslator(None).plan("ROT13")
+
+
+if __name__ == "__main__":
+    unittest.main()
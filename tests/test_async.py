@@ -0,0 +1,90 @@
+import asyncio
+import unittest
+from io import StringIO
+
+from srttranslate.translator import (
+    AsyncSrtTranslator,
+    SrtTranslator,
+    OutOfQuotaError,
+)
+
+from test_translator import (
+    SUBTITLES,
+    ROT13_EXPECTED,
+    AsyncDummyHandler,
+    DummyHandler,
+    make_subtitles,
+)
+
+
+class AsyncSingleTextHandler(AsyncDummyHandler):
+    translate_batch = None
+
+
+class AsyncTranslatorTest(unittest.TestCase):
+    def test_translates_on_the_callers_loop(self):
+        async def translate():
+            trans = AsyncSrtTranslator(AsyncDummyHandler())
+            trans.add_input_file(StringIO(SUBTITLES))
+            await trans.translate("ROT13")
+            return trans
+
+        trans = asyncio.run(translate())
+        outfile = StringIO()
+        trans.write("ROT13", outfile)
+        for expected in ROT13_EXPECTED:
+            self.assertIn(expected, outfile.getvalue())
+
+    def test_concurrency_bound(self):
+        handler = AsyncDummyHandler(delay=0.01)
+        trans = AsyncSrtTranslator(handler, batch_size=2, workers=3)
+        trans.add_input_file(StringIO(make_subtitles(40)))
+        asyncio.run(trans.translate(["ROT13", "DE"]))
+        self.assertEqual(40, handler.requests)
+        self.assertEqual(3, handler.max_in_flight)
+        self.assertEqual(["Yvar 40"], trans.output["DE"].sublst[-1].text)
+
+    def test_single_text_handler(self):
+        handler = AsyncSingleTextHandler()
+        trans = AsyncSrtTranslator(handler, workers=4)
+        trans.add_input_file(StringIO(make_subtitles(10)))
+        asyncio.run(trans.translate("ROT13"))
+        self.assertEqual(10, handler.requests)
+        self.assertEqual(["Yvar 1"], trans.output["ROT13"].sublst[0].text)
+
+    def test_async_quota_check(self):
+        trans = AsyncSrtTranslator(AsyncDummyHandler(in_quota=False))
+        trans.add_input_file(StringIO(SUBTITLES))
+        with self.assertRaises(OutOfQuotaError):
+            asyncio.run(trans.translate("ROT13"))
+
+    def test_stream(self):
+        outfile = StringIO()
+        trans = AsyncSrtTranslator(AsyncDummyHandler(), workers=2)
+        asyncio.run(
+            trans.translate_stream(
+                StringIO(make_subtitles(25)), {"ROT13": outfile}, window=10
+            )
+        )
+        self.assertIn(
+            "25\n00:00:25,000 --> 00:00:25,500\nYvar 25\n", outfile.getvalue()
+        )
+
+    def test_sync_translator_with_async_handler(self):
+        handler = AsyncDummyHandler()
+        trans = SrtTranslator(handler, batch_size=5, workers=4)
+        trans.add_input_file(StringIO(make_subtitles(20))).translate("ROT13")
+        self.assertEqual(4, handler.requests)
+        self.assertEqual(["Yvar 20"], trans.output["ROT13"].sublst[-1].text)
+
+    def test_sync_translator_inside_event_loop(self):
+        async def translate():
+            trans = SrtTranslator(DummyHandler(), workers=2)
+            return trans.add_input_file(StringIO(SUBTITLES)).translate("ROT13")
+
+        trans = asyncio.run(translate())
+        self.assertEqual(["Fgneg bs n zbivr"], trans.output["ROT13"].sublst[0].text)
+
+
+if __name__ == "__main__":
+    unittest.main()
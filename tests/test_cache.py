@@ -0,0 +1,117 @@
+import codecs
+import tempfile
+import unittest
+from io import StringIO
+from textwrap import dedent
+
+from srttranslate.cache import TranslationCache
+from srttranslate.translator import SrtTranslator
+
+from test_translator import DummyHandler, make_subtitles
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.clock = Clock()
+        self.cache = TranslationCache(self.tmpdir.name, clock=self.clock)
+
+    def tearDown(self):
+        self.cache.db.close()
+        self.tmpdir.cleanup()
+
+    def test_hits_and_misses(self):
+        self.cache.put_many("FR", "EN-GB", [("Bonjour", "Hello")])
+        found = self.cache.get_many("FR", "EN-GB", ["Bonjour", "Merci", "Bonjour"])
+        self.assertEqual({"Bonjour": "Hello"}, found)
+        self.assertEqual(1, self.cache.hits)
+        self.assertEqual(1, self.cache.misses)
+        self.assertEqual(7, self.cache.saved_chars)
+
+    def test_languages_are_part_of_the_key(self):
+        self.cache.put_many("FR", "EN-GB", [("Bonjour", "Hello")])
+        self.assertEqual({}, self.cache.get_many("FR", "DE", ["Bonjour"]))
+        self.assertEqual({}, self.cache.get_many("", "EN-GB", ["Bonjour"]))
+
+    def test_cache_persists(self):
+        self.cache.put_many("FR", "EN-GB", [("Bonjour", "Hello")])
+        self.cache.close()
+        self.cache = TranslationCache(self.tmpdir.name, clock=self.clock)
+        self.assertEqual(
+            {"Bonjour": "Hello"}, self.cache.get_many("FR", "EN-GB", ["Bonjour"])
+        )
+
+    def test_evict_old_entries(self):
+        self.cache.max_age = 100
+        self.cache.put_many("FR", "EN-GB", [("Bonjour", "Hello")])
+        self.clock.now += 50
+        self.cache.put_many("FR", "EN-GB", [("Merci", "Thanks")])
+        self.clock.now += 60
+        self.cache.evict()
+        self.assertEqual(1, len(self.cache))
+        self.assertEqual({}, self.cache.get_many("FR", "EN-GB", ["Bonjour"]))
+
+    def test_evict_least_recently_used(self):
+        self.cache.max_entries = 2
+        for src, dst in [("Un", "One"), ("Deux", "Two"), ("Trois", "Three")]:
+            self.cache.put_many("FR", "EN-GB", [(src, dst)])
+            self.clock.now += 1
+        self.cache.get_many("FR", "EN-GB", ["Un"])
+        self.cache.evict()
+        found = self.cache.get_many("FR", "EN-GB", ["Un", "Deux", "Trois"])
+        self.assertEqual({"Un": "One", "Trois": "Three"}, found)
+
+    def test_clear(self):
+        self.cache.put_many("FR", "EN-GB", [("Bonjour", "Hello")])
+        self.cache.clear()
+        self.assertEqual(0, len(self.cache))
+
+    def test_translator_uses_cache(self):
+        subtitles = dedent(
+            """
+            1
+            00:00:00,500 --> 00:00:03,000
+            Start of a movie
+
+            2
+            00:01:17,321 --> 00:01:19,742
+            No, use the other door, please
+            """
+        )
+        self.cache.put_many("EN-GB", "ROT13", [("Start of a movie", "cached")])
+        handler = DummyHandler()
+        trans = SrtTranslator(handler, cache=self.cache)
+        trans.add_input_file(StringIO(subtitles), "EN-GB")
+        trans.translate("ROT13")
+
+        texts = [sub.text for sub in trans.output["ROT13"]]
+        rot13 = codecs.encode("No, use the other door, please", "rot13")
+        self.assertEqual([["cached"], [rot13]], texts)
+        self.assertEqual(30, trans.chars)
+
+        handler.requests = 0
+        trans.translate("ROT13")
+        self.assertEqual(0, handler.requests)
+        self.assertEqual(3, self.cache.hits)
+
+    def test_saved_chars_match_deduplicated_run(self):
+        subtitles = make_subtitles(30).replace("Line 2\n", "Line 1\n")
+        first = SrtTranslator(DummyHandler(), cache=self.cache)
+        first.add_input_file(StringIO(subtitles), "EN-GB").translate("ROT13")
+        second = SrtTranslator(DummyHandler(), cache=self.cache)
+        second.add_input_file(StringIO(subtitles), "EN-GB").translate("ROT13")
+        self.assertEqual(0, second.chars)
+        self.assertEqual(29, self.cache.hits)
+        self.assertEqual(first.chars, self.cache.saved_chars)
+
+
+if __name__ == "__main__":
+    unittest.main()
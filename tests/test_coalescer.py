@@ -0,0 +1,100 @@
+import threading
+import unittest
+from io import StringIO
+from contextlib import redirect_stdout
+
+from srttranslate.coalescer import RequestCoalescer
+from srttranslate.main import translate_many
+from srttranslate.translator import SrtTranslator
+
+from test_translator import DummyHandler, SlowHandler
+
+
+def make_file(n, ncues):
+    return "".join(
+        f"{i}\n00:00:{i:02},000 --> 00:00:{i:02},500\nFile {n} line {i}\n\n"
+        for i in range(1, ncues + 1)
+    )
+
+
+class RecordingHandler(DummyHandler):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+
+    def translate_batch(self, from_lang, to_lang, texts):
+        self.batches.append(texts)
+        return super().translate_batch(from_lang, to_lang, texts)
+
+
+class CoalescerTest(unittest.TestCase):
+    def translate_files(self, coalescer, contents):
+        # Translates the files at the same time, returns their translators
+        translators = [SrtTranslator(coalescer) for _ in contents]
+        errors = []
+
+        def work(trans, content):
+            try:
+                trans.add_input_file(StringIO(content)).translate("ROT13")
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [
+            threading.Thread(target=work, args=args)
+            for args in zip(translators, contents)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return translators, errors
+
+    def test_files_share_requests(self):
+        handler = RecordingHandler()
+        coalescer = RequestCoalescer(handler, batch_size=50, max_wait=1.0)
+        contents = [make_file(n, 7) for n in range(10)]
+        translators, errors = self.translate_files(coalescer, contents)
+        self.assertEqual([], errors)
+        # 70 texts, one full request and the rest after max_wait
+        self.assertEqual(2, handler.requests)
+        self.assertEqual([50, 20], [len(texts) for texts in handler.batches])
+        self.assertEqual(2, coalescer.requests)
+        for n, trans in enumerate(translators):
+            texts = [sub.text for sub in trans.output["ROT13"]]
+            expected = [[f"Svyr {n} yvar {i}"] for i in range(1, 8)]
+            self.assertEqual(expected, texts)
+
+    def test_request_limits(self):
+        handler = RecordingHandler()
+        coalescer = RequestCoalescer(handler, batch_size=50, batch_chars=100)
+        translations = coalescer.translate_batch(
+            "EN", "ROT13", [f"Text {i:05}" for i in range(25)]
+        )
+        self.assertEqual("Grkg 00024", translations[-1])
+        self.assertEqual([10, 10, 5], [len(texts) for texts in handler.batches])
+
+    def test_failed_request_fails_its_file(self):
+        handler = SlowHandler(fail_on="File 0 line 3")
+        coalescer = RequestCoalescer(handler, max_wait=1.0)
+        contents = [make_file(n, 3) for n in range(3)]
+        translators, errors = self.translate_files(coalescer, contents)
+        self.assertEqual(1, len(errors))
+        self.assertEqual({}, translators[0].output)
+        for trans in translators[1:]:
+            self.assertEqual(3, len(trans.output["ROT13"].sublst))
+
+    def test_translate_many_requests(self):
+        handler = RecordingHandler()
+        jobs = {}
+        for n in range(20):
+            jobs[StringIO(make_file(n, 9))] = {"ROT13": StringIO()}
+        with redirect_stdout(StringIO()) as out:
+            failed = translate_many(jobs, handler, jobs_in_parallel=20)
+        self.assertEqual([], failed)
+        # 180 texts of 50 per request, a request more if a file came late
+        self.assertLessEqual(handler.requests, 5)
+        self.assertIn(f"in {handler.requests} requests", out.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
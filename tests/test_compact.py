@@ -0,0 +1,67 @@
+import unittest
+from io import StringIO
+from textwrap import dedent
+
+from srttranslate.compact import CompactSubtitleFile
+from srttranslate.subtitles import SubtitleFile
+from srttranslate.translator import SrtTranslator
+
+from test_translator import DummyHandler
+
+SUBTITLES = dedent(
+    """
+    1
+    00:00:00,500 --> 00:00:03,000
+    00:01:12,629 --> 00:01:15,183
+    - Hello, Ms. Wilkins!
+    - Good morning!
+
+
+    00:01:17,321 --> 00:01:19,742
+    No, use the other door, please
+    """
+)
+
+
+class CompactSubtitleTest(unittest.TestCase):
+    def setUp(self):
+        self.sf = SubtitleFile().read(StringIO(SUBTITLES))
+        self.compact = CompactSubtitleFile().read(StringIO(SUBTITLES))
+
+    def test_same_records(self):
+        self.assertEqual(3, len(self.compact))
+        self.assertEqual(list(self.sf), list(self.compact))
+
+    def test_count_chars(self):
+        self.assertEqual(67, self.compact.count_content_chars())
+        self.assertEqual(0, CompactSubtitleFile().count_content_chars())
+
+    def test_remove_empty_subtitles(self):
+        self.sf.remove_empty_subtitles()
+        self.compact.remove_empty_subtitles()
+        self.assertEqual(2, len(self.compact))
+        self.assertEqual(list(self.sf), list(self.compact))
+        self.assertEqual("No, use the other door, please", self.compact.text(1))
+
+    def test_write(self):
+        expected = StringIO()
+        self.sf.write(expected)
+        outfile = StringIO()
+        self.compact.write(outfile)
+        self.assertEqual(expected.getvalue(), outfile.getvalue())
+
+    def test_conversions(self):
+        compact = CompactSubtitleFile.from_subtitle_file(self.sf)
+        self.assertEqual(list(self.sf), list(compact))
+        self.assertEqual(list(self.sf), list(compact.to_subtitle_file()))
+
+    def test_translator_accepts_compact_file(self):
+        trans = SrtTranslator(DummyHandler())
+        trans.add_input_srt(self.compact.remove_empty_subtitles(), "EN-GB")
+        trans.translate("ROT13")
+        texts = [sub.text for sub in trans.output["ROT13"]]
+        self.assertEqual(["- Uryyb, Zf. Jvyxvaf!", "- Tbbq zbeavat!"], texts[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
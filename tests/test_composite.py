@@ -0,0 +1,178 @@
+import time
+import threading
+import unittest
+from io import StringIO
+
+from srttranslate.composite import CompositeHandler
+from srttranslate.translator import OutOfQuotaError, SrtTranslator
+
+from test_translator import DummyHandler, make_subtitles
+
+
+class QuotaError(Exception):
+    pass
+
+
+class Backend(DummyHandler):
+    # Takes delay seconds per request, or slow_delay for the requests
+    # listed in slow (by number), and raises error if given
+    def __init__(self, delay=0.0, slow=(), slow_delay=1.0, error=None, **kwargs):
+        super().__init__(**kwargs)
+        self.delay = delay
+        self.slow = slow
+        self.slow_delay = slow_delay
+        self.error = error
+        self.released = 0
+        self.lock = threading.Lock()
+
+    def translate_batch(self, from_lang, to_lang, texts):
+        with self.lock:
+            self.requests += 1
+            n = self.requests
+        time.sleep(self.slow_delay if n in self.slow else self.delay)
+        if self.error is not None:
+            raise self.error
+        return [txt.upper() for txt in texts]
+
+    def release_quota(self, nchars):
+        self.released += nchars
+
+
+class DocumentBackend(Backend):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.documents = 0
+
+    def translate_document(self, from_lang, to_lang, texts, tag_handling=None):
+        self.documents += 1
+        if self.error is not None:
+            raise self.error
+        return [txt.upper() for txt in texts]
+
+
+class CompositeTest(unittest.TestCase):
+    def composite(self, backends, **kwargs):
+        composite = CompositeHandler(backends, quota_errors=(QuotaError,), **kwargs)
+        self.addCleanup(composite.close)
+        return composite
+
+    def test_hedges_slow_request(self):
+        slow = Backend(slow=[1], slow_delay=2.0)
+        fast = Backend()
+        composite = self.composite([slow, fast], hedge_delay=0.05)
+        start = time.monotonic()
+        self.assertEqual(["HI"], composite.translate_batch("EN", "DE", ["hi"]))
+        self.assertLess(time.monotonic() - start, 1.0)
+        stats = composite.backend_stats()
+        self.assertEqual((1, 1), (stats[1]["hedges"], stats[1]["hedges_won"]))
+
+    def test_hedge_after_latency_percentile(self):
+        primary = Backend(delay=0.01, slow=[6], slow_delay=2.0)
+        backup = Backend(delay=0.01)
+        composite = self.composite([primary, backup], min_samples=5, hedge_delay=10)
+        # Routing is by latency, keep the first backend in front
+        composite.stats[1].latency.observe(5.0)
+        for _ in range(5):
+            composite.translate_batch("EN", "DE", ["a"])
+        self.assertEqual(5, primary.requests)
+        # The 6th request is slow and hedged at the p95 of the first five,
+        # not after hedge_delay
+        start = time.monotonic()
+        composite.translate_batch("EN", "DE", ["a"])
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual(1, composite.backend_stats()[1]["hedges_won"])
+
+    def test_failover_on_error(self):
+        broken = Backend(error=ValueError("down"))
+        working = Backend()
+        composite = self.composite([broken, working])
+        self.assertEqual(["HI"], composite.translate_batch("EN", "DE", ["hi"]))
+        stats = composite.backend_stats()
+        self.assertEqual((1, 1), (stats[0]["requests"], stats[0]["errors"]))
+        self.assertEqual(0, stats[1]["hedges"])
+
+        composite = self.composite([Backend(error=ValueError("down"))])
+        with self.assertRaises(ValueError):
+            composite.translate_batch("EN", "DE", ["hi"])
+
+    def test_failover_on_quota(self):
+        exhausted = Backend(error=QuotaError())
+        working = Backend()
+        composite = self.composite([exhausted, working])
+        composite.translate_batch("EN", "DE", ["hi"])
+        composite.translate_batch("EN", "DE", ["hi"])
+        self.assertEqual(1, exhausted.requests)
+        self.assertEqual(2, working.requests)
+        self.assertTrue(composite.backend_stats()[0]["out_of_quota"])
+
+    def test_check_quota(self):
+        none_left = Backend(in_quota=False)
+        some_left = Backend()
+        composite = self.composite([none_left, some_left])
+        self.assertTrue(composite.check_quota(100))
+        self.assertTrue(composite.backend_stats()[0]["out_of_quota"])
+        composite.release_quota(60)
+        self.assertEqual(60, some_left.released)
+
+        composite = self.composite([Backend(in_quota=False)])
+        self.assertFalse(composite.check_quota(1))
+        with self.assertRaises(OutOfQuotaError):
+            composite.translate_batch("EN", "DE", ["hi"])
+
+    def test_routes_to_fastest(self):
+        slow = Backend(delay=0.05)
+        fast = Backend()
+        composite = self.composite([slow, fast], hedge_delay=10)
+        for _ in range(10):
+            composite.translate_batch("EN", "DE", ["a"])
+        self.assertEqual(1, slow.requests)
+        self.assertEqual(9, fast.requests)
+
+    def test_queued_requests_not_hedged(self):
+        # One thread for six callers: the requests waiting for it are not
+        # late, only those slow once sent would be
+        backends = [Backend(delay=0.05), Backend(delay=0.05)]
+        composite = self.composite(backends, hedge_delay=0.15, threads=1)
+        callers = [
+            threading.Thread(
+                target=composite.translate_batch, args=("EN", "DE", [f"t{i}"])
+            )
+            for i in range(6)
+        ]
+        for caller in callers:
+            caller.start()
+        for caller in callers:
+            caller.join()
+        stats = composite.backend_stats()
+        self.assertEqual(0, sum(backend["hedges"] for backend in stats))
+        self.assertEqual(6, sum(backend.requests for backend in backends))
+
+    def test_documents(self):
+        broken = DocumentBackend(error=QuotaError())
+        working = DocumentBackend()
+        composite = self.composite([broken, working], hedge_delay=0.0)
+        trans = SrtTranslator(composite, engine="document")
+        trans.add_input_file(StringIO(make_subtitles(5)))
+        trans.translate("DE")
+        self.assertEqual((1, 1), (broken.documents, working.documents))
+        self.assertEqual(0, broken.requests + working.requests)
+        self.assertEqual(["LINE 5"], trans.output["DE"].sublst[-1].text)
+        self.assertEqual(0, composite.backend_stats()[1]["hedges"])
+        # Only when every backend translates documents
+        composite = self.composite([DocumentBackend(), Backend()])
+        self.assertFalse(hasattr(composite, "translate_document"))
+
+    def test_translator(self):
+        composite = self.composite([Backend(slow=[2], slow_delay=2.0), Backend()])
+        composite.hedge_delay = 0.05
+        trans = SrtTranslator(composite, batch_size=5, workers=4)
+        trans.add_input_file(StringIO(make_subtitles(20)))
+        start = time.monotonic()
+        trans.translate("DE")
+        self.assertLess(time.monotonic() - start, 1.5)
+        texts = [sub.text for sub in trans.output["DE"]]
+        self.assertEqual([[f"LINE {i}"] for i in range(1, 21)], texts)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,180 @@
+import json
+import pathlib
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from contextlib import redirect_stdout, redirect_stderr
+from io import StringIO
+
+from srttranslate.daemon import (
+    TranslationServer,
+    check_spec,
+    is_loopback,
+    serve_main,
+    submit_job,
+    submit_main,
+)
+
+from test_translator import SUBTITLES, DummyHandler, SlowHandler
+
+
+class BlockingHandler(DummyHandler):
+    # Holds every request until released
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def translate_batch(self, from_lang, to_lang, texts):
+        self.release.wait(10)
+        return super().translate_batch(from_lang, to_lang, texts)
+
+
+class DaemonTest(unittest.TestCase):
+    def start(self, handler, **kwargs):
+        self.server = TranslationServer(
+            handler, ("127.0.0.1", 0), verbose=False, **kwargs
+        )
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server.url
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = pathlib.Path(self.tmpdir.name)
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.stop()
+        self.tmpdir.cleanup()
+
+    def test_translate_file(self):
+        url = self.start(DummyHandler())
+        subfile = self.dir / "film.srt"
+        subfile.write_text(SUBTITLES)
+        outfile = self.dir / "film.rot13.srt"
+        events = []
+        final = submit_job(
+            url,
+            dict(input=str(subfile), outputs={"ROT13": str(outfile)}),
+            events.append,
+        )
+        self.assertEqual("done", final["event"])
+        self.assertEqual("queued", events[0]["event"])
+        self.assertIn("progress", [event["event"] for event in events])
+        self.assertIn("Fgneg bs n zbivr", outfile.read_text())
+
+    def test_translate_source(self):
+        url = self.start(DummyHandler())
+        final = submit_job(url, dict(source=SUBTITLES, langs=["ROT13", "DE"]))
+        self.assertEqual("done", final["event"])
+        self.assertIn("Fgneg bs n zbivr", final["translations"]["DE"])
+
+    def test_bad_job(self):
+        url = self.start(DummyHandler())
+        final = submit_job(url, dict(input="film.srt"))
+        self.assertEqual("failed", final["event"])
+        self.assertIn("outputs", final["error"])
+
+    def test_check_spec(self):
+        self.assertIsNone(check_spec(dict(input="a.srt", outputs={"DE": "a.de.srt"})))
+        self.assertIsNone(check_spec(dict(source="", langs=["DE"])))
+        for spec in (
+            [],
+            dict(input="a.srt", outputs=["a.de.srt"]),
+            dict(input="a.srt", outputs={"DE": 1}),
+            dict(input="a.srt", outputs={}),
+            dict(source="", langs="DE"),
+            dict(source="", langs=[["DE"]]),
+        ):
+            self.assertIsNotNone(check_spec(spec), spec)
+
+    def test_unexpected_error_keeps_worker(self):
+        url = self.start(DummyHandler(), jobs=1)
+        # Passes check_spec, fails opening the input
+        final = submit_job(url, dict(input=str(self.dir), outputs={"DE": "x"}))
+        self.assertEqual("failed", final["event"])
+        final = submit_job(url, dict(source=SUBTITLES, langs=["ROT13"]))
+        self.assertEqual("done", final["event"])
+        self.assertEqual(1, self.server.status()["failed"])
+
+    def test_loopback_only(self):
+        self.assertTrue(is_loopback("127.0.0.1"))
+        self.assertTrue(is_loopback("localhost"))
+        self.assertFalse(is_loopback("0.0.0.0"))
+        self.assertFalse(is_loopback("192.0.2.1"))
+        with redirect_stderr(StringIO()) as err:
+            self.assertEqual(1, serve_main(["--host", "0.0.0.0"]))
+        self.assertIn("not a loopback address", err.getvalue())
+
+    def test_failed_job_keeps_worker(self):
+        url = self.start(SlowHandler(fail_on="Start of a movie"), jobs=1)
+        final = submit_job(url, dict(source=SUBTITLES, langs=["ROT13"]))
+        self.assertEqual("Translation failed", final["error"])
+        final = submit_job(
+            url, dict(source=SUBTITLES.replace("Start", "End"), langs=["ROT13"])
+        )
+        self.assertEqual("done", final["event"])
+        self.assertEqual(1, self.server.status()["failed"])
+
+    def test_queue_full(self):
+        handler = BlockingHandler()
+        url = self.start(handler, jobs=1, queue_size=1)
+        spec = dict(source=SUBTITLES, langs=["ROT13"])
+        results = []
+        clients = [
+            threading.Thread(target=lambda: results.append(submit_job(url, spec)))
+            for _ in range(2)
+        ]
+        for client in clients:
+            client.start()
+        while self.server.status()["running"] + self.server.status()["queued"] < 2:
+            threading.Event().wait(0.01)
+
+        request = urllib.request.Request(
+            f"{url}/jobs", json.dumps(spec).encode(), method="POST"
+        )
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            urllib.request.urlopen(request)
+        self.assertEqual(503, cm.exception.code)
+        cm.exception.close()
+
+        handler.release.set()
+        for client in clients:
+            client.join()
+        self.assertEqual(["done", "done"], [final["event"] for final in results])
+
+    def test_submit_command(self):
+        url = self.start(DummyHandler())
+        for name in ("a.srt", "b.srt"):
+            (self.dir / name).write_text(SUBTITLES)
+        with redirect_stdout(StringIO()):
+            status = submit_main(["--url", url, "-l", "DE", str(self.dir)])
+            upload_status = submit_main(
+                ["--url", url, "-u", "-t", "{stem}.up.srt", str(self.dir / "a.srt")]
+            )
+        self.assertEqual(0, status)
+        self.assertEqual(0, upload_status)
+        self.assertIn("Fgneg bs n zbivr", (self.dir / "b.de.srt").read_text())
+        self.assertIn("Fgneg bs n zbivr", (self.dir / "a.up.srt").read_text())
+
+    def test_submit_upload_detects_encoding(self):
+        url = self.start(DummyHandler())
+        source = SUBTITLES.replace("movie", "movie à «Paris»")
+        for encoding in ("utf-16", "utf-16-le", "cp1252"):
+            (self.dir / "a.srt").write_bytes(source.encode(encoding))
+            with redirect_stdout(StringIO()):
+                status = submit_main(
+                    ["--url", url, "-u", "-o", str(self.dir / "a.up.srt"), "-l", "DE"]
+                    + [str(self.dir / "a.srt")]
+                )
+            self.assertEqual(0, status)
+            self.assertIn(
+                "Fgneg bs n zbivr à «Cnevf»", (self.dir / "a.up.srt").read_text()
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
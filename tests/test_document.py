@@ -0,0 +1,128 @@
+import os
+import sys
+import unittest
+from io import StringIO
+from unittest import mock
+
+from srttranslate.deeplhandler import DeeplHandler
+from srttranslate.document import choose_engine, from_document, to_document
+from srttranslate.translator import SrtTranslator, TranslatorError
+
+from test_translator import DummyHandler, make_subtitles
+from test_merging import DIALOGUE, XmlHandler
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(TOP_DIR, "benchmarks"))
+
+from fake_deepl import rot13, start_server  # noqa: E402
+
+
+class DocumentHandler(DummyHandler):
+    # Translates documents the way the fake DeepL server does
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.documents = 0
+
+    def translate_document(self, from_lang, to_lang, texts, tag_handling=None):
+        self.documents += 1
+        document = rot13(to_document(texts, tag_handling), "xml")
+        return from_document(document, len(texts), tag_handling)
+
+
+class XmlDocumentHandler(XmlHandler, DocumentHandler):
+    pass
+
+
+class DocumentTest(unittest.TestCase):
+    def test_round_trip(self):
+        texts = ["Tom & <Jerry>", "two\nlines", ""]
+        document = to_document(texts)
+        self.assertIn('<p id="c0">Tom &amp; &lt;Jerry&gt;</p>', document)
+        self.assertIn('<p id="c1">two<br>lines</p>', document)
+        self.assertEqual(texts, from_document(document, 3))
+
+    def test_translated_markup(self):
+        # Attributes, spacing and tags may change on the way back
+        document = (
+            '<p class="x" id="c1">deux <b>lignes</b><br />ici</p>\n'
+            '<p id="c0">L&#39;un &amp; l&apos;autre</p>'
+        )
+        self.assertEqual(
+            ["L'un & l'autre", "deux lignes\nici"], from_document(document, 2)
+        )
+        with self.assertRaises(ValueError):
+            from_document(document, 3)
+
+    def test_choose_engine(self):
+        self.assertEqual("text", choose_engine(5000, 10_000))
+        self.assertEqual("text", choose_engine(10, 100_000))
+        self.assertEqual("document", choose_engine(2000, 60_000))
+
+    def test_translator_document_engine(self):
+        handler = DocumentHandler()
+        trans = SrtTranslator(handler, engine="document")
+        trans.add_input_file(StringIO(make_subtitles(120)))
+        trans.translate(["ROT13", "DE"])
+        self.assertEqual(2, handler.documents)
+        self.assertEqual(0, handler.requests)
+
+        plain = SrtTranslator(DummyHandler())
+        plain.add_input_file(StringIO(make_subtitles(120)))
+        plain.translate("ROT13")
+        self.assertEqual(list(plain.output["ROT13"]), list(trans.output["ROT13"]))
+        self.assertEqual(trans.output["ROT13"].sublst, trans.output["DE"].sublst)
+
+    def test_translator_document_merged_sentences(self):
+        handler = XmlDocumentHandler()
+        trans = SrtTranslator(handler, engine="document", merge_sentences=True)
+        trans.add_input_file(StringIO(DIALOGUE))
+        trans.translate("ROT13")
+        plain = SrtTranslator(DummyHandler())
+        plain.add_input_file(StringIO(DIALOGUE))
+        plain.translate("ROT13")
+        self.assertEqual(1, handler.documents)
+        self.assertEqual(list(plain.output["ROT13"]), list(trans.output["ROT13"]))
+
+    def test_translator_auto_engine(self):
+        handler = DocumentHandler()
+        with mock.patch.multiple(
+            "srttranslate.document", DOCUMENT_MIN_TEXTS=100, DOCUMENT_MIN_CHARS=500
+        ):
+            SrtTranslator(handler, engine="auto").add_input_file(
+                StringIO(make_subtitles(99))
+            ).translate("ROT13")
+            self.assertEqual((0, 2), (handler.documents, handler.requests))
+            SrtTranslator(handler, engine="auto").add_input_file(
+                StringIO(make_subtitles(100))
+            ).translate("ROT13")
+            self.assertEqual((1, 2), (handler.documents, handler.requests))
+            # Without document support the text engine is used
+            SrtTranslator(DummyHandler(), engine="auto").add_input_file(
+                StringIO(make_subtitles(100))
+            ).translate("ROT13")
+
+        with self.assertRaises(TranslatorError):
+            SrtTranslator(DummyHandler(), engine="document").add_input_file(
+                StringIO(make_subtitles(3))
+            ).translate("ROT13")
+
+    def test_deepl_handler_with_fake_server(self):
+        server = start_server(document_time=0.2)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        handler = DeeplHandler("key", server_url=server.url, poll_interval=0.05)
+        trans = SrtTranslator(handler, engine="document")
+        trans.add_input_file(StringIO(make_subtitles(30).replace("Line", "A & <b>")))
+        trans.translate("DE")
+        texts = [sub.text for sub in trans.output["DE"]]
+        self.assertEqual(["N & <o> 1"], texts[0])
+        self.assertEqual(30, len(texts))
+        self.assertEqual(1, server.stats["document_requests"])
+        self.assertEqual(0, server.stats["translate_requests"])
+        # Billed at least 50000 characters
+        self.assertEqual(50_000, server.stats["characters"])
+        self.assertEqual({}, server.documents)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import time
+import tempfile
+import unittest
+from io import StringIO
+
+from srttranslate.journal import TranslationJournal
+from srttranslate.translator import SrtTranslator
+
+from test_translator import DummyHandler, SlowHandler, make_subtitles
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_record_and_resume(self):
+        journal = TranslationJournal(self.tmpdir.name, "abc")
+        journal.record("DE", [("Yes", "Ja"), ("No", "Nein")])
+        journal.close()
+
+        journal = TranslationJournal(self.tmpdir.name, "abc")
+        self.assertEqual({"Yes": "Ja"}, journal.get_many("DE", ["Yes", "Maybe"]))
+        self.assertEqual({}, journal.get_many("FR", ["Yes"]))
+        self.assertEqual(1, journal.resumed)
+        self.assertEqual(
+            {}, TranslationJournal(self.tmpdir.name, "xyz").get_many("DE", ["Yes"])
+        )
+
+    def test_no_resume_discards_journal(self):
+        journal = TranslationJournal(self.tmpdir.name, "abc")
+        journal.record("DE", [("Yes", "Ja")])
+        journal.close()
+
+        journal = TranslationJournal(self.tmpdir.name, "abc", resume=False)
+        self.assertEqual({}, journal.get_many("DE", ["Yes"]))
+
+    def test_truncated_entry_ignored(self):
+        journal = TranslationJournal(self.tmpdir.name, "abc")
+        journal.record("DE", [("Yes", "Ja")])
+        journal.close()
+        with journal.path("DE").open("a") as fd:
+            fd.write('["No", "Ne')
+
+        journal = TranslationJournal(self.tmpdir.name, "abc")
+        self.assertEqual({"Yes": "Ja"}, journal.get_many("DE", ["Yes", "No"]))
+
+    def test_remove(self):
+        journal = TranslationJournal(self.tmpdir.name, "abc")
+        journal.record("DE", [("Yes", "Ja")])
+        journal.remove()
+        self.assertFalse(journal.path("DE").exists())
+
+    def test_translator_resumes_interrupted_job(self):
+        subtitles = make_subtitles(30)
+        journal = TranslationJournal(self.tmpdir.name, "abc")
+        trans = SrtTranslator(
+            SlowHandler(fail_on="Line 22"), batch_size=5, journal=journal
+        )
+        trans.add_input_file(StringIO(subtitles))
+        with self.assertRaises(RuntimeError):
+            trans.translate("ROT13")
+        journal.close()
+
+        journal = TranslationJournal(self.tmpdir.name, "abc")
+        handler = DummyHandler()
+        trans = SrtTranslator(handler, batch_size=5, journal=journal)
+        trans.add_input_file(StringIO(subtitles)).translate("ROT13")
+        self.assertEqual(20, journal.resumed)
+        self.assertEqual(2, handler.requests)
+        self.assertEqual(["Yvar 30"], trans.output["ROT13"].sublst[-1].text)
+
+    def test_requests_in_flight_journaled_after_failure(self):
+        class FailFirstHandler(DummyHandler):
+            def translate_batch(self, from_lang, to_lang, texts):
+                if "Line 1" in texts:
+                    raise RuntimeError("Translation failed")
+                time.sleep(0.05)
+                return super().translate_batch(from_lang, to_lang, texts)
+
+        journal = TranslationJournal(self.tmpdir.name, "abc")
+        handler = FailFirstHandler()
+        trans = SrtTranslator(handler, batch_size=5, workers=4, journal=journal)
+        trans.add_input_file(StringIO(make_subtitles(40)))
+        with self.assertRaises(RuntimeError):
+            trans.translate("ROT13")
+        journal.close()
+
+        # The three other requests started with the failed one finish and
+        # are journaled, no other request starts
+        self.assertEqual(3, handler.requests)
+        journal = TranslationJournal(self.tmpdir.name, "abc")
+        texts = [f"Line {i}" for i in range(1, 41)]
+        found = journal.get_many("ROT13", texts)
+        self.assertEqual(15, len(found))
+        self.assertEqual(sum(len(txt) for txt in found), trans.chars)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+import sys
+import tempfile
+import unittest
+import subprocess
+from io import StringIO
+from types import SimpleNamespace
+
+from srttranslate.deeplhandler import DeeplHandler
+from srttranslate.ledger import QuotaLedger, account_id
+from srttranslate.translator import SrtTranslator
+
+from test_translator import SlowHandler, make_subtitles
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Usage:
+    # What deepl.Translator.get_usage() returns, as far as used
+    def __init__(self, count, limit):
+        self.character = SimpleNamespace(count=count, limit=limit)
+
+
+class ReleasingHandler(SlowHandler):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.released = 0
+
+    def release_quota(self, nchars):
+        self.released += nchars
+
+
+class LedgerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.clock = Clock()
+        self.ledgers = []
+
+    def tearDown(self):
+        for ledger in self.ledgers:
+            ledger.db.close()
+        self.tmpdir.cleanup()
+
+    def ledger(self, account="acct", **kwargs):
+        # One per process sharing the quota
+        ledger = QuotaLedger(self.tmpdir.name, account, clock=self.clock, **kwargs)
+        self.ledgers.append(ledger)
+        return ledger
+
+    def test_snapshot_ttl(self):
+        ledger = self.ledger(ttl=60)
+        self.assertIsNone(ledger.snapshot())
+        ledger.update(100, 1000)
+        self.assertEqual((100, 1000), self.ledger(ttl=60).snapshot())
+        self.clock.now += 61
+        self.assertIsNone(ledger.snapshot())
+
+    def test_processes_share_quota(self):
+        first = self.ledger().update(100, 1000)
+        second = self.ledger()
+        self.assertTrue(first.reserve(600))
+        self.assertFalse(second.reserve(400))
+        self.assertTrue(second.reserve(300))
+        self.assertEqual((100, 1000, 900), second.usage())
+
+        first.consume(500)
+        first.release(100)
+        self.assertEqual((600, 1000, 300), second.usage())
+        self.assertTrue(second.reserve(100))
+        self.assertFalse(second.reserve(1))
+
+        first.close()
+        self.assertEqual((600, 1000, 400), second.usage())
+
+    def test_accounts_are_separate(self):
+        self.ledger("a").update(900, 1000)
+        other = self.ledger("b").update(0, 1000)
+        self.assertTrue(other.reserve(1000))
+        self.assertNotEqual(account_id("key"), account_id("key", "http://x"))
+
+    def test_dead_process_reservation_expires(self):
+        ledger = self.ledger().update(0, 1000)
+        self.assertTrue(ledger.reserve(1000))
+        proc = subprocess.Popen([sys.executable, "-c", "pass"])
+        proc.wait()
+        ledger.db.execute(
+            "UPDATE reservations SET pid = ? WHERE id = ?",
+            (proc.pid, ledger.reservation),
+        )
+        self.assertTrue(self.ledger().reserve(1000))
+
+    def test_old_reservation_expires(self):
+        ledger = self.ledger(stale_after=100).update(0, 1000)
+        self.assertTrue(ledger.reserve(1000))
+        self.clock.now += 101
+        self.assertTrue(self.ledger(stale_after=100).reserve(1000))
+
+    def test_handler_uses_fresh_snapshot(self):
+        # No usage request is made, the ledger already knows it
+        self.ledger().update(100, 1000)
+        handler = DeeplHandler("key", ledger=self.ledger())
+        self.assertEqual(100, handler.chars)
+        self.assertEqual(1000, handler.limit)
+        self.assertTrue(handler.check_quota(900))
+        self.assertFalse(self.ledger().reserve(1))
+        handler.release_quota(400)
+        self.assertTrue(self.ledger().reserve(400))
+
+    def test_handler_refreshes_stale_usage(self):
+        self.ledger().update(100, 1000)
+        handler = DeeplHandler("key", ledger=self.ledger(ttl=60))
+        lookups = []
+
+        def get_usage():
+            lookups.append(self.clock.now)
+            return Usage(700, 1000)
+
+        handler.transl.get_usage = get_usage
+        self.assertTrue(handler.check_quota(800))
+        self.assertEqual([], lookups)
+        handler.release_quota(800)
+
+        # Meanwhile the account was used elsewhere
+        self.clock.now += 61
+        self.assertFalse(handler.check_quota(800))
+        self.assertEqual([self.clock.now], lookups)
+        self.assertEqual(700, handler.chars)
+        self.assertTrue(handler.check_quota(300))
+        self.assertEqual(1, len(lookups))
+
+    def test_translator_releases_unused_quota(self):
+        handler = ReleasingHandler(fail_on="Line 12")
+        trans = SrtTranslator(handler, batch_size=5)
+        trans.add_input_file(StringIO(make_subtitles(20)))
+        with self.assertRaises(RuntimeError):
+            trans.translate("ROT13")
+        needed = sum(len(f"Line {i}") for i in range(1, 21))
+        self.assertEqual(needed - trans.chars, handler.released)
+        self.assertEqual(sum(len(f"Line {i}") for i in range(1, 11)), trans.chars)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+import os
+import time
+import pathlib
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from contextlib import redirect_stdout, redirect_stderr
+from io import StringIO
+
+from srttranslate.cache import TranslationCache
+from srttranslate.main import (
+    find_subtitle_files,
+    is_up_to_date,
+    main,
+    translate_many,
+)
+from srttranslate.scheduler import RequestScheduler
+
+from test_translator import SUBTITLES, DummyHandler, SlowHandler
+
+
+class ClosingHandler(DummyHandler):
+    def close(self):
+        pass
+
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = pathlib.Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name, txt=SUBTITLES, age=0):
+        path = self.dir / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(txt)
+        if age:
+            mtime = time.time() - age
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def run_main(self, *args):
+        # Returns (exit status, stdout, handler)
+        handler = ClosingHandler()
+        out = StringIO()
+        with mock.patch(
+            "srttranslate.main.make_handler",
+            return_value=(RequestScheduler(), handler),
+        ), mock.patch.dict(os.environ, DEEPL_API_KEY="key"):
+            with redirect_stdout(out), redirect_stderr(StringIO()):
+                status = main(["--cache-dir", str(self.dir / "cache"), *args])
+        return status, out.getvalue(), handler
+
+    def test_find_subtitle_files(self):
+        a = self.write("s1/a.srt")
+        b = self.write("s1/b.srt")
+        self.write("s1/notes.txt")
+        c = self.write("s2/c.fr.srt")
+        self.write("s2/c.en.srt")
+        found = find_subtitle_files(
+            [self.dir / "s1", self.dir / "s2" / "*.fr.srt", a, self.dir / "x.srt"]
+        )
+        self.assertEqual([a, b, c, self.dir / "x.srt"], found)
+
+    def test_is_up_to_date(self):
+        sub = self.write("a.srt", age=100)
+        out = self.write("a.de.srt")
+        self.assertTrue(is_up_to_date(sub, [out]))
+        self.assertFalse(is_up_to_date(sub, [out, self.dir / "a.es.srt"]))
+        self.write("a.srt")
+        os.utime(out, (time.time() - 50, time.time() - 50))
+        self.assertFalse(is_up_to_date(sub, [out]))
+
+    def test_batch_skips_outputs_and_up_to_date_files(self):
+        self.write("a.srt", age=100)
+        self.write("a.de.srt")
+        self.write("b.srt")
+        status, out, handler = self.run_main("-l", "DE", str(self.dir))
+        self.assertEqual(0, status)
+        self.assertIn("1 files up to date.", out)
+        # a.de.srt is an output, not an input to translate into a.de.de.srt
+        self.assertFalse((self.dir / "a.de.de.srt").exists())
+        self.assertIn("Fgneg bs n zbivr", (self.dir / "b.de.srt").read_text())
+        self.assertIn("1 files translated, 0 failed.", out)
+
+        status, out, handler = self.run_main("-l", "DE", "--force", str(self.dir))
+        self.assertIn("2 files translated, 0 failed.", out)
+        self.assertFalse((self.dir / "a.de.de.srt").exists())
+
+    def test_time_window_options(self):
+        sub = self.write("a.srt")
+        out = self.dir / "part.srt"
+        status, _, _ = self.run_main(
+            "--no-cache",
+            "--from",
+            "1:00",
+            "--to",
+            "1:16",
+            "--rebase",
+            "-o",
+            str(out),
+            str(sub),
+        )
+        self.assertEqual(0, status)
+        self.assertEqual(
+            "1\n00:00:12,629 --> 00:00:15,183\n"
+            "- Uryyb, Zf. Jvyxvaf!\n- Tbbq zbeavat!\n\n",
+            out.read_text(),
+        )
+        status, _, _ = self.run_main("--from", "1:00", "--to", "0:30", str(sub))
+        self.assertEqual(1, status)
+
+    def test_plan(self):
+        self.write("a.srt")
+        self.write("b.srt", SUBTITLES.replace("Start of a movie", "Start"))
+        out = StringIO()
+        with mock.patch("srttranslate.main.make_handler") as make_handler:
+            with mock.patch.dict(os.environ, DEEPL_API_KEY=""):
+                with redirect_stdout(out), redirect_stderr(StringIO()):
+                    status = main(["--plan", "--no-cache", "-l", "DE", str(self.dir)])
+        self.assertEqual(0, status)
+        make_handler.assert_not_called()
+        lines = out.getvalue().splitlines()
+        self.assertEqual(f"{self.dir / 'a.srt'}: 83 characters in 1 requests", lines[0])
+        self.assertEqual(f"{self.dir / 'b.srt'}: 72 characters in 1 requests", lines[1])
+        self.assertEqual(
+            "Total: 155 characters in at most 2 requests (1 if fully packed) "
+            "for 2 files.",
+            lines[2],
+        )
+        self.assertEqual([], list(self.dir.glob("*.de.srt")))
+
+    def test_translate_many_reports_every_failure(self):
+        good = self.write("good.srt")
+        bad = self.write("bad.srt", SUBTITLES.replace("Start", "Fail"))
+        missing = self.dir / "missing.srt"
+        jobs = {
+            path: {"ROT13": path.with_suffix(".rot13.srt")}
+            for path in (good, bad, missing)
+        }
+        out = StringIO()
+        err = StringIO()
+        with redirect_stdout(out), redirect_stderr(err):
+            failed = translate_many(jobs, SlowHandler(fail_on="Fail of a movie"))
+        self.assertEqual({bad, missing}, set(failed))
+        self.assertIn("RuntimeError", err.getvalue())
+        self.assertIn("1 files translated, 2 failed.", out.getvalue())
+        self.assertTrue(good.with_suffix(".rot13.srt").exists())
+
+    def test_cache_shared_by_threads(self):
+        cache = TranslationCache(self.dir / "cache")
+        errors = []
+
+        def work(n):
+            try:
+                for i in range(50):
+                    texts = [f"{n} {i}", "shared"]
+                    cache.put_many("EN", "DE", [(txt, txt.upper()) for txt in texts])
+                    found = cache.get_many("EN", "DE", texts)
+                    self.assertEqual({txt: txt.upper() for txt in texts}, found)
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        cache.close()
+        self.assertEqual([], errors)
+        self.assertEqual(8 * 50 * 2, cache.hits)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+import re
+import codecs
+import unittest
+from io import StringIO
+from textwrap import dedent
+
+from srttranslate.merging import group_sentences, join_cues, split_cues
+from srttranslate.subtitles import SubtitleFile
+from srttranslate.translator import SrtTranslator
+
+from test_translator import DummyHandler
+
+DIALOGUE = dedent(
+    """
+    1
+    00:00:01,000 --> 00:00:02,000
+    I told you that
+
+    2
+    00:00:02,100 --> 00:00:03,500
+    we would be late.
+
+    3
+    00:00:03,600 --> 00:00:05,000
+    It's not my fault,
+
+    4
+    00:00:09,000 --> 00:00:10,000
+    the bus & the train
+
+    5
+    00:00:10,200 --> 00:00:11,000
+    were both <i>late</i>.
+    Really!
+    """
+)
+
+MARKUP_RE = re.compile(r"(<[^>]*>|&\w+;)")
+
+
+class XmlHandler(DummyHandler):
+    # rot13 that leaves markup alone, like DeepL with tag_handling="xml"
+    def rot13(self, txt, tag_handling):
+        if tag_handling != "xml":
+            return codecs.encode(txt, "rot13")
+        return "".join(
+            part if MARKUP_RE.fullmatch(part) else codecs.encode(part, "rot13")
+            for part in MARKUP_RE.split(txt)
+        )
+
+    def translate(self, from_lang, to_lang, txt, tag_handling=None):
+        self.requests += 1
+        return self.rot13(txt, tag_handling)
+
+    def translate_batch(self, from_lang, to_lang, texts, tag_handling=None):
+        self.requests += 1
+        self.texts = texts
+        return [self.rot13(txt, tag_handling) for txt in texts]
+
+
+class MergingTest(unittest.TestCase):
+    def setUp(self):
+        self.sf = SubtitleFile().read(StringIO(DIALOGUE))
+
+    def test_group_sentences(self):
+        # 3 does not end a sentence but 4 starts four seconds later
+        self.assertEqual([[0, 1], [2], [3, 4]], group_sentences(self.sf.sublst))
+        self.assertEqual(
+            [[0, 1], [2, 3, 4]], group_sentences(self.sf.sublst, max_gap=5000)
+        )
+        self.assertEqual(
+            [[0], [1], [2], [3], [4]], group_sentences(self.sf.sublst, max_cues=1)
+        )
+
+    def test_join_and_split(self):
+        texts = ["the bus & the train", "were both <i>late</i>.\nReally!"]
+        joined = join_cues(texts)
+        self.assertEqual(
+            "<c>the bus &amp; the train</c>"
+            "<c>were both &lt;i&gt;late&lt;/i&gt;.<br/>Really!</c>",
+            joined,
+        )
+        self.assertEqual(texts, split_cues(joined, texts))
+        self.assertEqual(["a & b"], split_cues(join_cues(["a & b"]), ["a & b"]))
+
+    def test_split_lost_markup(self):
+        # Words are shared out in proportion to the length of the cues
+        sources = ["one two three four five six", "seven eight"]
+        self.assertEqual(
+            ["uno dos tres", "cuatro"], split_cues("uno dos tres cuatro", sources)
+        )
+        self.assertEqual(
+            ["uno dos tres", "cuatro"],
+            split_cues("<c>uno dos tres cuatro</c>", sources),
+        )
+
+    def test_split_fewer_words_than_cues(self):
+        self.assertEqual(
+            ["uno", "dos"], split_cues("uno dos", ["one two three four five", "x"])
+        )
+        self.assertEqual(
+            ["uno", "dos", "tres"], split_cues("uno dos tres", ["", "one two", ""])
+        )
+        self.assertIsNone(split_cues("Oui", ["Yes I", "do"]))
+
+    def test_translator_unsplittable_unit(self):
+        # The cues of a unit that can't be split back are sent one by one
+        class OneWordHandler(XmlHandler):
+            def rot13(self, txt, tag_handling):
+                return "Ah" if "<c>" in txt else super().rot13(txt, tag_handling)
+
+        trans = SrtTranslator(OneWordHandler(), merge_sentences=True)
+        trans.add_input_srt(self.sf, "EN")
+        trans.translate("ROT13")
+        plain = SrtTranslator(DummyHandler())
+        plain.add_input_srt(self.sf, "EN")
+        plain.translate("ROT13")
+        self.assertEqual(list(plain.output["ROT13"]), list(trans.output["ROT13"]))
+
+    def test_translator_merges_sentences(self):
+        handler = XmlHandler()
+        trans = SrtTranslator(handler, merge_sentences=True)
+        trans.add_input_srt(self.sf, "EN")
+        trans.translate("ROT13")
+        self.assertEqual(3, len(handler.texts))
+
+        plain = SrtTranslator(DummyHandler())
+        plain.add_input_srt(self.sf, "EN")
+        plain.translate("ROT13")
+        self.assertEqual(list(plain.output["ROT13"]), list(trans.output["ROT13"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import json
+import unittest
+from io import StringIO
+
+from srttranslate.metrics import (
+    Histogram,
+    Metrics,
+    HumanReporter,
+    JsonLinesReporter,
+    PrometheusReporter,
+    rate_limited,
+)
+from srttranslate.translator import SrtTranslator
+
+from test_translator import DummyHandler, SingleTextHandler, make_subtitles
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class MetricsTest(unittest.TestCase):
+    def test_histogram_percentiles(self):
+        hist = Histogram(bounds=(0.1, 0.2, 0.4))
+        for value in [0.05] * 50 + [0.15] * 40 + [0.3] * 10:
+            hist.observe(value)
+        self.assertAlmostEqual(0.1, hist.percentile(50))
+        self.assertAlmostEqual(0.3, hist.percentile(95))
+        self.assertEqual([50, 40, 10, 0], hist.counts)
+
+    def test_phase_timing(self):
+        clock = FakeClock()
+        metrics = Metrics(clock=clock)
+        with metrics.phase("parse"):
+            clock.now += 2
+        with metrics.phase("parse"):
+            clock.now += 1
+        self.assertEqual(3, metrics.phases["parse"])
+
+    def test_progress_is_rate_limited(self):
+        clock = FakeClock()
+        calls = []
+        progressfn = rate_limited(lambda x, y: calls.append(y), 1.0, clock)
+        for chars in range(1, 11):
+            progressfn(10, chars)
+            clock.now += 0.3
+        self.assertEqual([1, 5, 9, 10], calls)
+
+    def test_translator_metrics(self):
+        subtitles = make_subtitles(10).replace("Line 10", "Line 1")
+        metrics = Metrics()
+        trans = SrtTranslator(SingleTextHandler(), metrics=metrics)
+        trans.add_input_file(StringIO(subtitles)).translate("ROT13")
+
+        self.assertEqual(1, metrics.counters["files"])
+        self.assertEqual(10, metrics.counters["cues"])
+        self.assertEqual(9, metrics.counters["requests"])
+        self.assertEqual(1, metrics.counters["duplicate_texts"])
+        self.assertEqual(6, metrics.counters["duplicate_characters"])
+        self.assertEqual(9, metrics.latency.count)
+
+    def test_reporters(self):
+        metrics = Metrics()
+        trans = SrtTranslator(DummyHandler(), metrics=metrics)
+        trans.add_input_file(StringIO(make_subtitles(3))).translate("ROT13")
+        snap = metrics.snapshot()
+
+        out = StringIO()
+        HumanReporter(out).report(snap)
+        self.assertIn("3 subtitles, 1 requests, 18 characters", out.getvalue())
+
+        out = StringIO()
+        JsonLinesReporter(out).report(snap)
+        JsonLinesReporter(out).report(snap)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertEqual(3, json.loads(lines[0])["counters"]["cues"])
+
+        out = StringIO()
+        PrometheusReporter(out).report(snap)
+        text = out.getvalue()
+        self.assertIn("srttranslate_cues_total 3\n", text)
+        self.assertIn(
+            'srttranslate_request_latency_seconds_bucket{le="+Inf"} 1\n', text
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import unittest
+from io import StringIO
+from textwrap import dedent
+
+from srttranslate.previous import PreviousTranslation, pair_texts
+from srttranslate.subtitles import SubtitleFile
+from srttranslate.translator import SrtTranslator
+
+from test_translator import DummyHandler
+
+OLD_SOURCE = dedent(
+    """
+    1
+    00:00:01,000 --> 00:00:02,000
+    Good morning
+
+    2
+    00:00:03,000 --> 00:00:04,000
+    How are yuo?
+
+    3
+    00:00:05,000 --> 00:00:06,000
+    Fine, thanks
+    """
+)
+
+OLD_TRANSLATION = dedent(
+    """
+    1
+    00:00:01,000 --> 00:00:02,000
+    Buenos días
+
+    2
+    00:00:03,000 --> 00:00:04,000
+    ¿Cómo estás?
+
+    3
+    00:00:05,000 --> 00:00:06,000
+    Bien, gracias
+    """
+)
+
+# Typo fixed, everything half a second later and a subtitle added
+NEW_SOURCE = dedent(
+    """
+    1
+    00:00:01,500 --> 00:00:02,500
+    Good morning
+
+    2
+    00:00:03,500 --> 00:00:04,500
+    How are you?
+
+    3
+    00:00:05,500 --> 00:00:06,500
+    Fine, thanks
+
+    4
+    00:00:07,500 --> 00:00:08,500
+    And you?
+    """
+)
+
+
+class RecordingHandler(DummyHandler):
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    def translate_batch(self, from_lang, to_lang, texts):
+        self.sent.extend(texts)
+        return super().translate_batch(from_lang, to_lang, texts)
+
+
+def read(txt):
+    return SubtitleFile().read(StringIO(txt))
+
+
+class PreviousTranslationTest(unittest.TestCase):
+    def test_pair_by_time(self):
+        translation = read(OLD_TRANSLATION)
+        del translation.sublst[0]
+        self.assertEqual(
+            {"How are yuo?": "¿Cómo estás?", "Fine, thanks": "Bien, gracias"},
+            pair_texts(read(OLD_SOURCE), translation),
+        )
+
+    def test_pair_by_position(self):
+        # Retimed translation with the same number of subtitles
+        retimed = read(OLD_TRANSLATION.replace(",000", ",250"))
+        pairs = pair_texts(read(OLD_SOURCE), retimed)
+        self.assertEqual("Buenos días", pairs["Good morning"])
+
+    def test_only_changed_subtitles_sent(self):
+        previous = PreviousTranslation().add(
+            "ES", read(OLD_SOURCE), read(OLD_TRANSLATION)
+        )
+        handler = RecordingHandler()
+        trans = SrtTranslator(handler, previous=previous)
+        trans.add_input_srt(read(NEW_SOURCE), "EN")
+        trans.translate("ES")
+
+        self.assertEqual(["How are you?", "And you?"], handler.sent)
+        self.assertEqual(len("How are you?And you?"), trans.chars)
+        self.assertEqual(len("Good morningFine, thanks"), previous.reused_chars)
+        output = trans.output["ES"]
+        self.assertEqual(["Buenos días"], output.sublst[0].text)
+        self.assertEqual(1500, output.sublst[0].start_ms)
+        self.assertEqual(["Ubj ner lbh?"], output.sublst[1].text)
+        self.assertEqual(["Bien, gracias"], output.sublst[2].text)
+
+    def test_language_without_previous_translation(self):
+        previous = PreviousTranslation().add(
+            "ES", read(OLD_SOURCE), read(OLD_TRANSLATION)
+        )
+        handler = RecordingHandler()
+        trans = SrtTranslator(handler, previous=previous)
+        trans.add_input_srt(read(NEW_SOURCE), "EN")
+        trans.translate("DE")
+        self.assertEqual(4, len(handler.sent))
+        self.assertEqual(0, previous.reused_chars)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+
+from srttranslate.scheduler import AimdLimiter, RequestScheduler, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class HttpError(Exception):
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        self.http_status_code = status
+        self.retry_after = retry_after
+
+
+class Flaky:
+    # Fails with the given errors, then succeeds
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def make_scheduler(clock, **kwargs):
+    return RequestScheduler(clock=clock, sleep=clock.sleep, rnd=lambda: 1.0, **kwargs)
+
+
+class SchedulerTest(unittest.TestCase):
+    def test_token_bucket(self):
+        clock = FakeClock()
+        bucket = TokenBucket(10, clock=clock)
+        self.assertEqual(0, bucket.reserve(10))
+        self.assertAlmostEqual(0.5, bucket.reserve(5))
+        clock.now += 1.5
+        self.assertEqual(0, bucket.reserve(5))
+
+    def test_requests_are_paced(self):
+        clock = FakeClock()
+        scheduler = make_scheduler(clock, requests_per_sec=2, chars_per_sec=100)
+        for _ in range(4):
+            scheduler.call(lambda: "ok", 50)
+        self.assertAlmostEqual(1.0, clock.now)
+        self.assertAlmostEqual(1.0, scheduler.throttled_time)
+
+    def test_retry_with_exponential_backoff(self):
+        clock = FakeClock()
+        scheduler = make_scheduler(clock, base_delay=1)
+        fn = Flaky(HttpError(503), HttpError(502), HttpError(500))
+        self.assertEqual("ok", scheduler.call(fn))
+        self.assertEqual([1, 2, 4], clock.sleeps)
+        self.assertEqual(3, scheduler.retries)
+        self.assertEqual(4, scheduler.requests)
+
+    def test_retry_after_is_honored(self):
+        clock = FakeClock()
+        scheduler = make_scheduler(clock)
+        scheduler.call(Flaky(HttpError(429, retry_after=7)))
+        self.assertEqual([7], clock.sleeps)
+
+    def test_gives_up_after_max_retries(self):
+        clock = FakeClock()
+        scheduler = make_scheduler(clock, max_retries=2)
+        fn = Flaky(*[HttpError(503)] * 5)
+        with self.assertRaises(HttpError):
+            scheduler.call(fn)
+        self.assertEqual(3, fn.calls)
+
+    def test_no_retry_on_client_errors(self):
+        clock = FakeClock()
+        scheduler = make_scheduler(clock)
+        for status in (400, 403, 456):
+            fn = Flaky(HttpError(status))
+            with self.assertRaises(HttpError):
+                scheduler.call(fn)
+            self.assertEqual(1, fn.calls)
+        self.assertEqual(0, scheduler.retries)
+
+    def test_concurrency_limit_adapts(self):
+        limiter = AimdLimiter(limit=8)
+        clock = FakeClock()
+        scheduler = make_scheduler(clock, limiter=limiter)
+        scheduler.call(Flaky(HttpError(429)))
+        self.assertEqual(4, int(limiter.limit))
+        for _ in range(10):
+            scheduler.call(lambda: "ok")
+        self.assertEqual(6, int(limiter.limit))
+        self.assertEqual(0, limiter.in_flight)
+
+
+if __name__ == "__main__":
+    unittest.main()
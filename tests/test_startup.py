@@ -0,0 +1,39 @@
+import os
+import sys
+import subprocess
+import unittest
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(*args):
+    env = dict(os.environ, PYTHONPATH=TOP_DIR)
+    return subprocess.run(
+        [sys.executable] + list(args),
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+
+
+class StartupTest(unittest.TestCase):
+    def test_no_heavy_imports(self):
+        proc = run_python(
+            "-c",
+            "import sys, srttranslate.main; "
+            "print(' '.join(m for m in ('deepl', 'requests', 'sqlite3', 'asyncio') "
+            "if m in sys.modules))",
+        )
+        self.assertEqual("", proc.stdout.strip(), proc.stderr)
+
+    def test_version(self):
+        with open(os.path.join(TOP_DIR, "srttranslate", "VERSION")) as fd:
+            version = fd.read().strip()
+        proc = run_python("-m", "srttranslate.main", "--version")
+        self.assertEqual(0, proc.returncode, proc.stderr)
+        self.assertIn(version, proc.stdout)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,23 @@
+import io
+import codecs
+import random
+import tempfile
 import unittest
-from io import StringIO
+from unittest import mock
+from pathlib import Path
+from io import StringIO, BytesIO
 from textwrap import dedent
 
-from srttranslate.subtitles import SubtitleFile
+from srttranslate.subtitles import (
+    parse_time,
+    sniff_encoding,
+    SubtitleFile,
+    SubtitleRecord,
+    SubtitleWriter,
+    TimeIndex,
+    TimeWindow,
+    Timepoint,
+)
 
 
 class SubtitleTest(unittest.TestCase):
@@ -239,6 +254,177 @@ class SubtitleTest(unittest.TestCase):
         sf = SubtitleFile().read(subfile)
         self.assertEqual(67, sf.count_content_chars())
 
+    def test_record_times(self):
+        sub = SubtitleRecord(Timepoint(1, 2, 3, 456), 3723999, ["Hello"])
+        self.assertEqual(3723456, sub.start_ms)
+        self.assertEqual(Timepoint(1, 2, 3, 999), sub.end)
+        self.assertEqual(
+            sub, SubtitleRecord(3723456, Timepoint(1, 2, 3, 999), ["Hello"])
+        )
+        self.assertEqual("01:02:03,456 --> 01:02:03,999\nHello\n", str(sub))
+        with self.assertRaises(AttributeError):
+            sub.extra = 1
+
+    def test_timing_line_with_arrow_in_text(self):
+        subfile = StringIO(
+            dedent(
+                """
+             1
+             00:00:00,500 --> 00:00:03,000
+             Go left --> then right
+             """
+            )
+        )
+        sf = SubtitleFile().read(subfile)
+        self.assertEqual(1, len(sf.sublst))
+        self.assertEqual(["Go left --> then right"], sf.sublst[0].text)
+
+    def test_write_file_is_atomic(self):
+        sf = SubtitleFile().read(StringIO("1\n00:00:00,500 --> 00:00:03,000\nHi\n"))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "out.srt"
+            sf.write(path)
+            before = path.read_text()
+
+            with self.assertRaises(ValueError):
+                with SubtitleWriter(path) as writer:
+                    writer.write(sf.sublst[0])
+                    raise ValueError("Translation failed")
+            self.assertEqual(before, path.read_text())
+            self.assertEqual(["out.srt"], [p.name for p in Path(tmpdir).iterdir()])
+
+    def test_sniff_encoding(self):
+        self.assertEqual(("utf-8", 3), sniff_encoding(codecs.BOM_UTF8 + b"1\n"))
+        self.assertEqual(
+            ("utf-16-le", 2), sniff_encoding("\ufeff1\n".encode("utf-16-le"))
+        )
+        self.assertEqual(
+            ("utf-16-be", 0), sniff_encoding("1\n00:00".encode("utf-16-be"))
+        )
+        self.assertEqual(("utf-8", 0), sniff_encoding("Très".encode("utf-8")))
+        self.assertEqual(("cp1252", 0), sniff_encoding("Très “bien”".encode("cp1252")))
+        # 0x81 is not defined in Windows-1252
+        self.assertEqual(("latin-1", 0), sniff_encoding(b"Tr\xe8s\x81"))
+
+
+class EncodingTest(unittest.TestCase):
+    CONTENT = "1\r\n00:00:00,500 --> 00:00:03,000\r\nÇa va, “Amélie”?\r\n\r\n"
+    EXPECTED = [SubtitleRecord(500, 3000, ["Ça va, “Amélie”?"])]
+
+    def encodings(self):
+        yield "utf-8", self.CONTENT.encode("utf-8")
+        yield "utf-8", codecs.BOM_UTF8 + self.CONTENT.encode("utf-8")
+        yield "utf-16-le", self.CONTENT.encode("utf-16")
+        yield "utf-16-be", codecs.BOM_UTF16_BE + self.CONTENT.encode("utf-16-be")
+        yield "utf-16-le", self.CONTENT.encode("utf-16-le")
+        yield "cp1252", self.CONTENT.encode("cp1252")
+        content = self.CONTENT.replace("“", "«").replace("”", "»")
+        yield "latin-1", content.encode("latin-1") + b"\x81"
+
+    def test_read_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "in.srt"
+            for encoding, data in self.encodings():
+                path.write_bytes(data)
+                sf = SubtitleFile().read(path)
+                self.assertEqual(encoding, sf.encoding)
+                if encoding != "latin-1":
+                    self.assertEqual(self.EXPECTED, sf.sublst)
+                self.assertEqual(sf.sublst, SubtitleFile().read(BytesIO(data)).sublst)
+                self.assertEqual(sf.sublst, list(SubtitleFile.iter_records(path)))
+
+    def test_read_mapped_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "in.srt"
+            path.write_bytes(self.CONTENT.encode("utf-16"))
+            with mock.patch("srttranslate.subtitles.MMAP_THRESHOLD", 0):
+                self.assertEqual(self.EXPECTED, SubtitleFile().read(path).sublst)
+
+    def test_read_stdin(self):
+        for _, data in self.encodings():
+            stdin = io.TextIOWrapper(BytesIO(data))
+            with mock.patch("sys.stdin", stdin):
+                sf = SubtitleFile().read("-")
+            self.assertEqual(1, len(sf.sublst))
+            stdin = io.TextIOWrapper(BytesIO(data))
+            with mock.patch("sys.stdin", stdin):
+                self.assertEqual(sf.sublst, list(SubtitleFile.iter_records("-")))
+            self.assertFalse(stdin.closed)
+
+
+class TimeIndexTest(unittest.TestCase):
+    def test_queries_match_linear_scan(self):
+        rnd = random.Random(7)
+        records = []
+        for i in range(300):
+            start = rnd.randrange(100_000)
+            # Mostly short cues, some spanning many others
+            length = rnd.choice([rnd.randrange(1, 3000), rnd.randrange(20_000)])
+            records.append(SubtitleRecord(start, start + length, [f"Cue {i}"]))
+        index = TimeIndex(records)
+
+        def key(sub):
+            return (sub.start_ms, sub.end_ms, sub.text)
+
+        for _ in range(200):
+            start = rnd.randrange(-1000, 110_000)
+            end = start + rnd.randrange(1, 10_000)
+            expected = [
+                sub for sub in records if sub.start_ms < end and sub.end_ms > start
+            ]
+            self.assertEqual(
+                sorted(expected, key=key),
+                sorted(index.overlapping(start, end), key=key),
+            )
+            expected = [sub for sub in records if sub.start_ms <= start < sub.end_ms]
+            self.assertEqual(
+                sorted(expected, key=key), sorted(index.active_at(start), key=key)
+            )
+
+    def test_subtitle_file_index(self):
+        sf = SubtitleFile().read(
+            StringIO(
+                "1\n00:00:01,000 --> 00:00:02,000\nOne\n\n"
+                "2\n00:00:03,000 --> 00:00:05,000\nTwo\n\n"
+                "3\n00:00:04,000 --> 00:00:06,000\nThree\n"
+            )
+        )
+        self.assertEqual([["Two"], ["Three"]], [sub.text for sub in sf.active_at(4500)])
+        self.assertEqual([], sf.active_at(2000))
+        self.assertEqual([["One"], ["Two"]], [s.text for s in sf.overlapping(0, 4000)])
+        self.assertEqual([["Three"]], [s.text for s in sf.overlapping(5000)])
+        # The index follows records added later
+        sf.sublst.append(SubtitleRecord(7000, 8000, ["Four"]))
+        self.assertEqual([["Four"]], [sub.text for sub in sf.active_at(7000)])
+
+    def test_time_window(self):
+        records = [
+            SubtitleRecord(1000, 2000, ["One"]),
+            SubtitleRecord(3000, 5000, ["Two"]),
+            SubtitleRecord(6000, 7000, ["Three"]),
+        ]
+        sf = SubtitleFile()
+        sf.sublst = records
+        window = TimeWindow(4000, 6000)
+        self.assertEqual([records[1]], window.select(sf))
+        self.assertEqual([records[1]], list(window.filter(records)))
+        window = TimeWindow(4000, None, rebase=True)
+        expected = [
+            SubtitleRecord(0, 1000, ["Two"]),
+            SubtitleRecord(2000, 3000, ["Three"]),
+        ]
+        self.assertEqual(expected, window.select(sf))
+        self.assertEqual(expected, list(window.filter(records)))
+
+    def test_parse_time(self):
+        self.assertEqual(3723500, parse_time("01:02:03,500"))
+        self.assertEqual(3723050, parse_time("1:02:03.05"))
+        self.assertEqual(62000, parse_time("1:02"))
+        self.assertEqual(90000, parse_time("90"))
+        for value in ("", "1:2:3:4", "1,2345", "a:00"):
+            with self.assertRaises(ValueError):
+                parse_time(value)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,16 +1,55 @@
+import time
+import asyncio
 import codecs
+import random
+import tempfile
 import unittest
 from io import StringIO
+from pathlib import Path
 from textwrap import dedent
 
-from srttranslate.translator import SrtTranslator, TranslatorError, OutOfQuotaError
-from srttranslate.subtitles import SubtitleFile
+from srttranslate.translator import (
+    SrtTranslator,
+    TranslatorError,
+    OutOfQuotaError,
+    make_batches,
+)
+from srttranslate.subtitles import SubtitleFile, TimeWindow
+
+SUBTITLES = dedent(
+    """
+    1
+    00:00:00,500 --> 00:00:03,000
+    Start of a movie
+
+    2
+    00:01:12,629 --> 00:01:15,183
+    - Hello, Ms. Wilkins!
+    - Good morning!
+
+    3
+    00:01:17,321 --> 00:01:19,742
+    No, use the other door, please
+    """
+)
+
+ROT13_EXPECTED = [
+    "00:00:00,500 --> 00:00:03,000\nFgneg bs n zbivr\n",
+    "00:01:12,629 --> 00:01:15,183\n" "- Uryyb, Zf. Jvyxvaf!\n" "- Tbbq zbeavat!\n",
+    "00:01:17,321 --> 00:01:19,742\n" "Ab, hfr gur bgure qbbe, cyrnfr\n",
+]
 
 
 class DummyHandler:
     # Handlers need:
     #  - a translate() method
+    #  - optionally a translate_batch() method, translating a list of texts
+    #    in one request. Used instead of translate() when present.
+    #  - both take a tag_handling="xml" keyword when the texts carry markup
+    #    to be kept as is (merged sentences)
     #  - a check_quota(x) method, True if nchars is in quota, False if not
+    #  - optionally a release_quota(x) method, called with the characters
+    #    passed by check_quota() that were not sent because of an error
     #  - chars attribute - chars consumed in the period
     #  - limit attribute - max chars allowed in the period
     #
@@ -20,14 +59,74 @@ class DummyHandler:
         self.in_quota = in_quota
         self.chars = chars
         self.limit = limit
+        self.requests = 0
 
     def translate(self, from_lang, to_lang, txt):
+        self.requests += 1
         return codecs.encode(txt, "rot13")
 
+    def translate_batch(self, from_lang, to_lang, texts):
+        self.requests += 1
+        return [codecs.encode(txt, "rot13") for txt in texts]
+
     def check_quota(self, nchars):
         return self.in_quota
 
 
+class AsyncDummyHandler(DummyHandler):
+    # DummyHandler for the async protocol: translate(), translate_batch()
+    # and check_quota() are coroutines. Keeps count of the requests in
+    # flight.
+    def __init__(self, delay=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def request(self):
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+
+    async def translate(self, from_lang, to_lang, txt):
+        await self.request()
+        return codecs.encode(txt, "rot13")
+
+    async def translate_batch(self, from_lang, to_lang, texts):
+        await self.request()
+        return [codecs.encode(txt, "rot13") for txt in texts]
+
+    async def check_quota(self, nchars):
+        return self.in_quota
+
+
+class SingleTextHandler(DummyHandler):
+    # A handler that has no translate_batch()
+    translate_batch = None
+
+
+class SlowHandler(DummyHandler):
+    # Answers out of order, failing on the text given in fail_on
+    def __init__(self, fail_on=None, **kwargs):
+        super().__init__(**kwargs)
+        self.fail_on = fail_on
+
+    def translate_batch(self, from_lang, to_lang, texts):
+        time.sleep(random.uniform(0, 0.01))
+        if self.fail_on in texts:
+            raise RuntimeError("Translation failed")
+        return super().translate_batch(from_lang, to_lang, texts)
+
+
+def make_subtitles(n):
+    return "".join(
+        f"{i}\n00:00:{i % 60:02},000 --> 00:00:{i % 60:02},500\nLine {i}\n\n"
+        for i in range(1, n + 1)
+    )
+
+
 class TestTranslator(unittest.TestCase):
     def test_translator_translates_from_file(self):
         subfile = StringIO(
@@ -138,6 +237,196 @@ class TestTranslator(unittest.TestCase):
         with self.assertRaises(OutOfQuotaError):
             trans.translate("ROT13")
 
+    def test_batches_are_bounded_by_size(self):
+        batches = list(make_batches(["a"] * 7, batch_size=3))
+        self.assertEqual([[0, 1, 2], [3, 4, 5], [6]], batches)
+
+    def test_batches_are_bounded_by_chars(self):
+        texts = ["aaaa", "bb", "cc", "dddddddd", "e"]
+        batches = list(make_batches(texts, batch_chars=6))
+        self.assertEqual([[0, 1], [2], [3], [4]], batches)
+
+    def test_translator_batches_requests(self):
+        handler = DummyHandler()
+        trans = SrtTranslator(handler, batch_size=2)
+        trans.add_input_file(StringIO(SUBTITLES), "EN-GB")
+        trans.translate("ROT13")
+
+        self.assertEqual(2, handler.requests)
+        for xsub, expstr in zip(trans.output["ROT13"], ROT13_EXPECTED):
+            self.assertEqual(str(xsub), expstr)
+
+    def test_translator_without_batch_support(self):
+        handler = SingleTextHandler()
+        trans = SrtTranslator(handler).add_input_file(StringIO(SUBTITLES), "EN-GB")
+        trans.translate("ROT13")
+
+        self.assertEqual(3, handler.requests)
+        for xsub, expstr in zip(trans.output["ROT13"], ROT13_EXPECTED):
+            self.assertEqual(str(xsub), expstr)
+
+    def test_concurrent_translation_keeps_order(self):
+        progress = []
+        trans = SrtTranslator(
+            SlowHandler(),
+            progressfn=lambda x, y: progress.append((x, y)),
+            batch_size=3,
+            workers=4,
+        )
+        trans.add_input_file(StringIO(make_subtitles(40)), "EN-GB")
+        trans.translate("ROT13")
+
+        texts = [sub.text for sub in trans.output["ROT13"]]
+        expected = [[codecs.encode(f"Line {i}", "rot13")] for i in range(1, 41)]
+        self.assertEqual(expected, texts)
+        self.assertEqual(14, len(progress))
+        self.assertEqual(progress[-1][0], progress[-1][1])
+
+    def test_failed_request_leaves_no_output(self):
+        trans = SrtTranslator(SlowHandler(fail_on="Line 17"), batch_size=3, workers=4)
+        trans.add_input_file(StringIO(make_subtitles(40)), "EN-GB")
+        with self.assertRaises(RuntimeError):
+            trans.translate("ROT13")
+        self.assertNotIn("ROT13", trans.output)
+
+    def test_identical_texts_translated_once(self):
+        subtitles = dedent(
+            """
+            1
+            00:00:01,000 --> 00:00:02,000
+            Yes.
+
+            2
+            00:00:03,000 --> 00:00:04,000
+            What?
+
+            3
+            00:00:05,000 --> 00:00:06,000
+            Yes.
+
+            4
+            00:00:07,000 --> 00:00:08,000
+            What?
+            """
+        )
+        handler = SingleTextHandler()
+        trans = SrtTranslator(handler).add_input_file(StringIO(subtitles), "EN-GB")
+        trans.translate("ROT13")
+
+        self.assertEqual(2, handler.requests)
+        self.assertEqual(9, trans.chars)
+        texts = [sub.text for sub in trans.output["ROT13"]]
+        self.assertEqual([["Lrf."], ["Jung?"], ["Lrf."], ["Jung?"]], texts)
+
+    def test_translates_time_window(self):
+        handler = DummyHandler()
+        window = TimeWindow(60_000, 76_000, rebase=True)
+        trans = SrtTranslator(handler, window=window)
+        trans.add_input_file(StringIO(SUBTITLES), "EN-GB")
+        trans.translate("ROT13")
+        out = StringIO()
+        trans.write("ROT13", out)
+        self.assertEqual(
+            "1\n00:00:12,629 --> 00:00:15,183\n- Uryyb, Zf. Jvyxvaf!\n- Tbbq zbeavat!\n\n",
+            out.getvalue(),
+        )
+        self.assertEqual(len("- Hello, Ms. Wilkins!\n- Good morning!"), trans.chars)
+
+        outfile = StringIO()
+        trans = SrtTranslator(handler, window=TimeWindow(73_000))
+        trans.translate_stream(StringIO(SUBTITLES), {"ROT13": outfile}, "EN-GB")
+        self.assertEqual(
+            "1\n" + ROT13_EXPECTED[1] + "\n2\n" + ROT13_EXPECTED[2] + "\n",
+            outfile.getvalue(),
+        )
+
+    def test_quota_check_uses_unique_chars(self):
+        class QuotaHandler(DummyHandler):
+            def check_quota(self, nchars):
+                return self.chars + nchars <= self.limit
+
+        subtitles = (
+            make_subtitles(3).replace("Line 2", "Line 1").replace("Line 3", "Line 1")
+        )
+        trans = SrtTranslator(QuotaHandler(chars=0, limit=6))
+        trans.add_input_file(StringIO(subtitles), "EN-GB")
+        trans.translate("ROT13")
+        self.assertEqual(6, trans.chars)
+
+    def test_translate_several_languages(self):
+        class LangHandler(DummyHandler):
+            def __init__(self):
+                super().__init__()
+                self.quota_checks = []
+
+            def translate_batch(self, from_lang, to_lang, texts):
+                self.requests += 1
+                return [f"{to_lang}:{txt}" for txt in texts]
+
+            def check_quota(self, nchars):
+                self.quota_checks.append(nchars)
+                return True
+
+        handler = LangHandler()
+        trans = SrtTranslator(handler, workers=3)
+        trans.add_input_file(StringIO(SUBTITLES), "EN-GB")
+        trans.translate(["FR", "DE", "ES"])
+
+        self.assertEqual([249], handler.quota_checks)
+        self.assertEqual(3, handler.requests)
+        for lang in ("FR", "DE", "ES"):
+            texts = [sub.text for sub in trans.output[lang]]
+            self.assertEqual([f"{lang}:Start of a movie"], texts[0])
+            self.assertEqual([83, 83], trans.progress[lang])
+
+    def test_translate_stream(self):
+        handler = DummyHandler()
+        expected = StringIO()
+        trans = SrtTranslator(handler).add_input_file(StringIO(make_subtitles(25)))
+        trans.translate("ROT13").write("ROT13", expected)
+
+        handler.requests = 0
+        outfile = StringIO()
+        trans = SrtTranslator(handler)
+        trans.translate_stream(
+            StringIO(make_subtitles(25)), {"ROT13": outfile}, window=10
+        )
+        self.assertEqual(expected.getvalue(), outfile.getvalue())
+        self.assertEqual(3, handler.requests)
+        self.assertIsNone(trans.input)
+
+    def test_translate_stream_writes_as_it_goes(self):
+        outfile = StringIO()
+        written = []
+
+        def lines():
+            for line in StringIO(make_subtitles(6)):
+                written.append(outfile.getvalue().count("-->"))
+                yield line
+
+        trans = SrtTranslator(DummyHandler())
+        trans.translate_stream(lines(), {"ROT13": outfile}, window=2)
+        self.assertEqual(6, outfile.getvalue().count("-->"))
+        self.assertEqual([0, 2, 4], sorted(set(written)))
+
+    def test_translate_stream_writes_file_in_place(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "out.srt"
+            written = []
+
+            def lines():
+                for line in StringIO(make_subtitles(6)):
+                    written.append(path.read_text().count("-->"))
+                    yield line
+
+            trans = SrtTranslator(SlowHandler(fail_on="Line 5"))
+            with self.assertRaises(RuntimeError):
+                trans.translate_stream(lines(), {"ROT13": path}, window=2)
+            self.assertEqual([0, 2, 4], sorted(set(written)))
+            # What was translated before the failure is left in the file
+            self.assertEqual(4, path.read_text().count("-->"))
+            self.assertEqual(["out.srt"], [p.name for p in Path(tmpdir).iterdir()])
+
     def test_empty_in_empty_out(self):
         sf = SubtitleFile()
         trans = SrtTranslator(DummyHandler())